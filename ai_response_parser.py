@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+模型回复解析
+extract_analysis()：从模型回复中取出第一个JSON对象。快速路径直接用 raw_decode 从对象开头解码
+（C实现，忽略代码块标记和对象之后的文字）；失败时单次扫描取出配平的对象，同时修复常见缺陷
+（全角标点、尾随逗号、输出被截断时未闭合的括号）后再解码；
+validate_analysis()：按提示词约定的结构校验并规范化字段（评分范围、紧急程度取值、列表/对象类型）；
+IncrementalFieldScanner：流式输出时逐段输入文本，只扫描新到达的字符，
+跟踪JSON的字符串/转义/嵌套状态，顶层对象的某个字段值完整后立即解析返回，
+不必等待整个回复结束（例如 health_score、urgency 通常在最前面，几秒后才轮到长篇建议）
+"""
+
+import json
+
+# 字符串之外出现时按JSON结构符号处理的全角字符
+FULLWIDTH_PUNCTUATION = {
+    '，': ',', '：': ':', '｛': '{', '｝': '}', '［': '[', '］': ']'
+}
+# 字符串之外出现的全角引号视为JSON引号
+FULLWIDTH_QUOTES = {'“': '”', '＂': '＂'}
+
+URGENCY_VALUES = ('low', 'medium', 'high')
+URGENCY_ALIASES = {'低': 'low', '中': 'medium', '中等': 'medium', '高': 'high', '紧急': 'high'}
+
+# 提示词约定的分析结果结构：字段 -> (类型, 缺失时的默认值)
+ANALYSIS_SCHEMA = {
+    'health_score': ((int, float), 75),
+    'analysis_summary': (str, '基于图像特征的专业农业分析'),
+    'urgency': (str, 'medium'),
+    'crop_type': (dict, None),
+    'growth_stage': (dict, None),
+    'diseases': (list, None),
+    'nutrition_status': (dict, None),
+    'issues': (list, []),
+    'recommendations': (list, ['建议进一步观察', '如有问题请咨询农业专家'])
+}
+
+_DECODER = json.JSONDecoder()
+
+
+class ResponseParseError(ValueError):
+    """模型回复中没有可解析的JSON对象"""
+
+
+def extract_analysis(text):
+    """提取回复中的第一个JSON对象，返回 (数据, 修复项列表)，无法解析时抛出 ResponseParseError"""
+    start = _object_start(text)
+    if start < 0:
+        raise ResponseParseError("回复中没有JSON对象")
+
+    # 快速路径：格式正确的回复一次解码完成
+    if text[start] == '{':
+        try:
+            data, _ = _DECODER.raw_decode(text, start)
+            if isinstance(data, dict):
+                return data, []
+        except ValueError:
+            pass
+
+    # 修复路径：单次扫描取出配平的对象并修复
+    repaired, repairs = repair_json_object(text, start)
+    try:
+        return json.loads(repaired), repairs
+    except ValueError as e:
+        raise ResponseParseError(f"JSON修复后仍无法解析: {e}")
+
+
+def _object_start(text):
+    """第一个看起来是JSON对象开头的花括号位置（之后是引号或右花括号），跳过说明文字中的花括号"""
+    position = 0
+    length = len(text)
+    while position < length:
+        brace = min((index for index in (text.find('{', position), text.find('｛', position)) if index >= 0),
+                    default=-1)
+        if brace < 0:
+            return -1
+        following = _skip_space(text, brace + 1)
+        if following >= length or text[following] in '"“＂}｝':
+            return brace
+        position = brace + 1
+    return -1
+
+
+def repair_json_object(text, start=0):
+    """从start处的左花括号开始扫描一个JSON对象，返回 (修复后的文本, 修复项列表)
+
+    字符串之外：全角标点转换为半角、全角引号转换为半角引号、删除 } 或 ] 前的尾随逗号；
+    字符串之内：未转义的换行和引号转义（引号后面不是 , : } ] 时视为正文中的引号）；
+    回复结束时对象仍未闭合（输出被截断）：回退到最后一个完整成员之后并补全括号
+    """
+    out = []
+    repairs = set()
+    stack = []
+    in_string = False
+    escape = False
+    closing_quote = '"'
+    pending_comma = None  # 字符串外最后一个逗号在out中的位置（后面只有空白时可能是尾随逗号）
+    # 最近一个结构完整的截断点：(out长度, 当时未闭合的括号)，输出被截断时回退到这里
+    safe_point = (0, ())
+    length = len(text)
+    index = start - 1
+
+    while index + 1 < length:
+        index += 1
+        char = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == closing_quote or char == '"':
+                if _ends_string(text, index + 1):
+                    in_string = False
+                    if char != '"':
+                        repairs.add('fullwidth_quotes')
+                        char = '"'
+                elif char == '"':
+                    repairs.add('unescaped_quote')
+                    out.append('\\')
+            elif char == '\n':
+                repairs.add('raw_newline')
+                char = '\\n'
+            out.append(char)
+            continue
+
+        if char in FULLWIDTH_PUNCTUATION:
+            repairs.add('fullwidth_punctuation')
+            char = FULLWIDTH_PUNCTUATION[char]
+        if char in FULLWIDTH_QUOTES:
+            repairs.add('fullwidth_quotes')
+            closing_quote = FULLWIDTH_QUOTES[char]
+            char = '"'
+
+        if char == '"':
+            if closing_quote != '"' and text[index] == '"':
+                closing_quote = '"'
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            out.append(char)
+            pending_comma = None
+            safe_point = (len(out), tuple(stack))
+            continue
+        elif char in '}]':
+            if pending_comma is not None:
+                out[pending_comma] = ''
+                repairs.add('trailing_comma')
+            if stack:
+                stack.pop()
+            out.append(char)
+            pending_comma = None
+            if not stack:
+                break
+            safe_point = (len(out), tuple(stack))
+            continue
+        elif char == ',':
+            safe_point = (len(out), tuple(stack))
+            out.append(char)
+            pending_comma = len(out) - 1
+            continue
+
+        if not char.isspace():
+            pending_comma = None
+        out.append(char)
+
+    if in_string or stack:
+        # 输出被截断：丢弃最后一个不完整的成员，补全仍未闭合的括号
+        repairs.add('truncated')
+        length, open_brackets = safe_point
+        del out[length:]
+        out.extend(reversed(open_brackets))
+    return ''.join(out), sorted(repairs)
+
+
+def _ends_string(text, position):
+    """判断引号是否为字符串的结束引号：之后（跳过空白）是文本结束、} ]，
+    或者是 , : 且再之后是一个JSON值/键的开头（避免把正文中的"xx"，后续文字误判为结束）"""
+    position = _skip_space(text, position)
+    if position >= len(text) or text[position] in '}]｝］':
+        return True
+    if text[position] not in ',:，：':
+        return False
+    position = _skip_space(text, position + 1)
+    return position >= len(text) or text[position] in _VALUE_START
+
+
+def _skip_space(text, position):
+    length = len(text)
+    while position < length and text[position].isspace():
+        position += 1
+    return position
+
+
+_VALUE_START = frozenset('"“＂{[｛［}]｝］-0123456789tfn')
+
+
+def validate_analysis(data):
+    """按约定结构校验并规范化分析结果（原地修改），返回问题列表"""
+    if not isinstance(data, dict):
+        raise ResponseParseError("分析结果不是JSON对象")
+
+    problems = []
+    for field, (expected_type, default) in ANALYSIS_SCHEMA.items():
+        value = data.get(field)
+        if value is None:
+            if default is not None:
+                data[field] = list(default) if isinstance(default, list) else default
+                problems.append(f"missing:{field}")
+            continue
+        if field == 'health_score' and isinstance(value, str):
+            try:
+                value = float(value.strip().rstrip('分'))
+            except ValueError:
+                pass
+        if not isinstance(value, expected_type) or isinstance(value, bool):
+            problems.append(f"type:{field}")
+            data[field] = list(default) if isinstance(default, list) else default
+            if data[field] is None:
+                del data[field]
+            continue
+        data[field] = value
+
+    score = data['health_score']
+    clamped = int(round(min(100, max(0, score))))
+    if clamped != score:
+        problems.append('range:health_score')
+    data['health_score'] = clamped
+
+    urgency = str(data['urgency']).strip().lower()
+    urgency = URGENCY_ALIASES.get(urgency, urgency)
+    if urgency not in URGENCY_VALUES:
+        problems.append('enum:urgency')
+        urgency = 'high' if clamped < 50 else 'medium' if clamped < 75 else 'low'
+    data['urgency'] = urgency
+
+    for field in ('diseases', 'issues'):
+        if field in data:
+            items = [item for item in data[field] if isinstance(item, dict)]
+            if len(items) != len(data[field]):
+                problems.append(f"items:{field}")
+            data[field] = items
+    data['recommendations'] = [str(item) for item in data['recommendations'] if item]
+    return problems
+
+
+def parse_analysis(text):
+    """提取并校验单株分析结果，返回 (数据, 修复项列表, 问题列表)"""
+    data, repairs = extract_analysis(text)
+    return data, repairs, validate_analysis(data)
+
+
+class IncrementalFieldScanner:
+    """增量扫描顶层JSON对象，返回新完成的字段
+
+    回复开头的 ```json 等非JSON内容会被跳过；只处理第一个顶层对象
+    """
+
+    def __init__(self):
+        self._buffer = []  # 从顶层对象开始的全部字符
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.finished = False
+
+        # 当前顶层字段的解析状态
+        self._key = None  # 已读到的字段名
+        self._key_start = None  # 字段名字符串的起始位置
+        self._value_start = None  # 字段值的起始位置（冒号之后）
+        self.fields = {}
+
+    def feed(self, text):
+        """输入一段新文本，返回本段内新完成的顶层字段 {字段名: 值}"""
+        completed = {}
+        if self.finished:
+            return completed
+
+        for char in text:
+            if not self._started:
+                if char != '{':
+                    continue
+                self._started = True
+                self._depth = 1
+                self._buffer.append(char)
+                continue
+
+            position = len(self._buffer)
+            self._buffer.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key is None and self._key_start is not None:
+                        key = self._decode(self._key_start, position + 1)
+                        self._key = key if isinstance(key, str) else None
+                        self._key_start = None
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None and self._value_start is None:
+                    self._key_start = position
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_field(position, completed)
+                    self.finished = True
+                    break
+            elif char == ':' and self._depth == 1 and self._key is not None and self._value_start is None:
+                self._value_start = position + 1
+            elif char == ',' and self._depth == 1:
+                self._complete_field(position, completed)
+
+        return completed
+
+    def _complete_field(self, end, completed):
+        """顶层字段值在end位置结束（逗号或右花括号）"""
+        if self._key is not None and self._value_start is not None:
+            value = self._decode(self._value_start, end)
+            if value is not _INVALID:
+                self.fields[self._key] = value
+                completed[self._key] = value
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+
+    def _decode(self, start, end):
+        try:
+            return json.loads(''.join(self._buffer[start:end]))
+        except ValueError:
+            return _INVALID
+
+    @property
+    def text(self):
+        """目前扫描到的顶层对象文本"""
+        return ''.join(self._buffer)
+
+
+_INVALID = object()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析结果缓存
+以 植株ID + 分析区域的感知哈希(dHash) 为键：同一植株画面变化很小（汉明距离不超过阈值）时
+直接复用上次的分析结果，避免重复调用付费API；
+内存层按TTL过期、按LRU淘汰，可选SQLite磁盘层在后端重启后继续有效
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+DEFAULT_CACHE_CONFIG = {
+    'enabled': True,
+    'max_entries': 256,  # 内存中最多缓存的结果数
+    'ttl': 1800.0,  # 结果有效期（秒）
+    'max_distance': 6,  # 64位dHash允许的最大汉明距离
+    'hash_size': 8,
+    'disk_path': None  # SQLite文件路径，None表示只使用内存缓存
+}
+
+
+def compute_dhash(image, hash_size=8):
+    """计算图像的差值哈希(dHash)，返回 hash_size*hash_size 位整数"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class AnalysisCache:
+    """分析结果缓存 - 内存LRU + TTL，可选SQLite持久化"""
+
+    def __init__(self, max_entries=256, ttl=1800.0, max_distance=6, hash_size=8, disk_path=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.disk_path = disk_path
+
+        self._entries = OrderedDict()  # (plant_id, phash) -> (result, created_at)
+        self._plant_hashes = {}  # plant_id -> {phash, ...}
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+        # 统计信息
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+
+    @classmethod
+    def from_config(cls, config=None):
+        """按配置字典创建缓存，未启用时返回None"""
+        config = dict(DEFAULT_CACHE_CONFIG, **(config or {}))
+        if not config['enabled']:
+            return None
+        return cls(max_entries=config['max_entries'], ttl=config['ttl'], max_distance=config['max_distance'],
+                   hash_size=config['hash_size'], disk_path=config['disk_path'])
+
+    def _open_disk(self, path):
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    plant_id TEXT NOT NULL,
+                    phash TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (plant_id, phash)
+                )
+            ''')
+            # 启动时清理已过期的记录
+            self._db.execute('DELETE FROM analysis_cache WHERE created_at < ?', (time.time() - self.ttl,))
+            self._db.commit()
+            print(f"💾 AI分析结果磁盘缓存: {path}")
+        except sqlite3.Error as e:
+            print(f"❌ 打开AI分析结果磁盘缓存失败: {e}")
+            self._db = None
+
+    def image_hash(self, image):
+        return compute_dhash(image, self.hash_size)
+
+    def get(self, plant_id, phash):
+        """查找同一植株哈希距离在阈值内的有效结果，返回 (结果, 汉明距离) 或 (None, None)"""
+        plant_id = str(plant_id)
+        now = time.time()
+
+        with self._lock:
+            best_key, best_distance = None, None
+            for cached_hash in list(self._plant_hashes.get(plant_id, ())):
+                key = (plant_id, cached_hash)
+                result, created_at = self._entries[key]
+                if now - created_at > self.ttl:
+                    self._remove(key)
+                    self.expired += 1
+                    continue
+                distance = hamming_distance(phash, cached_hash)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.memory_hits += 1
+                return self._entries[best_key][0], best_distance
+
+            result, distance = self._get_from_disk(plant_id, phash, now)
+            if result is not None:
+                self.disk_hits += 1
+                return result, distance
+
+            self.misses += 1
+            return None, None
+
+    def _get_from_disk(self, plant_id, phash, now):
+        if self._db is None:
+            return None, None
+
+        try:
+            rows = self._db.execute(
+                'SELECT phash, result, created_at FROM analysis_cache WHERE plant_id = ? AND created_at >= ?',
+                (plant_id, now - self.ttl)).fetchall()
+        except sqlite3.Error as e:
+            print(f"❌ 读取AI分析结果磁盘缓存失败: {e}")
+            return None, None
+
+        best = None
+        for cached_hex, result_json, created_at in rows:
+            distance = hamming_distance(phash, int(cached_hex, 16))
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, int(cached_hex, 16), result_json, created_at)
+
+        if best is None:
+            return None, None
+
+        distance, cached_hash, result_json, created_at = best
+        result = json.loads(result_json)
+        # 提升到内存层
+        self._store_memory(plant_id, cached_hash, result, created_at)
+        return result, distance
+
+    def put(self, plant_id, phash, result):
+        """缓存一次成功的分析结果"""
+        plant_id = str(plant_id)
+        created_at = time.time()
+
+        with self._lock:
+            self._store_memory(plant_id, phash, result, created_at)
+            self.stores += 1
+
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO analysis_cache (plant_id, phash, result, created_at) VALUES (?, ?, ?, ?)',
+                        (plant_id, format(phash, 'x'), json.dumps(result, ensure_ascii=False), created_at))
+                    self._db.commit()
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    print(f"❌ 写入AI分析结果磁盘缓存失败: {e}")
+
+    def _store_memory(self, plant_id, phash, result, created_at):
+        key = (plant_id, phash)
+        self._entries[key] = (result, created_at)
+        self._entries.move_to_end(key)
+        self._plant_hashes.setdefault(plant_id, set()).add(phash)
+
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        hashes = self._plant_hashes.get(key[0])
+        if hashes is not None:
+            hashes.discard(key[1])
+            if not hashes:
+                del self._plant_hashes[key[0]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._plant_hashes.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM analysis_cache')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'disk': self._db is not None,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'stores': self.stores
+        }
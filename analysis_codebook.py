@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+紧凑分析模式的代码表
+紧凑模式下模型只输出评分、枚举代码和一句摘要，病害/缺素/问题的症状、治疗方案和建议等固定文字
+不再由模型逐项生成（输出token数决定了大部分延迟），而是由前端按本代码表在本地展开；
+代码表在客户端连接时随 connection_established 下发，提示词中的代码列表也由本表生成，两者始终一致
+"""
+
+from ai_response_parser import URGENCY_ALIASES, URGENCY_VALUES
+
+CODEBOOK_VERSION = 1
+
+# 严重程度/紧急程度代码
+SEVERITY_CODES = {'L': 'low', 'M': 'medium', 'H': 'high'}
+
+CROP_CODES = {
+    'LV': {'name': '叶菜类（生菜/菠菜/白菜）', 'characteristics': '叶片较薄，边缘清晰，浅绿色为主'},
+    'FV': {'name': '果菜类（番茄/辣椒/茄子）', 'characteristics': '叶片厚实，深绿色为主，可能有果实结构'},
+    'RT': {'name': '根茎类（萝卜/胡萝卜）', 'characteristics': '地上部分绿色适中，可能有块根结构'},
+    'GR': {'name': '禾本科（小麦/水稻/玉米）', 'characteristics': '叶片细长，边缘线条明显'},
+    'LG': {'name': '豆类（大豆/豌豆）', 'characteristics': '复叶结构，叶片圆润，可能有豆荚'},
+    'OT': {'name': '其他农作物', 'characteristics': '需要更多信息进行准确识别'}
+}
+
+STAGE_CODES = {
+    'SD': {'stage': '苗期', 'description': '植株处于幼苗阶段，新叶较多', 'care_points': '注意保温保湿，适量浇水，避免强光'},
+    'VG': {'stage': '生长期', 'description': '植株正在快速生长发育', 'care_points': '增加施肥，保证充足水分和养分供应'},
+    'FL': {'stage': '开花期', 'description': '植株进入开花阶段', 'care_points': '控制氮肥，补充磷钾肥，保证授粉条件'},
+    'FR': {'stage': '结果期', 'description': '果实正在膨大发育', 'care_points': '均衡水肥供应，防止裂果和落果'},
+    'MT': {'stage': '成熟期', 'description': '植株发育成熟，叶色深绿健康', 'care_points': '加强田间管理，注意适时采收'},
+    'ST': {'stage': '受害期', 'description': '植株受病害或逆境影响，生长发育受阻', 'care_points': '立即处理病害和逆境因素，恢复植株健康'}
+}
+
+DISEASE_CODES = {
+    'LS': {
+        'name': '叶斑病', 'pathogen': '真菌性病原',
+        'symptoms': '叶片出现黄褐色斑点，严重时斑点连片',
+        'treatment': '使用多菌灵或百菌清等杀菌剂，7-10天喷洒一次',
+        'prevention': '改善通风条件，避免叶片长时间湿润',
+        'recommendations': ['及时摘除病叶，避免病害传播', '喷洒杀菌剂，连续处理2-3次']
+    },
+    'AN': {
+        'name': '炭疽病', 'pathogen': '真菌性病原',
+        'symptoms': '叶片出现褐色凹陷坏死斑，边缘清晰',
+        'treatment': '使用甲基托布津或代森锰锌，病情严重需要系统性治疗',
+        'prevention': '避免植株密度过大，清除病残体',
+        'recommendations': ['立即清除病残体', '使用系统性杀菌剂进行治疗']
+    },
+    'DM': {
+        'name': '霜霉病', 'pathogen': '卵菌',
+        'symptoms': '叶片正面出现黄色多角形病斑，背面有灰白色霉层',
+        'treatment': '使用烯酰吗啉或霜脲氰锰锌喷雾',
+        'prevention': '降低田间湿度，避免傍晚浇水',
+        'recommendations': ['加强通风排湿', '发病初期及时用药']
+    },
+    'PM': {
+        'name': '白粉病', 'pathogen': '真菌性病原',
+        'symptoms': '叶片表面覆盖白色粉状霉层',
+        'treatment': '使用三唑酮或醚菌酯喷雾',
+        'prevention': '合理密植，避免偏施氮肥',
+        'recommendations': ['摘除严重病叶', '交替使用不同杀菌剂防止抗药性']
+    },
+    'GM': {
+        'name': '灰霉病', 'pathogen': '真菌性病原',
+        'symptoms': '叶片、花或果实出现水渍状病斑，表面有灰色霉层',
+        'treatment': '使用腐霉利或嘧霉胺喷雾',
+        'prevention': '控制湿度，及时清除残花病果',
+        'recommendations': ['降低棚内湿度', '清除病残组织并带出田外']
+    },
+    'BL': {
+        'name': '疫病', 'pathogen': '卵菌',
+        'symptoms': '叶片出现暗绿色水渍状大斑，迅速扩展腐烂',
+        'treatment': '使用甲霜灵锰锌或烯酰吗啉喷雾灌根',
+        'prevention': '高垄栽培，雨后及时排水',
+        'recommendations': ['立即拔除中心病株', '雨后及时喷药保护']
+    },
+    'FW': {
+        'name': '枯萎病', 'pathogen': '土传真菌',
+        'symptoms': '植株萎蔫，叶片自下而上变黄枯死，维管束褐变',
+        'treatment': '使用咯菌腈或多菌灵灌根',
+        'prevention': '轮作倒茬，使用抗病品种',
+        'recommendations': ['拔除病株并消毒土壤', '与非寄主作物轮作']
+    },
+    'RR': {
+        'name': '根腐病', 'pathogen': '土传病原',
+        'symptoms': '植株整体萎蔫，叶片失绿，根系可能腐烂',
+        'treatment': '改善排水，使用恶霉灵或多菌灵灌根',
+        'prevention': '避免积水，改良土壤结构',
+        'recommendations': ['立即改善土壤排水条件', '减少浇水频率，避免积水']
+    },
+    'BS': {
+        'name': '细菌性斑点病', 'pathogen': '细菌',
+        'symptoms': '叶片出现水渍状小斑点，周围有黄色晕圈',
+        'treatment': '使用氢氧化铜或春雷霉素喷雾',
+        'prevention': '种子消毒，避免喷灌',
+        'recommendations': ['避免雨天农事操作', '发病初期喷施铜制剂']
+    },
+    'VR': {
+        'name': '病毒病', 'pathogen': '病毒',
+        'symptoms': '叶片花叶、皱缩或畸形，植株矮化',
+        'treatment': '无特效药，可喷施宁南霉素减轻症状',
+        'prevention': '防治蚜虫、粉虱等传毒昆虫',
+        'recommendations': ['拔除病株', '及时防治传毒害虫']
+    }
+}
+
+NUTRIENT_CODES = {
+    'N': {'nutrient': '氮素', 'symptoms': '叶片普遍黄化，老叶先黄化脱落',
+          'treatment': '施用尿素或硫酸铵，每亩10-15公斤', 'recommendations': ['追施速效氮肥', '注意氮磷钾平衡']},
+    'P': {'nutrient': '磷素', 'symptoms': '叶片暗绿或紫红色，生长缓慢',
+          'treatment': '施用过磷酸钙或磷酸二氢钾', 'recommendations': ['叶面喷施磷酸二氢钾', '基肥中增加磷肥']},
+    'K': {'nutrient': '钾素', 'symptoms': '叶缘焦枯，抗病性下降',
+          'treatment': '施用硫酸钾或氯化钾', 'recommendations': ['及时补钾', '增强植株抗性']},
+    'CA': {'nutrient': '钙素', 'symptoms': '新叶卷曲畸形，果实脐腐',
+           'treatment': '叶面喷施硝酸钙或氯化钙', 'recommendations': ['叶面补钙', '保持土壤水分稳定']},
+    'MG': {'nutrient': '镁素', 'symptoms': '老叶边缘黄化，逐渐向内扩展',
+           'treatment': '施用硫酸镁，叶面喷施效果更快', 'recommendations': ['叶面喷施硫酸镁溶液', '注意钙镁平衡']},
+    'FE': {'nutrient': '铁素', 'symptoms': '叶片黄化但叶脉保持绿色，新叶受影响更严重',
+           'treatment': '叶面喷施硫酸亚铁溶液，浓度0.2-0.3%', 'recommendations': ['调节土壤pH至6.0-7.0', '叶面喷施铁肥']},
+    'B': {'nutrient': '硼素', 'symptoms': '生长点坏死，花而不实',
+          'treatment': '叶面喷施硼砂或硼酸溶液', 'recommendations': ['花期前喷施硼肥']}
+}
+
+ISSUE_CODES = {
+    'LL': {'type': '光照不足', 'description': '光照强度偏低，可能影响光合作用',
+           'solution': '改善采光条件，或补充人工光照', 'recommendations': ['清理遮挡物，改善自然采光']},
+    'SB': {'type': '日灼/光照过强', 'description': '叶片出现灼伤斑或发白',
+           'solution': '高温时段适当遮阴', 'recommendations': ['中午前后遮阴降温']},
+    'WD': {'type': '缺水干旱', 'description': '叶片萎蔫卷曲，土壤干燥',
+           'solution': '及时灌溉，保持土壤湿润', 'recommendations': ['早晚浇水，避免中午高温浇水']},
+    'WL': {'type': '湿度过高/积水', 'description': '土壤积水或叶面长时间湿润，易诱发病害',
+           'solution': '开沟排水，加强通风', 'recommendations': ['减少浇水频率', '改善田间排水']},
+    'LC': {'type': '种植密度或覆盖问题', 'description': '植被覆盖率过低，可能是种植密度不足或植株发育不良',
+           'solution': '检查种植密度，补种或改善栽培管理', 'recommendations': ['检查种子发芽率和成活率']},
+    'PS': {'type': '虫害', 'description': '叶片有虫孔、缺刻或可见害虫',
+           'solution': '根据害虫种类选用杀虫剂或生物防治', 'recommendations': ['悬挂黄板诱杀', '定期检查叶片背面']},
+    'WE': {'type': '杂草', 'description': '植株周围杂草较多，争夺水肥',
+           'solution': '及时人工或机械除草', 'recommendations': ['中耕除草']},
+    'IQ': {'type': '图像质量问题', 'description': '图像可能模糊或拍摄条件不佳，影响准确诊断',
+           'solution': '改善拍摄条件，确保图像清晰', 'recommendations': ['重新拍摄更清晰的照片进行分析']}
+}
+
+# 没有发现问题时的建议
+HEALTHY_RECOMMENDATIONS = ['继续保持当前管理方式', '定期监测植株健康状况']
+
+CODEBOOK = {
+    'version': CODEBOOK_VERSION,
+    'severity': SEVERITY_CODES,
+    'crops': CROP_CODES,
+    'stages': STAGE_CODES,
+    'diseases': DISEASE_CODES,
+    'nutrients': NUTRIENT_CODES,
+    'issues': ISSUE_CODES,
+    'healthy_recommendations': HEALTHY_RECOMMENDATIONS
+}
+
+# 紧凑模式回复中的字段 -> 完整模式字段（用于流式进度推送）
+COMPACT_PROGRESS_FIELDS = {'h': 'health_score', 'u': 'urgency', 't': 'analysis_summary'}
+
+# 紧凑模式提示词中的标记（模拟服务器据此返回紧凑格式）
+COMPACT_PROMPT_TAG = '【紧凑输出】'
+
+
+def _code_list(codes, label_field):
+    return ' '.join(f"{code}={entry[label_field]}" for code, entry in codes.items())
+
+
+def build_compact_prompt():
+    """由代码表生成紧凑模式提示词"""
+    return f"""
+请作为资深农业专家和植物病理学家分析图片中的农作物。{COMPACT_PROMPT_TAG}只返回一个JSON对象，不要任何解释文字，分类一律使用下列代码：
+作物: {_code_list(CROP_CODES, 'name')}
+阶段: {_code_list(STAGE_CODES, 'stage')}
+病害: {_code_list(DISEASE_CODES, 'name')}
+缺素: {_code_list(NUTRIENT_CODES, 'nutrient')}
+问题: {_code_list(ISSUE_CODES, 'type')}
+程度: L=低 M=中 H=高
+格式:
+{{"h":健康评分0-100,"u":"紧急程度L/M/H","c":["作物代码",置信度0-100],"g":"阶段代码","d":[["病害代码",概率0-100,"程度"]],"n":[["缺素代码","程度"]],"e":[["问题代码","程度"]],"t":"不超过40字的摘要"}}
+没有的项返回空列表[]，不要输出代码表以外的代码。
+"""
+
+
+COMPACT_ANALYSIS_PROMPT = build_compact_prompt()
+
+
+def _severity(value, problems, field):
+    code = str(value).strip()
+    severity = SEVERITY_CODES.get(code.upper()) or URGENCY_ALIASES.get(code, code.lower())
+    if severity not in URGENCY_VALUES:
+        problems.append(f"enum:{field}")
+        return 'medium'
+    return severity
+
+
+def _number(value, default=None):
+    try:
+        return int(round(min(100, max(0, float(value)))))
+    except (TypeError, ValueError):
+        return default
+
+
+def _coded_items(data, field, codes, problems):
+    """把 [["代码", ...], ...] 列表中代码表内的项取出，未知代码和格式错误的项记入problems后丢弃"""
+    items = data.get(field) or []
+    if not isinstance(items, list):
+        problems.append(f"type:{field}")
+        return []
+    valid = []
+    for item in items:
+        item = item if isinstance(item, list) else [item]
+        code = str(item[0]).strip().upper() if item else ''
+        if code not in codes:
+            problems.append(f"code:{field}:{code}")
+            continue
+        valid.append((code, item[1:]))
+    return valid
+
+
+def validate_compact_analysis(data):
+    """校验紧凑模式回复并转换为分析结果字段，返回 (结果字段, 问题列表)
+
+    评分/紧急程度/摘要使用完整模式的字段名（排序、路由和缓存照常工作），
+    其余代码放在 codes 中，由前端按代码表展开
+    """
+    if not isinstance(data, dict):
+        raise ValueError("分析结果不是JSON对象")
+
+    problems = []
+    score = _number(data.get('h'))
+    if score is None:
+        problems.append('missing:h')
+        score = 75
+
+    if data.get('u') is None:
+        problems.append('missing:u')
+        urgency = 'high' if score < 50 else 'medium' if score < 75 else 'low'
+    else:
+        urgency = _severity(data['u'], problems, 'u')
+
+    crop = data.get('c') or []
+    crop = crop if isinstance(crop, list) else [crop]
+    crop_code = str(crop[0]).strip().upper() if crop else 'OT'
+    if crop_code not in CROP_CODES:
+        problems.append(f"code:c:{crop_code}")
+        crop_code = 'OT'
+    stage_code = str(data.get('g') or '').strip().upper()
+    if stage_code not in STAGE_CODES:
+        problems.append(f"code:g:{stage_code}")
+        stage_code = None
+
+    codes = {
+        'crop': {'code': crop_code, 'confidence': _number(crop[1] if len(crop) > 1 else None, 50)},
+        'stage': stage_code,
+        'diseases': [{'code': code, 'probability': _number(rest[0] if rest else None, 50),
+                      'severity': _severity(rest[1] if len(rest) > 1 else 'M', problems, 'd')}
+                     for code, rest in _coded_items(data, 'd', DISEASE_CODES, problems)],
+        'deficiencies': [{'code': code, 'severity': _severity(rest[0] if rest else 'M', problems, 'n')}
+                         for code, rest in _coded_items(data, 'n', NUTRIENT_CODES, problems)],
+        'issues': [{'code': code, 'severity': _severity(rest[0] if rest else 'M', problems, 'e')}
+                   for code, rest in _coded_items(data, 'e', ISSUE_CODES, problems)]
+    }
+    return {
+        'analysis_profile': 'compact',
+        'health_score': score,
+        'urgency': urgency,
+        'analysis_summary': str(data.get('t') or ''),
+        'codes': codes
+    }, problems
+
+
+def compact_progress_fields(fields):
+    """把流式扫描出的紧凑模式字段换成完整模式的字段名，供进度推送使用"""
+    progress = {}
+    for key, value in fields.items():
+        name = COMPACT_PROGRESS_FIELDS.get(key)
+        if name == 'urgency':
+            value = SEVERITY_CODES.get(str(value).upper(), value)
+        if name:
+            progress[name] = value
+    return progress
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析任务调度
+固定数量的工作线程 + 有界优先级队列，替代每次检测创建一个分析线程：
+最近健康评分低或紧急程度高的植株优先分析；
+同一植株已在排队时只更新为最新帧（合并），队列满时淘汰优先级更低的任务或拒绝新任务；
+同一植株的分析正在进行时，后来的请求共享进行中的结果（SingleFlight）；
+短时间窗口内到达的多个植株请求可合并为一次多图调用（AnalysisBatcher）
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+import traceback
+
+# 优先级（数值越小越优先）
+PRIORITY_URGENT = 0  # 最近一次分析紧急程度高或健康评分低
+PRIORITY_NORMAL = 1  # 未分析过或健康状况一般
+PRIORITY_HEALTHY = 2  # 最近一次分析状况良好
+
+# submit() 的返回结果
+SUBMIT_QUEUED = 'queued'
+SUBMIT_COALESCED = 'coalesced'
+SUBMIT_REJECTED = 'rejected'
+
+
+class AnalysisTask:
+    """一个待执行的植株分析任务"""
+
+    __slots__ = ('plant_id', 'frame', 'qr_info', 'features', 'priority', 'seq', 'enqueued_at', 'cancelled')
+
+    def __init__(self, plant_id, frame, qr_info, priority, seq, features=None):
+        self.plant_id = plant_id
+        self.frame = frame
+        self.qr_info = qr_info
+        self.features = features  # 提交前已提取的该帧图像特征（没有则为None）
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.time()
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AnalysisExecutor:
+    """AI分析执行器 - 固定工作线程从有界优先级队列取任务执行"""
+
+    def __init__(self, handler, workers=2, max_queue=16, health_memory=600.0,
+                 urgent_health_score=50, healthy_score=75, on_status=None):
+        # handler(task) 执行分析，返回分析结果字典（用于记录植株健康状况）
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.health_memory = health_memory  # 植株健康记录的有效期（秒）
+        self.urgent_health_score = urgent_health_score
+        self.healthy_score = healthy_score
+        self.on_status = on_status  # 队列状态变化回调 on_status(status_dict)
+
+        self._heap = []
+        self._queued = {}  # plant_id -> 排队中的任务
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self.plant_health = {}  # plant_id -> (health_score, urgency, 记录时间)
+
+        # 统计信息
+        self.active_count = 0
+        self.submitted_count = 0
+        self.completed_count = 0
+        self.failed_count = 0
+        self.coalesced_count = 0
+        self.rejected_count = 0
+        self.evicted_count = 0
+        self.avg_task_seconds = 0.0
+        self.avg_wait_seconds = 0.0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._threads = []
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"analysis-worker-{index}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        print(f"🧠 AI分析执行器已启动: {self.workers}个工作线程, 队列上限{self.max_queue}")
+
+    def shutdown(self, timeout=2.0):
+        with self._cond:
+            self._running = False
+            self._heap = []
+            self._queued.clear()
+            self._cond.notify_all()
+
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.time()))
+        self._threads = []
+
+    def priority_for(self, plant_id):
+        """根据植株最近一次的分析结果确定优先级"""
+        record = self.plant_health.get(plant_id)
+        if record is None or time.time() - record[2] > self.health_memory:
+            return PRIORITY_NORMAL
+
+        health_score, urgency, _ = record
+        if urgency == 'high' or health_score < self.urgent_health_score:
+            return PRIORITY_URGENT
+        if health_score >= self.healthy_score and urgency == 'low':
+            return PRIORITY_HEALTHY
+        return PRIORITY_NORMAL
+
+    def record_result(self, plant_id, result):
+        """记录植株分析结果，用于后续任务排序"""
+        if not result or result.get('status') != 'ok':
+            return
+        self.plant_health[plant_id] = (result.get('health_score', 0), result.get('urgency', 'medium'), time.time())
+
+    def submit(self, plant_id, frame, qr_info, features=None):
+        """提交分析任务，返回 queued / coalesced / rejected；features 为该帧已提取的图像特征，随任务传给处理函数"""
+        with self._cond:
+            if not self._running:
+                return SUBMIT_REJECTED
+
+            self.submitted_count += 1
+
+            # 同一植株已在排队：只保留最新帧，不重复分析
+            queued = self._queued.get(plant_id)
+            if queued is not None:
+                queued.frame = frame
+                queued.qr_info = qr_info
+                queued.features = features
+                self.coalesced_count += 1
+                return SUBMIT_COALESCED
+
+            priority = self.priority_for(plant_id)
+            if len(self._queued) >= self.max_queue:
+                victim = max(self._queued.values())
+                if priority >= victim.priority:
+                    self.rejected_count += 1
+                    result = SUBMIT_REJECTED
+                else:
+                    # 淘汰排队中优先级最低、最晚进入的任务（释放其帧）
+                    self._evict(victim)
+                    result = self._enqueue(plant_id, frame, qr_info, priority, features)
+            else:
+                result = self._enqueue(plant_id, frame, qr_info, priority, features)
+            status = self._status_locked()
+
+        self._publish(status)
+        return result
+
+    def _enqueue(self, plant_id, frame, qr_info, priority, features=None):
+        task = AnalysisTask(plant_id, frame, qr_info, priority, next(self._seq), features)
+        heapq.heappush(self._heap, task)
+        self._queued[plant_id] = task
+        self._cond.notify()
+        return SUBMIT_QUEUED
+
+    def _evict(self, task):
+        task.cancelled = True
+        task.frame = None
+        del self._queued[task.plant_id]
+        self.evicted_count += 1
+        print(f"⚠️ 分析队列已满，淘汰植株 {task.plant_id} 的分析任务")
+
+    def _next_task(self):
+        with self._cond:
+            while self._running:
+                while self._heap:
+                    task = heapq.heappop(self._heap)
+                    if task.cancelled:
+                        continue
+                    del self._queued[task.plant_id]
+                    self.active_count += 1
+                    return task, self._status_locked()
+                self._cond.wait(timeout=0.5)
+        return None, None
+
+    def _worker_loop(self):
+        while self._running:
+            task, status = self._next_task()
+            if task is None:
+                break
+            self._publish(status)
+
+            wait_seconds = time.time() - task.enqueued_at
+            start_time = time.time()
+            success = False
+            try:
+                result = self.handler(task)
+                self.record_result(task.plant_id, result)
+                success = bool(result) and result.get('status') == 'ok'
+            except Exception as e:
+                print(f"❌ AI分析任务执行错误: {e}")
+                traceback.print_exc()
+            finally:
+                task.frame = None
+
+            elapsed = time.time() - start_time
+            with self._cond:
+                self.active_count -= 1
+                if success:
+                    self.completed_count += 1
+                else:
+                    self.failed_count += 1
+                finished = self.completed_count + self.failed_count
+                self.avg_task_seconds = elapsed if finished == 1 else self.avg_task_seconds * 0.8 + elapsed * 0.2
+                self.avg_wait_seconds = wait_seconds if finished == 1 else self.avg_wait_seconds * 0.8 + wait_seconds * 0.2
+                status = self._status_locked()
+            self._publish(status)
+
+    def estimated_wait(self, position=None):
+        """估算排在第position位（默认队尾）的任务还需等待的秒数"""
+        with self._cond:
+            return self._estimated_wait_locked(len(self._queued) if position is None else position)
+
+    def _estimated_wait_locked(self, position):
+        if position <= 0 and self.active_count < self.workers:
+            return 0.0
+        # 前面的任务按工作线程数分批执行
+        rounds = math.ceil((position + self.active_count) / self.workers)
+        return round(rounds * self.avg_task_seconds, 1)
+
+    def _status_locked(self):
+        queue_length = len(self._queued)
+        return {
+            'queue_length': queue_length,
+            'capacity': self.max_queue,
+            'active': self.active_count,
+            'workers': self.workers,
+            'estimated_wait_seconds': self._estimated_wait_locked(queue_length),
+            'avg_analysis_seconds': round(self.avg_task_seconds, 2),
+            'avg_queue_wait_seconds': round(self.avg_wait_seconds, 2),
+            'submitted': self.submitted_count,
+            'completed': self.completed_count,
+            'failed': self.failed_count,
+            'coalesced': self.coalesced_count,
+            'rejected': self.rejected_count,
+            'evicted': self.evicted_count
+        }
+
+    def _publish(self, status):
+        if status is not None and self.on_status:
+            try:
+                self.on_status(status)
+            except Exception as e:
+                print(f"❌ 分析队列状态通知失败: {e}")
+
+    def stats(self):
+        with self._cond:
+            return self._status_locked()
+
+
+class SingleFlight:
+    """同键调用合并 - 同一植株已有分析在进行时，后来的调用者等待并共享其结果，
+    不再发起重复的API调用（需在事件循环中使用）"""
+
+    def __init__(self):
+        self._flights = {}  # key -> 进行中调用的 asyncio.Future
+
+        # 统计信息
+        self.calls = 0
+        self.shared = 0
+        self.refreshes = 0
+
+    def in_flight(self, key):
+        return key in self._flights
+
+    async def run(self, key, factory, refresh=False):
+        """执行 factory() 返回的协程，返回 (结果, 是否共享了其他调用者的结果)
+
+        refresh=True 时若已有调用在进行，则等其完成后再执行一次（多个刷新请求仍只执行一次），
+        用于需要最新画面而不是进行中结果的场景
+        """
+        future = self._flights.get(key)
+        if future is not None:
+            if not refresh:
+                self.shared += 1
+                return await asyncio.shield(future), True
+            try:
+                await asyncio.shield(future)
+            except Exception:
+                pass
+            if key in self._flights:
+                # 其他刷新请求已经开始了新的调用
+                self.shared += 1
+                return await asyncio.shield(self._flights[key]), True
+            self.refreshes += 1
+
+        return await self._lead(key, factory), False
+
+    async def _lead(self, key, factory):
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = future
+        self.calls += 1
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有共享者时避免"异常未被获取"警告
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+    def stats(self):
+        return {
+            'in_flight': len(self._flights),
+            'calls': self.calls,
+            'shared': self.shared,
+            'refreshes': self.refreshes
+        }
+
+
+class AnalysisBatcher:
+    """请求合批 - 时间窗口内到达的请求凑成一批，凑满或窗口结束时合并为一次调用（需在事件循环中使用）"""
+
+    def __init__(self, handler, max_batch_size=4, window=0.3):
+        # handler(payloads) 是返回结果列表（与payloads顺序一致）的协程函数
+        self.handler = handler
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window = window  # 第一个请求到达后最多等待多久（秒）
+        self._pending = []  # [(payload, future)]
+        self._timer = None
+        self._running = set()  # 进行中的批次任务（保持引用）
+
+        # 统计信息
+        self.batches = 0
+        self.items = 0
+        self.full_batches = 0
+        self.avg_batch_size = 0.0
+
+    async def submit(self, payload):
+        """提交一个请求，等待所在批次完成后返回对应的结果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # 等待期间已被取消的请求不再发送
+        pending = [(payload, future) for payload, future in self._pending if not future.done()]
+        batch, self._pending = pending[:self.max_batch_size], pending[self.max_batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        if not batch:
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        if len(batch) == self.max_batch_size:
+            self.full_batches += 1
+        self.avg_batch_size = len(batch) if self.batches == 1 else self.avg_batch_size * 0.9 + len(batch) * 0.1
+
+        task = asyncio.ensure_future(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.handler([payload for payload, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'window_seconds': self.window,
+            'waiting': len(self._pending),
+            'in_flight_batches': len(self._running),
+            'batches': self.batches,
+            'items': self.items,
+            'full_batches': self.full_batches,
+            'avg_batch_size': round(self.avg_batch_size, 2)
+        }
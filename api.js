@@ -13,6 +13,7 @@ class APIManager {
         this.isConnecting = false;
         this.messageQueue = [];
         this.heartbeatInterval = null;
+        this.videoProtocol = 'json';
 
         console.log('🔌 初始化API管理器 - 连接Python后端');
 
@@ -40,6 +41,8 @@ class APIManager {
 
         try {
             this.websocket = new WebSocket(this.wsUrl);
+            this.websocket.binaryType = 'arraybuffer';
+            this.videoProtocol = 'json';
 
             // 设置连接超时
             const connectionTimeout = setTimeout(() => {
@@ -69,6 +72,10 @@ class APIManager {
 
             this.websocket.onmessage = (event) => {
                 try {
+                    if (event.data instanceof ArrayBuffer) {
+                        this.handleBinaryFrame(event.data);
+                        return;
+                    }
                     const data = JSON.parse(event.data);
                     this.handleMessage(data);
                 } catch (error) {
@@ -152,6 +159,20 @@ class APIManager {
                 if (window.ui) {
                     ui.addLog('success', '🐍 Python后端连接已建立');
                 }
+                // 后端支持二进制视频帧时，协商使用二进制协议
+                if (data.data && Array.isArray(data.data.video_protocols) &&
+                    data.data.video_protocols.includes('binary')) {
+                    this.sendMessage('video_protocol', { protocol: 'binary' });
+                }
+                // 紧凑模式的分析结果只含代码，按后端下发的代码表在本地展开
+                if (data.data && data.data.analysis_codebook && window.reportManager) {
+                    reportManager.setCodebook(data.data.analysis_codebook);
+                }
+                break;
+
+            case 'video_protocol_ack':
+                this.videoProtocol = data.data.protocol;
+                console.log(`🎞️ 视频帧协议: ${this.videoProtocol}`);
                 break;
 
             case 'status_update':
@@ -173,6 +194,26 @@ class APIManager {
                 }
                 break;
 
+            case 'client_stats':
+            case 'pipeline_stats':
+                console.log('📊 后端发送统计:', data.data);
+                break;
+
+            case 'ai_circuit_status':
+                if (window.ui) {
+                    if (data.data.state === 'open') {
+                        ui.addLog('warning', `⚡ 云端AI暂不可用，${data.data.retry_in_seconds}秒后重试，期间使用本地分析`);
+                    } else if (data.data.state === 'closed') {
+                        ui.addLog('success', '✅ 云端AI已恢复');
+                    }
+                }
+                console.log('🔌 云端AI熔断器状态:', data.data);
+                break;
+
+            case 'analysis_queue_status':
+                console.log(`🧠 AI分析队列: ${data.data.queue_length}/${data.data.capacity}，预计等待 ${data.data.estimated_wait_seconds}s`);
+                break;
+
             case 'qr_detected':
                 this.handleQRDetection(data.data.qr_info);
                 break;
@@ -183,6 +224,13 @@ class APIManager {
                 }
                 break;
 
+            case 'ai_analysis_progress':
+                // 流式分析的阶段性字段（健康评分、紧急程度等），完整报告随后到达
+                if (window.reportManager) {
+                    reportManager.displayProgress(data.data);
+                }
+                break;
+
             case 'error':
                 if (window.ui) {
                     ui.addLog('error', data.data.message || data.data);
@@ -198,6 +246,40 @@ class APIManager {
         }
     }
 
+    /**
+     * 处理二进制视频帧
+     * 头部（小端序，28字节）: magic(4) version(1) flags(1) header_len(2) seq(4) timestamp(8) fps(4) width(2) height(2)
+     */
+    handleBinaryFrame(buffer) {
+        if (buffer.byteLength < 28) {
+            return;
+        }
+
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+        if (magic !== 'TTVF') {
+            console.error('❌ 二进制视频帧标识错误');
+            return;
+        }
+
+        const headerLength = view.getUint16(6, true);
+        const frameInfo = {
+            seq: view.getUint32(8, true),
+            timestamp: view.getFloat64(12, true),
+            fps: view.getFloat32(20, true),
+            width: view.getUint16(24, true),
+            height: view.getUint16(26, true)
+        };
+
+        if (window.videoManager) {
+            const blob = new Blob([new Uint8Array(buffer, headerLength)], { type: 'image/jpeg' });
+            videoManager.updateFrame(blob);
+            if (frameInfo.fps) {
+                videoManager.fps = frameInfo.fps;
+            }
+        }
+    }
+
     /**
      * 发送消息到Python后端
      */
@@ -327,6 +409,16 @@ class APIManager {
         return this.sendMessage('ai_test');
     }
 
+    /**
+     * 为选中的植株请求完整分析报告（紧凑模式下）
+     */
+    async requestFullAnalysis(plantId) {
+        if (window.ui) {
+            ui.addLog('info', `📋 正在请求植株 ${plantId} 的完整分析...`);
+        }
+        return this.sendMessage('full_analysis_request', { plant_id: plantId });
+    }
+
     async resetQRDetection() {
         if (window.ui) {
             ui.addLog('info', '🔄 正在重置二维码检测...');
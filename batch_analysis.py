@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+离线批量分析
+对航后保存的大量帧重新分析：输入可以是目录、通配符或视频文件，图像边读取边分析，
+本地特征分析分发到进程池，云端分析使用有界并发的异步请求；
+结果逐条追加写入JSONL，中断后用同一输出文件重新运行会跳过已成功分析的帧
+
+用法:
+    python batch_analysis.py frames/ -o results.jsonl                 # 自动选择：已配置API时用云端，否则本地
+    python batch_analysis.py "flights/**/*.jpg" --mode local --workers 8
+    python batch_analysis.py flight.mp4 --frame-step 30 --mode cloud --concurrency 6
+    python batch_analysis.py frames/ --plant-id-regex "(QR\\d+)"      # 从文件名提取植株ID（启用结果缓存）
+也可以通过 python crop_analyzer_dashscope.py <输入> [选项] 调用
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from analysis_cache import AnalysisCache
+from crop_analyzer_dashscope import CropAnalyzer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.h264', '.ts')
+
+MODE_AUTO = 'auto'
+MODE_LOCAL = 'local'
+MODE_CLOUD = 'cloud'
+
+
+def load_analyzer_settings(config_path=None):
+    """与后端相同的配置来源：环境变量优先，其次 config.json"""
+    config_path = config_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+    client_config = dict(config.get('dashscope_client', {}))
+    if os.getenv('DASHSCOPE_BASE_URL'):
+        client_config['base_url'] = os.getenv('DASHSCOPE_BASE_URL')
+    return {
+        'api_key': os.getenv('DASHSCOPE_API_KEY') or config.get('dashscope_api_key'),
+        'app_id': os.getenv('DASHSCOPE_APP_ID') or config.get('dashscope_app_id'),
+        'client_config': client_config,
+        'cache_config': config.get('analysis_cache', {})
+    }
+
+
+def iter_sources(source, frame_step=1):
+    """按顺序产出 (帧ID, 图像路径或已解码的帧)
+
+    图像文件只产出路径（由分析进程自己解码）；视频逐帧解码，每frame_step帧取一帧
+    """
+    if os.path.isfile(source) and source.lower().endswith(VIDEO_EXTENSIONS):
+        yield from iter_video_frames(source, frame_step)
+        return
+
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name)
+                 for root, _, names in os.walk(source) for name in names]
+        base = source
+    else:
+        paths = glob.glob(source, recursive=True)
+        base = os.path.dirname(source.split('*', 1)[0]) or '.'
+
+    for path in sorted(paths):
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            yield os.path.relpath(path, base).replace(os.sep, '/'), path
+
+
+def iter_video_frames(path, frame_step=1):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"无法打开视频文件: {path}")
+
+    name = os.path.basename(path)
+    frame_step = max(1, int(frame_step))
+    index = 0
+    try:
+        while True:
+            if index % frame_step:
+                # 跳过的帧只抓取不解码
+                if not capture.grab():
+                    break
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield f"{name}#{index}", frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def load_image(source):
+    return cv2.imread(source) if isinstance(source, str) else source
+
+
+def load_completed(output_path):
+    """读取已有输出文件中成功分析过的帧ID（用于断点续跑；失败的帧会重新分析）"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 上次中断时写了一半的行
+            if record.get('result', {}).get('status') == 'ok':
+                completed.add(record['id'])
+    return completed
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+# ---- 本地分析（进程池） ----
+
+_local_analyzer = None
+
+
+def _init_local_worker(client_config):
+    global _local_analyzer
+    cv2.setNumThreads(1)  # 并行度由进程数提供
+    _local_analyzer = CropAnalyzer(api_key=None, config=client_config)
+
+
+def _analyze_local(frame_id, source):
+    image = load_image(source)
+    if image is None:
+        return frame_id, {'status': 'error', 'message': f'无法读取图像: {source}'}
+    result = _local_analyzer._generate_professional_simulation(image)
+    result['analysis_tier'] = 'local'
+    return frame_id, result
+
+
+def iter_local_results(items, workers, client_config):
+    """在进程池中做本地特征分析，按完成顺序产出 (帧ID, 结果)，在途任务不超过进程数的两倍"""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_local_worker,
+                             initargs=(client_config,)) as pool:
+        pending = set()
+        for frame_id, source in items:
+            pending.add(pool.submit(_analyze_local, frame_id, source))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+# ---- 批量运行 ----
+
+class BatchRunner:
+    """读取输入、跳过已完成的帧、分发分析并逐条写入JSONL"""
+
+    def __init__(self, output_path, mode=MODE_AUTO, workers=None, concurrency=None,
+                 plant_id_regex=None, frame_step=1, limit=None, settings=None):
+        self.output_path = output_path
+        self.workers = workers or os.cpu_count() or 2
+        self.concurrency = concurrency
+        self.plant_id_regex = re.compile(plant_id_regex) if plant_id_regex else None
+        self.frame_step = frame_step
+        self.limit = limit
+        self.settings = settings or load_analyzer_settings()
+
+        self.analyzer = None
+        if mode != MODE_LOCAL:
+            self.analyzer = CropAnalyzer(api_key=self.settings['api_key'], app_id=self.settings['app_id'],
+                                         config=self.settings['client_config'],
+                                         cache=AnalysisCache.from_config(self.settings['cache_config']))
+            cloud_ready = self.analyzer.is_configured or self.analyzer.async_client is not None
+            if mode == MODE_AUTO and not cloud_ready:
+                print("ℹ️ 未配置云端AI，使用本地特征分析")
+                mode = MODE_LOCAL
+        self.mode = mode
+
+        # 统计信息
+        self.skipped = 0
+        self.written = 0
+        self.failed = 0
+        self.start_time = None
+
+    def plant_id_for(self, frame_id):
+        if self.plant_id_regex is None:
+            return None
+        match = self.plant_id_regex.search(frame_id)
+        if match is None:
+            return None
+        return match.group(1) if match.groups() else match.group(0)
+
+    def _pending_items(self, source, completed):
+        count = 0
+        for frame_id, item in iter_sources(source, self.frame_step):
+            if frame_id in completed:
+                self.skipped += 1
+                continue
+            if self.limit is not None and count >= self.limit:
+                return
+            count += 1
+            yield frame_id, item
+
+    def _write(self, output, frame_id, result):
+        record = {
+            'id': frame_id,
+            'plant_id': self.plant_id_for(frame_id),
+            'mode': self.mode,
+            'analyzed_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'result': result
+        }
+        output.write(json.dumps(record, ensure_ascii=False, default=_json_default) + '\n')
+        output.flush()  # 每条立即落盘，中断后可续跑
+
+        self.written += 1
+        if result.get('status') != 'ok':
+            self.failed += 1
+        if self.written % 50 == 0:
+            elapsed = time.time() - self.start_time
+            print(f"📊 已分析 {self.written} 帧（{self.written / elapsed:.1f} 帧/秒），失败 {self.failed}")
+
+    def run(self, source):
+        completed = load_completed(self.output_path)
+        if completed:
+            print(f"⏭️ 输出文件中已有 {len(completed)} 帧分析成功，将跳过")
+
+        self.start_time = time.time()
+        items = self._pending_items(source, completed)
+        with open(self.output_path, 'a', encoding='utf-8') as output:
+            if self.mode == MODE_LOCAL:
+                print(f"🧮 本地特征分析: {self.workers} 个进程")
+                for frame_id, result in iter_local_results(items, self.workers, self.settings['client_config']):
+                    self._write(output, frame_id, result)
+            else:
+                asyncio.run(self._run_cloud(items, output))
+
+        elapsed = time.time() - self.start_time
+        summary = {
+            'mode': self.mode,
+            'analyzed': self.written,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'seconds': round(elapsed, 1),
+            'frames_per_second': round(self.written / elapsed, 2) if elapsed > 0 else 0.0
+        }
+        print(f"✅ 批量分析完成: {summary}")
+        return summary
+
+    async def _run_cloud(self, items, output):
+        concurrency = self.concurrency or self.analyzer.client_config['max_concurrency']
+        print(f"☁️ 云端分析: 并发 {concurrency}")
+        # 图像在读取线程中解码，同时在途的帧不超过并发数
+        decoded = ((frame_id, load_image(item), self.plant_id_for(frame_id)) for frame_id, item in items)
+        try:
+            async for frame_id, result in self.analyzer.iter_analyze_batch(decoded, concurrency):
+                self._write(output, frame_id, result)
+        finally:
+            await self.analyzer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量分析保存的帧（目录/通配符/视频），结果写入JSONL')
+    parser.add_argument('source', help='图像目录、通配符（如 "frames/**/*.jpg"）或视频文件')
+    parser.add_argument('-o', '--output', default='analysis_results.jsonl', help='输出JSONL文件（已存在时续跑）')
+    parser.add_argument('--mode', choices=[MODE_AUTO, MODE_LOCAL, MODE_CLOUD], default=MODE_AUTO,
+                        help='local=本地特征分析，cloud=云端AI（失败时回退本地），auto=按是否配置API选择')
+    parser.add_argument('--workers', type=int, default=None, help='本地分析进程数（默认CPU核数）')
+    parser.add_argument('--concurrency', type=int, default=None, help='云端并发请求数（默认dashscope_client.max_concurrency）')
+    parser.add_argument('--frame-step', type=int, default=1, help='视频每隔多少帧取一帧')
+    parser.add_argument('--plant-id-regex', default=None, help='从帧ID（文件路径）中提取植株ID的正则')
+    parser.add_argument('--limit', type=int, default=None, help='本次最多分析的帧数')
+    parser.add_argument('--config', default=None, help='配置文件路径（默认与脚本同目录的config.json）')
+    args = parser.parse_args(argv)
+
+    runner = BatchRunner(args.output, mode=args.mode, workers=args.workers, concurrency=args.concurrency,
+                         plant_id_regex=args.plant_id_regex, frame_step=args.frame_step, limit=args.limit,
+                         settings=load_analyzer_settings(args.config))
+    summary = runner.run(args.source)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+按画面变化决定是否重新分析植株
+每个植株记录最近一次分析时的特征向量（各颜色比例、亮度、边缘密度，与分析结果中的 image_features 相同），
+冷却期过后再次经过同一植株时先提取特征（缩小图像上约几毫秒），与记录的向量比较：
+变化不超过阈值且上次结果未过期时直接复用上次的结果，不再排队分析；
+与 AnalysisCache 的区别：缓存按感知哈希只复用云端结果，这里在进入分析队列之前按特征漂移判断，本地/云端结果都适用
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CHANGE_GATE_CONFIG = {
+    'enabled': True,
+    'drift_threshold': 0.06,  # 特征向量各分量（归一化到0-1）的最大变化量
+    'max_age': 900.0,  # 上次结果超过该时间（秒）后无论画面是否变化都重新分析
+    'max_plants': 4096  # 最多记录的植株数（LRU淘汰）
+}
+
+# 参与比较的特征及其归一化系数
+FEATURE_SCALES = (
+    ('green_ratio', 1.0),
+    ('dark_green_ratio', 1.0),
+    ('light_green_ratio', 1.0),
+    ('yellow_ratio', 1.0),
+    ('brown_ratio', 1.0),
+    ('brightness', 255.0),
+    ('edge_density', 1.0)
+)
+
+# 不记录的结果来源：云端不可用时的回退结果不应挡住之后的云端分析
+UNRECORDED_TIERS = ('local_fallback',)
+
+
+def feature_vector(features):
+    """特征字典 -> 归一化的特征元组"""
+    return tuple(float(features.get(name, 0.0)) / scale for name, scale in FEATURE_SCALES)
+
+
+def feature_drift(previous, current):
+    """两个特征向量之间的漂移（各分量变化量的最大值）"""
+    return max(abs(a - b) for a, b in zip(previous, current))
+
+
+class ChangeGate:
+    """记录每株最近一次分析的特征向量和结果，画面没有明显变化时复用结果"""
+
+    def __init__(self, drift_threshold=0.06, max_age=900.0, max_plants=4096):
+        self.drift_threshold = drift_threshold
+        self.max_age = max_age
+        self.max_plants = max(1, int(max_plants))
+        self._plants = OrderedDict()  # plant_id -> (特征向量, 结果, 记录时间)
+        self._lock = threading.Lock()
+
+        # 统计信息：复用次数和各重新分析原因的次数
+        self.reused = 0
+        self.reasons = {'new': 0, 'expired': 0, 'drift': 0}
+        self.avg_drift = 0.0
+        self.checks = 0
+
+    @classmethod
+    def from_config(cls, config=None):
+        """按配置创建，未启用时返回None"""
+        config = dict(DEFAULT_CHANGE_GATE_CONFIG, **(config or {}))
+        if not config['enabled']:
+            return None
+        return cls(drift_threshold=config['drift_threshold'], max_age=config['max_age'],
+                   max_plants=config['max_plants'])
+
+    def check(self, plant_id, features, now=None):
+        """返回 (可复用的结果或None, 判断信息)；判断信息含 reason（new/expired/drift/unchanged）、drift、age"""
+        now = time.time() if now is None else now
+        current = feature_vector(features)
+        with self._lock:
+            entry = self._plants.get(plant_id)
+            if entry is None:
+                return None, self._count('new', None, None)
+
+            previous, result, recorded_at = entry
+            age = now - recorded_at
+            drift = feature_drift(previous, current)
+            self.checks += 1
+            self.avg_drift = drift if self.checks == 1 else self.avg_drift * 0.9 + drift * 0.1
+            if age > self.max_age:
+                return None, self._count('expired', drift, age)
+            if drift > self.drift_threshold:
+                return None, self._count('drift', drift, age)
+
+            self._plants.move_to_end(plant_id)
+            self.reused += 1
+            return result, {'reason': 'unchanged', 'drift': round(drift, 4), 'age': round(age, 1)}
+
+    def _count(self, reason, drift, age):
+        self.reasons[reason] += 1
+        return {
+            'reason': reason,
+            'drift': round(drift, 4) if drift is not None else None,
+            'age': round(age, 1) if age is not None else None
+        }
+
+    def record(self, plant_id, features, result, now=None):
+        """记录一次成功分析的特征向量和结果"""
+        if result.get('status') != 'ok' or result.get('analysis_tier') in UNRECORDED_TIERS:
+            return
+        with self._lock:
+            self._plants.pop(plant_id, None)
+            self._plants[plant_id] = (feature_vector(features), result, time.time() if now is None else now)
+            while len(self._plants) > self.max_plants:
+                self._plants.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plants.clear()
+
+    def stats(self):
+        with self._lock:
+            reanalyzed = sum(self.reasons.values())
+            total = reanalyzed + self.reused
+            return {
+                'plants': len(self._plants),
+                'drift_threshold': self.drift_threshold,
+                'max_age': self.max_age,
+                'reused': self.reused,
+                'reanalyzed': dict(self.reasons),
+                'reuse_rate': round(self.reused / total, 3) if total else 0.0,
+                'avg_drift': round(self.avg_drift, 4)
+            }
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+云端调用熔断与重试
+熔断器：连续失败达到阈值后打开，打开期间直接拒绝调用（立即回退到本地分析），
+冷却时间后进入半开状态放行少量探测请求，探测成功则关闭、失败则重新打开；
+重试策略：带全抖动的指数退避，所有重试受单次分析的截止时间约束
+"""
+
+import random
+import threading
+import time
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """三态熔断器（线程安全，同步和异步调用路径共用）"""
+
+    def __init__(self, failure_threshold=3, recovery_timeout=30.0, half_open_max_calls=1, on_state_change=None):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_timeout = recovery_timeout  # 打开后多久进入半开状态（秒）
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self.on_state_change = on_state_change  # on_state_change(status_dict)
+
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.rejected_count = 0
+        self.open_count = 0
+        self.last_error = None
+
+    def allow_request(self):
+        """是否允许发起调用；打开状态下冷却结束后转为半开并放行探测请求"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.time() - self.opened_at < self.recovery_timeout:
+                    self.rejected_count += 1
+                    return False
+                self._set_state(STATE_HALF_OPEN)
+
+            if self.state == STATE_HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    self.rejected_count += 1
+                    return False
+                self._half_open_calls += 1
+
+            return True
+
+    def release_probe(self):
+        """调用没有得出结果（被取消或出现接口错误以外的异常）：归还半开状态的探测名额，
+        否则熔断器会一直停在半开状态并拒绝所有调用"""
+        with self._lock:
+            if self.state == STATE_HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != STATE_CLOSED:
+                self._set_state(STATE_CLOSED)
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self.state == STATE_HALF_OPEN or (
+                    self.state == STATE_CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.opened_at = time.time()
+                self.open_count += 1
+                self._set_state(STATE_OPEN)
+
+    def _set_state(self, state):
+        previous = self.state
+        self.state = state
+        self._half_open_calls = 0
+        print(f"🔌 云端AI熔断器: {previous} → {state}")
+        if self.on_state_change:
+            try:
+                self.on_state_change(self._status_locked())
+            except Exception as e:
+                print(f"❌ 熔断器状态通知失败: {e}")
+
+    def _status_locked(self):
+        retry_in = 0.0
+        if self.state == STATE_OPEN:
+            retry_in = max(0.0, self.recovery_timeout - (time.time() - self.opened_at))
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'failure_threshold': self.failure_threshold,
+            'retry_in_seconds': round(retry_in, 1),
+            'open_count': self.open_count,
+            'rejected': self.rejected_count,
+            'last_error': self.last_error
+        }
+
+    def stats(self):
+        with self._lock:
+            return self._status_locked()
+
+
+class RetryPolicy:
+    """指数退避重试（全抖动），重试等待和下一次尝试都必须在截止时间之内"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=4.0, min_attempt_time=1.0):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_attempt_time = min_attempt_time  # 剩余时间不足以完成一次尝试时不再重试
+
+    def next_delay(self, attempt, deadline):
+        """第attempt次尝试失败后的等待秒数，不应再重试时返回None"""
+        if attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if time.monotonic() + delay + self.min_attempt_time > deadline:
+            return None
+        return delay
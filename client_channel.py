@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket客户端发送通道
+每个客户端拥有独立的发送队列和发送任务：
+控制/分析消息按顺序可靠投递，视频帧只保留最新一帧（新帧覆盖未发送的旧帧）；
+视频质量档位根据每个客户端的发送延迟和积压情况自适应调整
+"""
+
+import asyncio
+import time
+from collections import deque
+
+
+def _ewma(average, sample, first=False, alpha=0.1):
+    """指数滑动平均，首个样本直接作为初值"""
+    return sample if first else average * (1 - alpha) + sample * alpha
+
+
+class AdaptiveQualityController:
+    """自适应视频质量控制 - 根据发送延迟、丢帧和积压选择质量档位（0为最高质量）"""
+
+    def __init__(self, ladder_size, degrade_send_ms=80.0, upgrade_send_ms=25.0,
+                 upgrade_after=60, max_pending=8, change_cooldown=1.0):
+        self.ladder_size = max(1, ladder_size)
+        self.degrade_send_ms = degrade_send_ms
+        self.upgrade_send_ms = upgrade_send_ms
+        self.upgrade_after = upgrade_after
+        self.max_pending = max_pending
+        self.change_cooldown = change_cooldown
+
+        self.rung = 0
+        self.healthy_frames = 0
+        self.last_change_time = 0
+        self.changes = 0
+
+    def update(self, avg_send_ms, frame_dropped, pending_messages):
+        """每发送一帧调用一次，返回档位是否发生变化"""
+        now = time.time()
+        congested = (avg_send_ms > self.degrade_send_ms or
+                     frame_dropped or
+                     pending_messages >= self.max_pending)
+
+        if congested:
+            self.healthy_frames = 0
+            if self.rung < self.ladder_size - 1 and now - self.last_change_time >= self.change_cooldown:
+                return self._set_rung(self.rung + 1, now)
+            return False
+
+        if avg_send_ms < self.upgrade_send_ms:
+            self.healthy_frames += 1
+        else:
+            self.healthy_frames = 0
+
+        # 连续一段时间发送顺畅才提升质量，避免档位来回抖动
+        if self.rung > 0 and self.healthy_frames >= self.upgrade_after:
+            self.healthy_frames = 0
+            return self._set_rung(self.rung - 1, now)
+
+        return False
+
+    def _set_rung(self, rung, now):
+        self.rung = rung
+        self.last_change_time = now
+        self.changes += 1
+        return True
+
+
+class ClientChannel:
+    """单个客户端的发送通道 - 可靠消息队列 + 最新视频帧槽位"""
+
+    def __init__(self, websocket, payload_builder, max_pending=256, quality=None, on_rung_change=None):
+        self.websocket = websocket
+        self.client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
+        # payload_builder(packet, protocol, rung) -> 可直接发送的视频帧数据
+        self.payload_builder = payload_builder
+        self.max_pending = max_pending
+
+        # 自适应质量控制（None表示固定使用最高质量档位）
+        self.quality = quality
+        self.on_rung_change = on_rung_change
+
+        # 协商后的视频帧协议：'json' 或 'binary'
+        self.video_protocol = 'json'
+
+        self._pending_messages = deque()
+        self._pending_frame = None
+        self._frame_overwritten = False
+        self._wakeup = asyncio.Event()
+        self._sender_task = None
+        self.closed = False
+
+        # 统计信息
+        self.connected_at = time.time()
+        self.messages_sent = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.avg_send_ms = 0.0
+        self.avg_frame_lag_ms = 0.0
+        self.max_pending_seen = 0
+
+    def start(self):
+        self._sender_task = asyncio.create_task(self._sender_loop())
+
+    def close(self):
+        self.closed = True
+        self._pending_messages.clear()
+        self._pending_frame = None
+        self._wakeup.set()
+        if self._sender_task and not self._sender_task.done():
+            self._sender_task.cancel()
+
+    def send_message(self, payload):
+        """排队一条需要可靠投递的消息，队列溢出时断开该客户端"""
+        if self.closed:
+            return False
+
+        if len(self._pending_messages) >= self.max_pending:
+            # 客户端严重滞后，不能静默丢弃控制消息，断开让其重连
+            print(f"⚠️ 客户端 {self.client_ip} 发送队列溢出（{self.max_pending}条），断开连接")
+            self.close()
+            asyncio.ensure_future(self.websocket.close(code=1013, reason='send queue overflow'))
+            return False
+
+        self._pending_messages.append(payload)
+        self.max_pending_seen = max(self.max_pending_seen, len(self._pending_messages))
+        self._wakeup.set()
+        return True
+
+    @property
+    def rung(self):
+        return self.quality.rung if self.quality else 0
+
+    def send_video_frame(self, packet):
+        """放入最新视频帧，覆盖尚未发送的旧帧"""
+        if self.closed:
+            return
+        if self._pending_frame is not None:
+            self.frames_dropped += 1
+            self._frame_overwritten = True
+        self._pending_frame = packet
+        self._wakeup.set()
+
+    async def _sender_loop(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+
+                # 控制和分析消息优先于视频帧
+                while self._pending_messages and not self.closed:
+                    payload = self._pending_messages.popleft()
+                    await self._send(payload)
+                    self.messages_sent += 1
+
+                if self._pending_frame is not None and not self.closed:
+                    packet = self._pending_frame
+                    self._pending_frame = None
+                    payload = self.payload_builder(packet, self.video_protocol, self.rung)
+                    await self._send(payload)
+                    self.frames_sent += 1
+                    self._record_frame_lag(packet)
+                    self._update_quality()
+
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # 连接已断开，由连接处理协程负责清理
+            print(f"📴 客户端 {self.client_ip} 发送失败: {e}")
+            self.closed = True
+
+    async def _send(self, payload):
+        start_time = time.perf_counter()
+        await self.websocket.send(payload)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+        self.bytes_sent += len(payload)
+        self.avg_send_ms = _ewma(self.avg_send_ms, elapsed_ms,
+                                 self.messages_sent + self.frames_sent == 0)
+
+    def _record_frame_lag(self, packet):
+        # 从采集到发送完成的延迟
+        lag_ms = (time.time() - packet['timestamp']) * 1000
+        self.avg_frame_lag_ms = _ewma(self.avg_frame_lag_ms, lag_ms, self.frames_sent == 1)
+
+    def _update_quality(self):
+        if not self.quality:
+            return
+        frame_dropped = self._frame_overwritten
+        self._frame_overwritten = False
+        if self.quality.update(self.avg_send_ms, frame_dropped, len(self._pending_messages)):
+            print(f"🎚️ 客户端 {self.client_ip} 视频质量档位调整为 {self.quality.rung}")
+            if self.on_rung_change:
+                self.on_rung_change()
+
+    def stats(self):
+        return {
+            'client_ip': self.client_ip,
+            'video_protocol': self.video_protocol,
+            'quality_rung': self.rung,
+            'quality_changes': self.quality.changes if self.quality else 0,
+            'connected_seconds': round(time.time() - self.connected_at, 1),
+            'pending_messages': len(self._pending_messages),
+            'max_pending_seen': self.max_pending_seen,
+            'messages_sent': self.messages_sent,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'bytes_sent': self.bytes_sent,
+            'avg_send_ms': round(self.avg_send_ms, 2),
+            'avg_frame_lag_ms': round(self.avg_frame_lag_ms, 2)
+        }
@@ -3,10 +3,14 @@ import base64
 import json
 import time
 import random
+import re
+import threading
+from collections import OrderedDict
 from io import BytesIO
 import cv2
 import numpy as np
 from datetime import datetime
+import asyncio
 
 try:
     import dashscope
@@ -17,69 +21,62 @@ except ImportError:
     DASHSCOPE_AVAILABLE = False
     print("警告: dashscope库未安装，将使用专业模拟分析模式")
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-class CropAnalyzer:
-    """专业农作物健康分析器 - 集成农业专家知识库"""
-
-    def __init__(self, api_key, app_id=None):
-        self.api_key = api_key
-        self.app_id = app_id
-        self.model_name = "qwen-vl-max"  # 使用通义千问视觉模型
-
-        # 验证API配置
-        self.is_configured = self._validate_config()
-
-        # 分析计数器，确保每次分析都不同
-        self.analysis_count = 0
+from dashscope_client import AIOHTTP_AVAILABLE, DEFAULT_CLIENT_CONFIG, DashScopeAsyncClient, DashScopeError, content_text
+from ai_response_parser import IncrementalFieldScanner, ResponseParseError, extract_analysis, validate_analysis
+from analysis_codebook import COMPACT_ANALYSIS_PROMPT, compact_progress_fields, validate_compact_analysis
+from analysis_scheduler import AnalysisBatcher
+from circuit_breaker import CircuitBreaker, RetryPolicy
+from feature_engine import FeatureEngine
+from model_router import ModelRouter
 
-        print(f"专业农作物分析器初始化: {'真实AI模式' if self.is_configured else '专业模拟模式'}")
 
-    def _validate_config(self):
-        """验证API配置"""
-        if not DASHSCOPE_AVAILABLE:
-            print("❌ dashscope库未安装")
-            return False
-
-        if not self.api_key or self.api_key == "your-api-key-here":
-            print("❌ API密钥未配置")
-            return False
-
-        try:
-            # 设置API密钥
-            dashscope.api_key = self.api_key
-            print("✅ API密钥配置成功")
-            return True
-        except Exception as e:
-            print(f"❌ API配置失败: {str(e)}")
-            return False
-
-    def _image_to_base64(self, image):
-        """将OpenCV图像转换为base64编码"""
-        try:
-            # 确保图像是BGR格式
-            if len(image.shape) == 3 and image.shape[2] == 3:
-                # BGR to RGB
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+# 上传图像预算：视觉模型不需要完整采集分辨率，缩小并按目标字节数选择压缩质量以减少上传时间
+DEFAULT_UPLOAD_BUDGET = {
+    'max_edge': 1024,  # 长边像素上限
+    'target_bytes': 120 * 1024,  # 编码后目标大小（base64之前）
+    'format': 'jpeg',  # jpeg 或 webp（webp不可用时回退到jpeg）
+    'min_quality': 40,
+    'max_quality': 90
+}
 
-            # 编码为JPEG
-            _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+# 多图合批：队列较深时把多个植株的图像合并为一次调用，提示词只发送一次
+DEFAULT_BATCH_CONFIG = {
+    'enabled': False,
+    'max_batch_size': 4,  # 每次调用最多包含的植株图像数
+    'window': 0.3,  # 第一个请求到达后最多等待多久凑批（秒）
+    'deadline_per_extra_image': 8.0  # 每多一张图像，分析截止时间延长的秒数（输出随图像数增长）
+}
 
-            # 转换为base64
-            image_base64 = base64.b64encode(buffer).decode('utf-8')
+# 分级分析：先用本地特征分级，明显健康或明显严重的植株直接采用本地结果，
+# 只有处于不确定区间、本地发现病害征象或按计划抽检时才调用云端模型
+DEFAULT_TRIAGE_CONFIG = {
+    'enabled': False,
+    'healthy_above': 80,  # 本地评分不低于该值视为明显健康
+    'critical_below': 35,  # 本地评分低于该值视为明显严重
+    'escalate_on_disease': True,  # 本地诊断出病害征象时交给云端确认
+    'cloud_max_age': 0,  # 植株超过该时间（秒）没有云端分析结果时升级一次（从未上云视为超时），0表示不按时间升级
+    'sample_rate': 0.05  # 随机抽检比例，用于持续校验本地分级的准确性
+}
 
-            return f"data:image/jpeg;base64,{image_base64}"
+# 分析模式：full 为完整的专业分析结构；compact 只要求评分、枚举代码和一句摘要，
+# 固定的说明文字由前端按 analysis_codebook 代码表展开，输出token数大幅减少
+PROFILE_FULL = 'full'
+PROFILE_COMPACT = 'compact'
 
-        except Exception as e:
-            print(f"图像编码失败: {str(e)}")
-            return None
+DEFAULT_PROFILE_CONFIG = {
+    'default': PROFILE_FULL,  # 常规分析使用的模式
+    'keep_uploads': 32  # 紧凑模式下保留最近多少株的上传图像，用于按需生成完整分析
+}
 
-    def _call_real_ai_api(self, image_base64):
-        """调用真实的阿里云百炼AI API进行专业农业分析"""
-        try:
-            print("🤖 正在调用阿里云百炼专业农业AI...")
+# 分析结果来源（结果中的 analysis_tier 字段）
+TIER_LOCAL = 'local'  # 本地分级直接采用
+TIER_CLOUD = 'cloud'  # 云端模型
+TIER_LOCAL_FALLBACK = 'local_fallback'  # 云端不可用或失败时回退的本地分析
 
-            # 构建专业农业分析提示
-            prompt = """
+# 专业农业分析提示
+PROFESSIONAL_ANALYSIS_PROMPT = """
 请作为一位资深的农业专家和植物病理学家，对这张农作物图片进行专业分析。
 
 分析要求：
@@ -147,101 +144,582 @@ class CropAnalyzer:
 请基于图片中的实际情况进行专业分析，提供具体可行的农业指导建议。
 """
 
-            # 调用API
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"image": image_base64},
-                        {"text": prompt}
-                    ]
-                }
-            ]
+ANALYSIS_PROMPTS = {
+    PROFILE_FULL: PROFESSIONAL_ANALYSIS_PROMPT,
+    PROFILE_COMPACT: COMPACT_ANALYSIS_PROMPT
+}
 
-            response = MultiModalConversation.call(
-                model=self.model_name,
-                messages=messages,
-                top_p=0.8,
-                temperature=0.3  # 降低随机性，提高一致性
-            )
+# 非JSON回复中的健康评分
+HEALTH_SCORE_TEXT_PATTERN = re.compile(r'健康评分[:：]\s*(\d+)')
 
-            if response.status_code == 200:
-                # 【修复】正确解析API响应格式
-                raw_response = response.output.choices[0].message.content
-                print(f"✅ 专业农业AI响应: {str(raw_response)[:200]}...")
+# 多图合批时附加在专业分析提示之后的说明（{count}为图像数）
+BATCH_ANALYSIS_INSTRUCTIONS = """
+本次请求包含{count}张图片，分别来自不同的植株，每张图片前的文字标注了该图片的植株ID。
+请对每张图片分别按上述要求独立分析，不要混淆不同图片的内容，并以如下JSON格式返回：
+{{
+    "results": [
+        {{"plant_id": "图片前标注的植株ID", ...上述单株分析结果的全部字段}}
+    ]
+}}
+results中按图片顺序每张图片一项，共{count}项。
+"""
 
-                try:
-                    # 处理不同的响应格式
-                    if isinstance(raw_response, list):
-                        # 如果响应是列表，提取文本内容
-                        ai_response = ""
-                        for item in raw_response:
-                            if isinstance(item, dict) and 'text' in item:
-                                ai_response += item['text']
-                            else:
-                                ai_response += str(item)
-                    else:
-                        # 如果响应是字符串
-                        ai_response = str(raw_response)
-
-                    print(f"📝 解析后的文本: {ai_response[:200]}...")
-
-                    # 尝试解析JSON响应
-                    if ai_response.strip().startswith('{'):
-                        analysis_data = json.loads(ai_response)
-                    elif '```json' in ai_response:
-                        # 如果响应包含markdown格式的JSON
-                        import re
-                        json_match = re.search(r'```json\s*\n(.*?)\n```', ai_response, re.DOTALL)
-                        if json_match:
-                            json_text = json_match.group(1).strip()
-                            analysis_data = json.loads(json_text)
-                        else:
-                            # 尝试找到任何JSON对象
-                            json_match = re.search(r'\{.*\}', ai_response, re.DOTALL)
-                            if json_match:
-                                analysis_data = json.loads(json_match.group())
-                            else:
-                                raise ValueError("无法提取JSON数据")
-                    else:
-                        # 如果响应不是JSON，尝试提取JSON部分
-                        import re
-                        json_match = re.search(r'\{.*\}', ai_response, re.DOTALL)
-                        if json_match:
-                            analysis_data = json.loads(json_match.group())
-                        else:
-                            raise ValueError("无法提取JSON数据")
-
-                    # 验证必要字段
-                    required_fields = ['health_score', 'analysis_summary']
-                    for field in required_fields:
-                        if field not in analysis_data:
-                            analysis_data[field] = self._get_default_value(field)
-
-                    # 添加分析ID和时间戳
-                    analysis_data["analysis_id"] = f"AI_{self.analysis_count}_{int(time.time())}"
-                    analysis_data["analysis_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                    return {
-                        "status": "ok",
-                        **analysis_data
-                    }
 
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON解析失败: {str(e)}")
-                    # 返回基于文本的分析结果
-                    return self._parse_text_response(ai_response)
+class CropAnalyzer:
+    """专业农作物健康分析器 - 集成农业专家知识库"""
+
+    def __init__(self, api_key, app_id=None, config=None, cache=None):
+        self.api_key = api_key
+        self.app_id = app_id
+        self.model_name = "qwen-vl-max"  # 使用通义千问视觉模型
+
+        # 验证API配置
+        self.is_configured = self._validate_config()
+
+        # 异步HTTP客户端（连接池 + 并发限制 + 请求截止时间），配置见 dashscope_client.DEFAULT_CLIENT_CONFIG
+        self.client_config = dict(DEFAULT_CLIENT_CONFIG, **(config or {}))
+        self.async_client = None
+        if AIOHTTP_AVAILABLE and self._api_key_valid():
+            self.async_client = DashScopeAsyncClient(self.api_key, self.client_config)
+
+        # 云端调用熔断和重试：云端不可用时立即回退到本地分析，而不是每株都等待超时
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=self.client_config['breaker_failure_threshold'],
+            recovery_timeout=self.client_config['breaker_recovery_timeout'])
+        self.retry_policy = RetryPolicy(
+            max_attempts=self.client_config['retry_max_attempts'],
+            base_delay=self.client_config['retry_base_delay'],
+            max_delay=self.client_config['retry_max_delay'])
+        # 同步SDK调用本身没有超时控制，放到线程池中执行以便按截止时间放弃等待
+        self._sdk_executor = None
+
+        # 上传图像预算（config['upload_budget']覆盖默认值）和编码统计
+        self.upload_budget = dict(DEFAULT_UPLOAD_BUDGET, **self.client_config.get('upload_budget', {}))
+        if self.upload_budget['format'] == 'webp' and not cv2.haveImageWriter('.webp'):
+            print("⚠️ 当前OpenCV不支持WebP编码，上传图像使用JPEG")
+            self.upload_budget['format'] = 'jpeg'
+        self.upload_count = 0
+        self.upload_bytes_total = 0
+        self.avg_upload_bytes = 0.0
+        self.avg_encode_ms = 0.0
+
+        # 视觉模型路由（config['model_router']），未启用时所有请求使用model_name
+        self.router = ModelRouter.from_config(self.client_config.get('model_router'), self.model_name)
+
+        # 多图合批（config['batching']覆盖默认值），只用于异步客户端路径；不同模型的请求分别合批
+        self.batch_config = dict(DEFAULT_BATCH_CONFIG, **self.client_config.get('batching', {}))
+        self.batching_enabled = bool(self.batch_config['enabled'] and self.async_client
+                                     and self.batch_config['max_batch_size'] > 1)
+        self.batchers = {}  # 模型名称 -> AnalysisBatcher
+
+        # 本地图像特征引擎（config['feature_engine']覆盖默认值），DashScope不可用时的主要分析路径
+        self.feature_engine = FeatureEngine.from_config(self.client_config.get('feature_engine'))
+
+        # 分级分析（config['triage']覆盖默认值）
+        self.triage_config = dict(DEFAULT_TRIAGE_CONFIG, **self.client_config.get('triage', {}))
+        self.last_cloud_analysis = {}  # plant_id -> 最近一次云端分析成功的时间
+        self.tier_counts = {TIER_LOCAL: 0, TIER_CLOUD: 0, TIER_LOCAL_FALLBACK: 0}
+        self.escalation_counts = {}  # 升级原因 -> 次数
+
+        # 分析模式（config['analysis_profile']覆盖默认值）和各模式的token统计
+        self.profile_config = dict(DEFAULT_PROFILE_CONFIG, **self.client_config.get('analysis_profile', {}))
+        if self.profile_config['default'] not in ANALYSIS_PROMPTS:
+            print(f"⚠️ 未知的分析模式 {self.profile_config['default']}，使用完整模式")
+            self.profile_config['default'] = PROFILE_FULL
+        self.analysis_profile = self.profile_config['default']
+        self.recent_uploads = OrderedDict()  # plant_id -> (图像base64, 编码信息)，紧凑模式下按需完整分析用
+        self.profile_stats = {}
+
+        # 分析结果缓存（analysis_cache.AnalysisCache），None表示不缓存
+        self.cache = cache
+
+        # 回复解析统计；response_log 配置为文件路径时记录原始回复（parser_benchmark.py 的语料）
+        self.parse_stats = {'parsed': 0, 'repaired': 0, 'schema_problems': 0, 'text_fallback': 0}
+        self._response_log_lock = threading.Lock()
+
+        # 分析计数器，确保每次分析都不同
+        self.analysis_count = 0
+
+        print(f"专业农作物分析器初始化: {'真实AI模式' if self.is_configured else '专业模拟模式'}"
+              f"{'（异步客户端已启用）' if self.async_client else ''}")
+
+    def _validate_config(self):
+        """验证API配置"""
+        if not DASHSCOPE_AVAILABLE:
+            print("❌ dashscope库未安装")
+            return False
+
+        if not self._api_key_valid():
+            print("❌ API密钥未配置")
+            return False
+
+        try:
+            # 设置API密钥
+            dashscope.api_key = self.api_key
+            print("✅ API密钥配置成功")
+            return True
+        except Exception as e:
+            print(f"❌ API配置失败: {str(e)}")
+            return False
+
+    def _api_key_valid(self):
+        return bool(self.api_key) and self.api_key != "your-api-key-here"
+
+    def _image_to_base64(self, image):
+        """将OpenCV图像按上传预算编码为base64数据URL，返回 (数据URL, 编码信息)"""
+        try:
+            start_time = time.perf_counter()
+            budget = self.upload_budget
+
+            # 限制长边尺寸（OpenCV编码器直接接受BGR，无需转换颜色通道）
+            height, width = image.shape[:2]
+            scale = budget['max_edge'] / max(height, width)
+            if scale < 1.0:
+                image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+            buffer, quality, encodes = self._encode_to_budget(image)
+            encode_ms = (time.perf_counter() - start_time) * 1000
+
+            mime = 'image/webp' if budget['format'] == 'webp' else 'image/jpeg'
+            image_base64 = base64.b64encode(buffer).decode('utf-8')
+
+            upload_info = {
+                'format': budget['format'],
+                'width': image.shape[1],
+                'height': image.shape[0],
+                'quality': quality,
+                'bytes': len(buffer),
+                'base64_bytes': len(image_base64),
+                'encodes': encodes,
+                'encode_ms': round(encode_ms, 2)
+            }
+            self._record_upload(upload_info)
+            print(f"📦 上传图像: {upload_info['width']}x{upload_info['height']} {budget['format']} "
+                  f"q={quality} {len(buffer) / 1024:.1f}KB 编码{encode_ms:.1f}ms（{encodes}次）")
 
+            return f"data:{mime};base64,{image_base64}", upload_info
+
+        except Exception as e:
+            print(f"图像编码失败: {str(e)}")
+            return None, None
+
+    def _encode_to_budget(self, image):
+        """二分查找不超过目标字节数的最高质量，返回 (编码字节, 质量, 编码次数)"""
+        budget = self.upload_budget
+        ext, quality_flag = ('.webp', cv2.IMWRITE_WEBP_QUALITY) if budget['format'] == 'webp' \
+            else ('.jpg', cv2.IMWRITE_JPEG_QUALITY)
+
+        def encode(quality):
+            ok, buffer = cv2.imencode(ext, image, [quality_flag, quality])
+            if not ok:
+                raise ValueError(f"{ext}编码失败")
+            return buffer
+
+        # 最高质量已满足预算时只需编码一次
+        best = encode(budget['max_quality'])
+        encodes = 1
+        if len(best) <= budget['target_bytes']:
+            return best, budget['max_quality'], encodes
+
+        best_quality = None
+        low, high = budget['min_quality'], budget['max_quality'] - 1
+        while low <= high:
+            quality = (low + high) // 2
+            buffer = encode(quality)
+            encodes += 1
+            if len(buffer) <= budget['target_bytes']:
+                best, best_quality = buffer, quality
+                low = quality + 1
             else:
-                error_msg = f"API调用失败: {response.status_code}"
+                high = quality - 1
+
+        if best_quality is None:
+            # 最低质量仍超出预算，使用最低质量
+            best, best_quality = encode(budget['min_quality']), budget['min_quality']
+            encodes += 1
+        return best, best_quality, encodes
+
+    def _record_upload(self, upload_info):
+        self.upload_count += 1
+        self.upload_bytes_total += upload_info['bytes']
+        first = self.upload_count == 1
+        self.avg_upload_bytes = upload_info['bytes'] if first else self.avg_upload_bytes * 0.9 + upload_info['bytes'] * 0.1
+        self.avg_encode_ms = upload_info['encode_ms'] if first else self.avg_encode_ms * 0.9 + upload_info['encode_ms'] * 0.1
+
+    def get_upload_stats(self):
+        return {
+            'budget': self.upload_budget,
+            'uploads': self.upload_count,
+            'bytes_total': self.upload_bytes_total,
+            'avg_bytes': int(self.avg_upload_bytes),
+            'avg_encode_ms': round(self.avg_encode_ms, 2)
+        }
+
+    def _build_messages(self, image_base64, profile=None):
+        """构建专业农业分析请求消息"""
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"image": image_base64},
+                    {"text": ANALYSIS_PROMPTS[profile or self.analysis_profile]}
+                ]
+            }
+        ]
+
+    def _call_real_ai_api(self, image_base64, model=None, profile=None, record_stats=True):
+        """调用真实的阿里云百炼AI API进行专业农业分析（熔断 + 截止时间内重试）；
+        record_stats=False 时不计入模型路由和输出模式统计（连通性测试）"""
+        model = model or self.model_name
+        profile = profile or self.analysis_profile
+        deadline = time.monotonic() + self.client_config['analysis_deadline']
+        messages = self._build_messages(image_base64, profile)
+        attempt = 0
+
+        while True:
+            if not self.circuit_breaker.allow_request():
+                return self._circuit_open_error()
+
+            attempt += 1
+            try:
+                print(f"🤖 正在调用阿里云百炼专业农业AI...（第{attempt}次）")
+                start_time = time.monotonic()
+                content, usage = self._call_sdk(messages, deadline - time.monotonic(), model)
+            except DashScopeError as e:
+                if record_stats:
+                    self.router.record_call(model, time.monotonic() - start_time, success=False)
+                delay = self._handle_call_failure(e, attempt, deadline)
+                if delay is None:
+                    return {"status": "error", "message": f"真实AI分析失败: {str(e)}"}
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.circuit_breaker.release_probe()
+                raise
+
+            if record_stats:
+                self.router.record_call(model, time.monotonic() - start_time, usage)
+                self._record_profile(profile, time.monotonic() - start_time, usage)
+            self.circuit_breaker.record_success()
+            self._record_response(content, model)
+            try:
+                return self._parse_ai_response(content, profile)
+            except Exception as e:
+                error_msg = f"真实AI分析失败: {str(e)}"
                 print(f"❌ {error_msg}")
                 return {"status": "error", "message": error_msg}
 
+    def _call_sdk(self, messages, timeout, model=None):
+        """在线程池中调用DashScope SDK，超过timeout秒放弃等待，返回 (回复内容, token用量)"""
+        if self._sdk_executor is None:
+            self._sdk_executor = ThreadPoolExecutor(
+                max_workers=self.client_config['max_concurrency'], thread_name_prefix='dashscope-sdk')
+
+        future = self._sdk_executor.submit(
+            MultiModalConversation.call,
+            model=model or self.model_name,
+            messages=messages,
+            top_p=0.8,
+            temperature=0.3  # 降低随机性，提高一致性
+        )
+        try:
+            response = future.result(timeout=max(0.0, timeout))
+        except FutureTimeoutError:
+            raise DashScopeError(f"请求超时（{timeout:.1f}秒）", code='Timeout')
+        except Exception as e:
+            raise DashScopeError(f"网络请求失败: {e}", code='NetworkError')
+
+        if response.status_code != 200:
+            raise DashScopeError(f"API调用失败: {response.status_code}",
+                                 status_code=response.status_code, code=getattr(response, 'code', None))
+        usage = getattr(response, 'usage', None) or {}
+        return response.output.choices[0].message.content, {
+            'input_tokens': usage.get('input_tokens', 0),
+            'output_tokens': usage.get('output_tokens', 0)
+        }
+
+    async def _call_real_ai_api_async(self, image_base64, model=None, on_progress=None, profile=None,
+                                      record_stats=True):
+        """通过异步HTTP客户端调用阿里云百炼AI API（连接复用，熔断 + 截止时间内重试）"""
+        profile = profile or self.analysis_profile
+        content, error = await self._generate_async(self._build_messages(image_base64, profile), model=model,
+                                                    on_progress=on_progress, profile=profile,
+                                                    record_stats=record_stats)
+        if error:
+            return error
+        try:
+            return self._parse_ai_response(content, profile)
         except Exception as e:
             error_msg = f"真实AI分析失败: {str(e)}"
             print(f"❌ {error_msg}")
             return {"status": "error", "message": error_msg}
 
+    async def _generate_async(self, messages, extra_deadline=0.0, model=None, images=1, on_progress=None,
+                              profile=None, record_stats=True):
+        """发送请求直到成功或放弃，返回 (回复内容, None) 或 (None, 错误结果)
+
+        启用流式输出且提供 on_progress 时，顶层字段一完整就调用 on_progress({字段名: 值})；
+        record_stats=False 时不计入模型路由和输出模式统计
+        """
+        streaming = on_progress is not None and self.client_config['streaming']
+        model = model or self.model_name
+        profile = profile or self.analysis_profile
+        deadline = time.monotonic() + self.client_config['analysis_deadline'] + extra_deadline
+        attempt = 0
+
+        while True:
+            if not self.circuit_breaker.allow_request():
+                return None, self._circuit_open_error()
+
+            attempt += 1
+            try:
+                print(f"🤖 正在调用阿里云百炼专业农业AI（异步）...（第{attempt}次）")
+                # 模型延迟从请求实际发出时算起，等待配额许可和限流后重新排队的时间单独记录
+                timing = {}
+                timeout = max(0.001, deadline - time.monotonic())
+                if streaming:
+                    # 每次尝试重新扫描，重试时已推送的字段会被新结果覆盖
+                    content, body = await self.async_client.multimodal_generation_stream(
+                        model, messages, self._progress_scanner(on_progress, profile),
+                        timeout=timeout, timing=timing, top_p=0.8, temperature=0.3)
+                else:
+                    content, body = await self.async_client.multimodal_generation(
+                        model,
+                        messages,
+                        timeout=timeout,
+                        timing=timing,
+                        top_p=0.8,
+                        temperature=0.3
+                    )
+            except DashScopeError as e:
+                if record_stats:
+                    self.router.record_call(model, timing.get('latency', 0.0), success=False)
+                delay = self._handle_call_failure(e, attempt, deadline, requeued=True)
+                if delay is None:
+                    return None, {"status": "error", "message": f"真实AI分析失败: {str(e)}"}
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 被取消（如调用方超时）或意外异常：不算云端失败，但要归还半开探测名额
+                self.circuit_breaker.release_probe()
+                raise
+
+            if record_stats:
+                self.router.record_call(model, timing['latency'], body.get('usage'), images,
+                                        queue_wait_seconds=timing['queue_wait'])
+                self._record_profile(profile, timing['latency'], body.get('usage'), images)
+            self.circuit_breaker.record_success()
+            self._record_response(content, model)
+            return content, None
+
+    def _progress_scanner(self, on_progress, profile=PROFILE_FULL):
+        """生成流式回调：增量扫描文本，把新完成的字段交给 on_progress（紧凑模式的字段换成完整模式的字段名）"""
+        scanner = IncrementalFieldScanner()
+
+        def on_delta(text):
+            fields = scanner.feed(text)
+            if fields and profile == PROFILE_COMPACT:
+                fields = compact_progress_fields(fields)
+            if fields:
+                try:
+                    on_progress(fields)
+                except Exception as e:
+                    print(f"❌ 分析进度推送失败: {e}")
+
+        return on_delta
+
+    async def _call_cloud_async(self, plant_id, image_base64, model=None, on_progress=None):
+        """单株云端分析；启用合批时与窗口内使用同一模型的其他植株合并为一次调用（合批请求不推送进度）"""
+        model = model or self.model_name
+        if not self.batching_enabled:
+            return await self._call_real_ai_api_async(image_base64, model, on_progress)
+
+        batcher = self.batchers.get(model)
+        if batcher is None:
+            batcher = AnalysisBatcher(lambda items: self._call_batch_api_async(items, model),
+                                      max_batch_size=self.batch_config['max_batch_size'],
+                                      window=self.batch_config['window'])
+            self.batchers[model] = batcher
+        return await batcher.submit((plant_id, image_base64))
+
+    def _build_batch_messages(self, labels, images):
+        content = []
+        for label, image_base64 in zip(labels, images):
+            content.append({"text": f"植株ID: {label}"})
+            content.append({"image": image_base64})
+        content.append({"text": ANALYSIS_PROMPTS[self.analysis_profile] +
+                                BATCH_ANALYSIS_INSTRUCTIONS.format(count=len(images))})
+        return [{"role": "user", "content": content}]
+
+    async def _call_batch_api_async(self, items, model=None):
+        """AnalysisBatcher的处理函数：items为 [(植株ID, 图像base64)]，返回与items顺序一致的结果列表"""
+        if len(items) == 1:
+            return [await self._call_real_ai_api_async(items[0][1], model)]
+
+        # 没有植株ID的图像按序号标注，保证标签唯一
+        labels = []
+        for index, (plant_id, _) in enumerate(items):
+            label = str(plant_id) if plant_id is not None else f"IMG{index + 1}"
+            labels.append(label if label not in labels else f"{label}#{index + 1}")
+
+        print(f"📦 合批分析 {len(items)} 株: {', '.join(labels)}")
+        messages = self._build_batch_messages(labels, [image_base64 for _, image_base64 in items])
+        extra_deadline = self.batch_config['deadline_per_extra_image'] * (len(items) - 1)
+        content, error = await self._generate_async(messages, extra_deadline, model, images=len(items))
+        if error:
+            return [error] * len(items)
+
+        try:
+            results = self._parse_batch_response(content, labels, self.analysis_profile)
+        except Exception as e:
+            print(f"❌ 合批响应解析失败: {e}，逐株重新分析")
+            results = [None] * len(items)
+
+        # 响应中缺失的植株单独再请求一次
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            retried = await asyncio.gather(*(self._call_real_ai_api_async(items[index][1], model)
+                                             for index in missing))
+            for index, result in zip(missing, retried):
+                results[index] = result
+        return results
+
+    def _parse_batch_response(self, raw_response, labels, profile=None):
+        """把合批响应拆分为每株的结果，响应中找不到的植株对应None"""
+        data, repairs = extract_analysis(self._response_text(raw_response))
+        entries = data.get('results', []) if isinstance(data, dict) else data
+        if not isinstance(entries, list):
+            raise ValueError("合批响应缺少results列表")
+
+        by_label = {}
+        for entry in entries:
+            if isinstance(entry, dict) and entry.get('plant_id') is not None:
+                by_label.setdefault(str(entry['plant_id']), entry)
+
+        results = []
+        for index, label in enumerate(labels):
+            entry = by_label.get(label)
+            if entry is None and not by_label and len(entries) == len(labels):
+                entry = entries[index]  # 模型没有回填植株ID时按顺序对应
+            results.append(self._finalize_analysis(dict(entry), repairs, profile) if isinstance(entry, dict) else None)
+        return results
+
+    def _handle_call_failure(self, error, attempt, deadline, requeued=False):
+        """记录一次云端调用失败，返回重试前的等待秒数，不再重试时返回None
+
+        requeued=True 表示被限流的请求已由配额调度器重新排队到 throttle_max_wait（异步客户端），不再重试
+        """
+        print(f"❌ 云端AI调用失败（第{attempt}次）: {error}")
+        if error.throttled:
+            # 限流说明配额用尽而不是服务故障，不计入熔断器的失败次数
+            self.circuit_breaker.release_probe()
+            if requeued:
+                return None
+        else:
+            self.circuit_breaker.record_failure(error)
+        if not error.retryable:
+            return None
+        delay = self.retry_policy.next_delay(attempt, deadline)
+        if delay is not None:
+            print(f"🔁 {delay:.2f}秒后重试")
+        return delay
+
+    def _circuit_open_error(self):
+        status = self.circuit_breaker.stats()
+        print(f"⚡ 云端AI熔断中，{status['retry_in_seconds']}秒后重新探测，直接使用本地分析")
+        return {"status": "error", "message": "云端AI熔断中，跳过云端调用", "circuit_open": True}
+
+    def _parse_ai_response(self, raw_response, profile=None):
+        """解析模型回复（字符串或内容列表）为分析结果"""
+        print(f"✅ 专业农业AI响应: {str(raw_response)[:200]}...")
+
+        ai_response = self._response_text(raw_response)
+        try:
+            data, repairs = extract_analysis(ai_response)
+        except ResponseParseError as e:
+            print(f"❌ JSON解析失败: {str(e)}")
+            self.parse_stats['text_fallback'] += 1
+            # 返回基于文本的分析结果
+            return self._parse_text_response(ai_response)
+        return self._finalize_analysis(data, repairs, profile)
+
+    def _response_text(self, raw_response):
+        """模型回复可能是字符串或 [{'text': ...}] 内容列表，统一为文本"""
+        if isinstance(raw_response, list):
+            return content_text(raw_response)
+        return str(raw_response)
+
+    def _finalize_analysis(self, analysis_data, repairs=(), profile=None):
+        """按约定结构校验并补全字段，添加分析ID和时间戳"""
+        if (profile or self.analysis_profile) == PROFILE_COMPACT:
+            analysis_data, problems = validate_compact_analysis(analysis_data)
+        else:
+            problems = validate_analysis(analysis_data)
+        self.parse_stats['parsed'] += 1
+        if repairs:
+            self.parse_stats['repaired'] += 1
+        if problems:
+            self.parse_stats['schema_problems'] += 1
+        if repairs or problems:
+            print(f"🩹 模型回复已修复: {', '.join(list(repairs) + problems)}")
+            analysis_data["parse_warnings"] = {"repairs": list(repairs), "schema": problems}
+
+        analysis_data["analysis_id"] = f"AI_{self.analysis_count}_{int(time.time())}"
+        analysis_data["analysis_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        return {
+            "status": "ok",
+            **analysis_data
+        }
+
+    def _record_response(self, content, model):
+        """把原始回复追加到 response_log（JSONL），用于积累解析器测试语料"""
+        path = self.client_config.get('response_log')
+        if not path:
+            return
+        record = {
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'model': model,
+            'text': self._response_text(content)
+        }
+        try:
+            with self._response_log_lock, open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"⚠️ 记录模型回复失败: {e}")
+
+    def get_parse_stats(self):
+        return dict(self.parse_stats)
+
+    def _record_profile(self, profile, latency_seconds, usage=None, images=1):
+        """按分析模式统计token数和延迟（合批调用按图像数折算每株的输出token）"""
+        usage = usage or {}
+        output_tokens = int(usage.get('output_tokens') or 0)
+        latency_ms = latency_seconds * 1000
+        per_image = output_tokens / max(1, images)
+        stats = self.profile_stats.setdefault(profile, {
+            'calls': 0, 'images': 0, 'input_tokens': 0, 'output_tokens': 0,
+            'avg_output_tokens': 0.0, 'avg_latency_ms': 0.0
+        })
+        first = stats['calls'] == 0
+        stats['calls'] += 1
+        stats['images'] += images
+        stats['input_tokens'] += int(usage.get('input_tokens') or 0)
+        stats['output_tokens'] += output_tokens
+        stats['avg_output_tokens'] = per_image if first else stats['avg_output_tokens'] * 0.9 + per_image * 0.1
+        stats['avg_latency_ms'] = latency_ms if first else stats['avg_latency_ms'] * 0.9 + latency_ms * 0.1
+        print(f"🧾 {profile}模式: 输入 {usage.get('input_tokens', 0)} / 输出 {output_tokens} tokens，"
+              f"{latency_ms:.0f}ms")
+
+    def get_profile_stats(self):
+        """各分析模式的调用次数、token数和延迟"""
+        return {
+            'default': self.analysis_profile,
+            'profiles': {profile: dict(stats, avg_output_tokens=round(stats['avg_output_tokens'], 1),
+                                       avg_latency_ms=round(stats['avg_latency_ms'], 1))
+                         for profile, stats in self.profile_stats.items()}
+        }
+
     def _parse_text_response(self, text_response):
         """解析文本响应为结构化数据"""
         try:
@@ -250,8 +728,7 @@ class CropAnalyzer:
             urgency = "medium"
 
             # 尝试提取健康评分
-            import re
-            score_match = re.search(r'健康评分[:：]\s*(\d+)', text_response)
+            score_match = HEALTH_SCORE_TEXT_PATTERN.search(text_response)
             if score_match:
                 health_score = int(score_match.group(1))
 
@@ -290,17 +767,6 @@ class CropAnalyzer:
             print(f"文本解析失败: {str(e)}")
             return self._generate_professional_simulation(None)
 
-    def _get_default_value(self, field):
-        """获取字段的默认值"""
-        defaults = {
-            'health_score': 75,
-            'analysis_summary': '基于图像特征的专业农业分析',
-            'urgency': 'medium',
-            'issues': [],
-            'recommendations': ['建议进一步观察', '如有问题请咨询农业专家']
-        }
-        return defaults.get(field, '')
-
     def _generate_professional_simulation(self, image):
         """生成专业农业模拟分析结果（基于图像特征）"""
         try:
@@ -329,49 +795,16 @@ class CropAnalyzer:
     def _analyze_image_features_professional(self, image):
         """基于实际图像特征的专业农作物分析"""
         try:
-            # 转换为HSV进行颜色分析
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-            # 分析绿色区域（健康植被）
-            green_lower = np.array([35, 40, 40])
-            green_upper = np.array([85, 255, 255])
-            green_mask = cv2.inRange(hsv, green_lower, green_upper)
-            green_ratio = np.sum(green_mask > 0) / (image.shape[0] * image.shape[1])
-
-            # 分析深绿色（成熟叶片）
-            dark_green_lower = np.array([35, 60, 20])
-            dark_green_upper = np.array([85, 255, 120])
-            dark_green_mask = cv2.inRange(hsv, dark_green_lower, dark_green_upper)
-            dark_green_ratio = np.sum(dark_green_mask > 0) / (image.shape[0] * image.shape[1])
-
-            # 分析浅绿色（新叶）
-            light_green_lower = np.array([35, 30, 120])
-            light_green_upper = np.array([85, 255, 255])
-            light_green_mask = cv2.inRange(hsv, light_green_lower, light_green_upper)
-            light_green_ratio = np.sum(light_green_mask > 0) / (image.shape[0] * image.shape[1])
-
-            # 分析黄色/棕色区域（可能的病害）
-            yellow_lower = np.array([15, 40, 40])
-            yellow_upper = np.array([35, 255, 255])
-            yellow_mask = cv2.inRange(hsv, yellow_lower, yellow_upper)
-            yellow_ratio = np.sum(yellow_mask > 0) / (image.shape[0] * image.shape[1])
-
-            # 分析棕色区域（严重病害或枯死）
-            brown_lower = np.array([8, 50, 20])
-            brown_upper = np.array([20, 255, 200])
-            brown_mask = cv2.inRange(hsv, brown_lower, brown_upper)
-            brown_ratio = np.sum(brown_mask > 0) / (image.shape[0] * image.shape[1])
-
-            # 分析图像亮度
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            brightness = np.mean(gray)
-
-            # 分析图像清晰度
-            laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-
-            # 分析叶片形状特征（边缘检测）
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / (image.shape[0] * image.shape[1])
+            # 单次查表提取所有颜色比例，亮度/清晰度/边缘在缩小后的图像上计算
+            features = self.feature_engine.extract(image)
+            green_ratio = features['green_ratio']
+            dark_green_ratio = features['dark_green_ratio']
+            light_green_ratio = features['light_green_ratio']
+            yellow_ratio = features['yellow_ratio']
+            brown_ratio = features['brown_ratio']
+            brightness = features['brightness']
+            laplacian_var = features['clarity']
+            edge_density = features['edge_density']
 
             # 推断作物类型
             crop_type = self._identify_crop_type(green_ratio, dark_green_ratio, light_green_ratio, edge_density)
@@ -486,7 +919,8 @@ class CropAnalyzer:
         """基于图像特征识别作物类型"""
 
         # 叶菜类特征：浅绿色多，边缘密度高
-        if light_green_ratio > 0.1 and edge_density > 0.05:
+        # （边缘密度阈值按 FeatureEngine 的边缘检测分辨率标定，对应960x720原图上的 0.02/0.05/0.08）
+        if light_green_ratio > 0.1 and edge_density > 0.065:
             if green_ratio > 0.3:
                 return {
                     "name": "叶菜类（疑似生菜/菠菜）",
@@ -511,7 +945,7 @@ class CropAnalyzer:
             }
 
         # 禾本科特征：细长叶片
-        if edge_density > 0.08 and green_ratio > 0.2:
+        if edge_density > 0.095 and green_ratio > 0.2:
             return {
                 "name": "禾本科（疑似小麦/水稻）",
                 "confidence": 60,
@@ -709,7 +1143,7 @@ class CropAnalyzer:
                 "改善土壤条件和水肥管理"
             ])
 
-        if edge_density < 0.02:
+        if edge_density < 0.035:
             issues.append({
                 "type": "图像质量问题",
                 "description": "图像可能模糊或拍摄条件不佳，影响准确诊断",
@@ -969,41 +1403,327 @@ class CropAnalyzer:
 
         return scenario
 
-    def analyze_crop_health(self, image):
-        """分析农作物健康状况 - 专业版本"""
+    def analyze_crop_health(self, image, plant_id=None, triage=True):
+        """分析农作物健康状况 - 专业版本（提供plant_id时使用结果缓存；triage=False时跳过本地分级）"""
         try:
             print(f"🔍 开始专业农业分析 #{self.analysis_count + 1}")
 
+            local_result = None
             if self.is_configured:
+                cached, phash = self._cache_lookup(image, plant_id)
+                if cached:
+                    return cached
+
+                if triage and self.triage_config['enabled']:
+                    local_result = self._generate_professional_simulation(image)
+                    if not self._should_escalate(local_result, plant_id):
+                        return self._with_tier(local_result, TIER_LOCAL, plant_id)
+
                 # 尝试真实AI分析
-                image_base64 = self._image_to_base64(image)
+                image_base64, upload_info = self._image_to_base64(image)
                 if image_base64:
-                    result = self._call_real_ai_api(image_base64)
+                    model, route = self._route(plant_id, local_result)
+                    result = self._call_real_ai_api(image_base64, model)
                     if result["status"] == "ok":
                         print("✅ 真实专业农业AI分析成功")
-                        return result
+                        self._remember_upload(plant_id, image_base64, upload_info)
+                        return self._accept_cloud_result(result, upload_info, plant_id, phash, local_result,
+                                                         model, route)
                     else:
                         print("⚠️ 真实AI分析失败，切换到专业模拟")
                 else:
                     print("⚠️ 图像编码失败，切换到专业模拟")
 
             # 使用专业模拟分析
-            result = self._generate_professional_simulation(image)
+            result = local_result or self._generate_professional_simulation(image)
             print("✅ 专业农业模拟分析完成")
-            return result
+            return self._with_tier(result, TIER_LOCAL_FALLBACK if self.is_configured else TIER_LOCAL, plant_id)
 
         except Exception as e:
-            error_msg = f"专业分析过程出错: {str(e)}"
-            print(f"❌ {error_msg}")
-            return {
-                "status": "error",
-                "message": error_msg,
-                "health_score": 0,
-                "analysis_summary": "专业分析失败",
-                "urgency": "high",
-                "issues": [],
-                "recommendations": ["请检查系统配置", "重新尝试分析"]
-            }
+            return self._analysis_error(e)
+
+    async def analyze_crop_health_async(self, image, plant_id=None, triage=True, on_progress=None):
+        """分析农作物健康状况 - 异步版本，API请求直接在事件循环上进行
+
+        on_progress({字段名: 值}) 在流式输出中字段完整时调用（在事件循环中）
+        """
+        if self.async_client is None:
+            # 没有异步客户端时在线程池中执行同步版本，避免阻塞事件循环
+            return await asyncio.to_thread(self.analyze_crop_health, image, plant_id, triage)
+
+        try:
+            print(f"🔍 开始专业农业分析 #{self.analysis_count + 1}")
+
+            cached, phash = await asyncio.to_thread(self._cache_lookup, image, plant_id)
+            if cached:
+                return cached
+
+            local_result = None
+            if triage and self.triage_config['enabled']:
+                local_result = await asyncio.to_thread(self._generate_professional_simulation, image)
+                if not self._should_escalate(local_result, plant_id):
+                    return self._with_tier(local_result, TIER_LOCAL, plant_id)
+
+            image_base64, upload_info = await asyncio.to_thread(self._image_to_base64, image)
+            if image_base64:
+                model, route = self._route(plant_id, local_result)
+                result = await self._call_cloud_async(plant_id, image_base64, model, on_progress)
+                if result["status"] == "ok":
+                    print("✅ 真实专业农业AI分析成功")
+                    self._remember_upload(plant_id, image_base64, upload_info)
+                    return await asyncio.to_thread(self._accept_cloud_result, result, upload_info, plant_id, phash,
+                                                   local_result, model, route)
+                else:
+                    print("⚠️ 真实AI分析失败，切换到专业模拟")
+            else:
+                print("⚠️ 图像编码失败，切换到专业模拟")
+
+            result = local_result or await asyncio.to_thread(self._generate_professional_simulation, image)
+            print("✅ 专业农业模拟分析完成")
+            return self._with_tier(result, TIER_LOCAL_FALLBACK, plant_id)
+
+        except Exception as e:
+            return self._analysis_error(e)
+
+    def analysis_time_budget(self):
+        """一次云端分析最长可能持续的时间（秒）：分析截止时间 + 被限流后重新排队的累计上限"""
+        budget = self.client_config['analysis_deadline']
+        if self.async_client:
+            budget += self.async_client.scheduler.throttle_max_wait
+        return budget
+
+    def analyze_local_fallback(self, image, plant_id=None):
+        """云端分析未能按时完成时（如调用方等待超时）直接给出本地分析结果"""
+        try:
+            result = self._generate_professional_simulation(image)
+            return self._with_tier(result, TIER_LOCAL_FALLBACK, plant_id)
+        except Exception as e:
+            return self._analysis_error(e)
+
+    def _remember_upload(self, plant_id, image_base64, upload_info):
+        """紧凑模式下保留最近几株的上传图像，按需生成完整分析时不必重新采集和编码"""
+        if self.analysis_profile != PROFILE_COMPACT or plant_id is None or not self.profile_config['keep_uploads']:
+            return
+        self.recent_uploads.pop(plant_id, None)
+        self.recent_uploads[plant_id] = (image_base64, upload_info)
+        while len(self.recent_uploads) > self.profile_config['keep_uploads']:
+            self.recent_uploads.popitem(last=False)
+
+    async def analyze_full_async(self, plant_id):
+        """用该植株最近一次上传的图像按完整模式重新分析（紧凑模式下查看某株的详细报告）"""
+        upload = self.recent_uploads.get(plant_id)
+        if upload is None:
+            return {"status": "error", "message": f"植株 {plant_id} 没有可用于完整分析的图像"}
+
+        image_base64, upload_info = upload
+        model, route = self._route(plant_id, None)
+        print(f"📋 植株 {plant_id} 按需生成完整分析")
+        if self.async_client is not None:
+            result = await self._call_real_ai_api_async(image_base64, model, profile=PROFILE_FULL)
+        else:
+            result = await asyncio.to_thread(self._call_real_ai_api, image_base64, model, PROFILE_FULL)
+        if result["status"] != "ok":
+            return result
+        result["upload"] = upload_info
+        result["model"] = model
+        result["model_route"] = route
+        result["analysis_profile"] = PROFILE_FULL
+        return self._with_tier(result, TIER_CLOUD, plant_id)
+
+    async def probe_cloud_async(self, image):
+        """AI连通性测试：直接调用云端模型，云端不可用时返回错误而不是本地回退结果；
+        不读写结果缓存、不合批，也不计入模型路由/输出模式统计和植株历史"""
+        if self.async_client is None and not self.is_configured:
+            return {"status": "error", "message": "API未正确配置"}
+
+        image_base64, upload_info = await asyncio.to_thread(self._image_to_base64, image)
+        if not image_base64:
+            return {"status": "error", "message": "图像编码失败"}
+
+        if self.async_client is not None:
+            result = await self._call_real_ai_api_async(image_base64, record_stats=False)
+        else:
+            result = await asyncio.to_thread(self._call_real_ai_api, image_base64, None, None, False)
+        if result["status"] == "ok":
+            result["upload"] = upload_info
+            result["model"] = self.model_name
+            result["analysis_tier"] = TIER_CLOUD
+        return result
+
+    def _should_escalate(self, local_result, plant_id):
+        """根据本地分级结果决定是否调用云端模型，记录分级决策到结果的 triage 字段"""
+        config = self.triage_config
+        score = local_result.get('health_score', 0)
+        reason = None
+        if local_result.get('status') != 'ok':
+            reason = 'local_failed'
+        elif config['cloud_max_age'] and plant_id is not None and \
+                time.time() - self.last_cloud_analysis.get(plant_id, 0) > config['cloud_max_age']:
+            reason = 'stale'
+        elif config['critical_below'] <= score < config['healthy_above']:
+            reason = 'uncertain'
+        elif config['escalate_on_disease'] and local_result.get('diseases') and score >= config['healthy_above']:
+            reason = 'disease'
+        elif random.random() < config['sample_rate']:
+            reason = 'sampled'
+
+        local_result['triage'] = {
+            'local_score': score,
+            'decision': 'escalated' if reason else 'accepted',
+            'reason': reason or ('healthy' if score >= config['healthy_above'] else 'critical')
+        }
+        if reason:
+            self.escalation_counts[reason] = self.escalation_counts.get(reason, 0) + 1
+            print(f"⬆️ 本地评分 {score}，升级到云端分析（{reason}）")
+        else:
+            print(f"✅ 本地评分 {score}，采用本地分级结果（{local_result['triage']['reason']}）")
+        return reason is not None
+
+    def _route(self, plant_id, local_result):
+        model, route = self.router.route(plant_id, local_result.get('triage') if local_result else None)
+        if self.router.enabled:
+            print(f"🧭 植株 {plant_id} 使用模型 {model}（{route}）")
+        return model, route
+
+    def _accept_cloud_result(self, result, upload_info, plant_id, phash, local_result=None, model=None, route=None):
+        result["upload"] = upload_info
+        result["model"] = model or self.model_name
+        result["model_route"] = route
+        if local_result is not None:
+            # 保留升级原因，便于对比本地分级和云端结果
+            result["triage"] = local_result["triage"]
+        if plant_id is not None:
+            self.last_cloud_analysis[plant_id] = time.time()
+        self._with_tier(result, TIER_CLOUD, plant_id)
+        self._cache_store(plant_id, phash, result)
+        return result
+
+    def _with_tier(self, result, tier, plant_id=None):
+        """记录结果来源层级，并记入模型路由的植株历史"""
+        if result.get('status') == 'ok':
+            result['analysis_tier'] = tier
+            self.tier_counts[tier] += 1
+            self.router.observe(plant_id, result)
+        return result
+
+    def get_tier_stats(self):
+        total = sum(self.tier_counts.values())
+        return {
+            'triage_enabled': self.triage_config['enabled'],
+            'counts': dict(self.tier_counts),
+            'cloud_fraction': round(self.tier_counts[TIER_CLOUD] / total, 3) if total else 0.0,
+            'escalations': dict(self.escalation_counts)
+        }
+
+    async def iter_analyze_batch(self, items, concurrency=None):
+        """批量分析（异步生成器）：items 为可迭代的 (键, 图像, 植株ID)，按完成顺序产出 (键, 结果)
+
+        items 在线程中逐个读取（可以是边解码边产出的生成器），同时在途的图像不超过concurrency张；
+        图像为None（解码失败）时直接产出错误结果，不进入分析
+        """
+        concurrency = max(1, int(concurrency or self.client_config['max_concurrency']))
+        iterator = iter(items)
+        pending = set()
+        exhausted = False
+
+        async def run(key, image, plant_id):
+            if image is None:
+                return key, {"status": "error", "message": f"无法读取图像: {key}"}
+            return key, await self.analyze_crop_health_async(image, plant_id)
+
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                item = await asyncio.to_thread(next, iterator, None)
+                if item is None:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(run(*item)))
+
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+    async def analyze_batch_async(self, images, plant_ids=None, concurrency=None):
+        """批量分析图像，返回与输入顺序一致的结果列表"""
+        plant_ids = plant_ids or [None] * len(images)
+        results = [None] * len(images)
+        items = ((index, image, plant_id) for index, (image, plant_id) in enumerate(zip(images, plant_ids)))
+        async for index, result in self.iter_analyze_batch(items, concurrency):
+            results[index] = result
+        return results
+
+    def analyze_batch(self, images, plant_ids=None, concurrency=None):
+        """批量分析图像（同步版本，不能在事件循环中调用），返回与输入顺序一致的结果列表"""
+        async def run():
+            try:
+                return await self.analyze_batch_async(images, plant_ids, concurrency)
+            finally:
+                # 连接池绑定到本次临时创建的事件循环，结束前关闭
+                if self.async_client:
+                    await self.async_client.close()
+
+        return asyncio.run(run())
+
+    def _cache_lookup(self, image, plant_id):
+        """查询结果缓存，返回 (缓存的结果或None, 图像哈希)"""
+        if self.cache is None or plant_id is None:
+            return None, None
+
+        phash = self.cache.image_hash(image)
+        result, distance = self.cache.get(plant_id, phash)
+        if result is None:
+            return None, phash
+
+        print(f"♻️ 植株 {plant_id} 命中分析缓存（哈希距离 {distance}）")
+        return dict(result, cached=True, cache_distance=distance), phash
+
+    def _cache_store(self, plant_id, phash, result):
+        # 只缓存真实AI的结果，模拟分析失败回退的结果不缓存，下次仍会重试API
+        if self.cache is not None and phash is not None:
+            self.cache.put(plant_id, phash, result)
+
+    def get_circuit_status(self):
+        return self.circuit_breaker.stats()
+
+    def get_cache_stats(self):
+        return self.cache.stats() if self.cache else None
+
+    def _analysis_error(self, error):
+        error_msg = f"专业分析过程出错: {str(error)}"
+        print(f"❌ {error_msg}")
+        return {
+            "status": "error",
+            "message": error_msg,
+            "health_score": 0,
+            "analysis_summary": "专业分析失败",
+            "urgency": "high",
+            "issues": [],
+            "recommendations": ["请检查系统配置", "重新尝试分析"]
+        }
+
+    def get_client_stats(self):
+        """异步客户端的请求数、并发和延迟统计"""
+        return self.async_client.stats() if self.async_client else None
+
+    def get_batch_stats(self):
+        if not self.batching_enabled:
+            return None
+        return {model: batcher.stats() for model, batcher in self.batchers.items()}
+
+    def get_router_stats(self):
+        """各模型的调用次数、延迟、token数和费用"""
+        return self.router.stats()
+
+    async def close(self):
+        """关闭异步客户端的连接池"""
+        if self.async_client:
+            await self.async_client.close()
+        if self.cache:
+            self.cache.close()
+        if self._sdk_executor:
+            self._sdk_executor.shutdown(wait=False)
 
     def test_connection(self):
         """测试API连接"""
@@ -1015,7 +1735,7 @@ class CropAnalyzer:
             test_image = np.zeros((100, 100, 3), dtype=np.uint8)
             test_image[:] = (0, 255, 0)  # 绿色测试图像
 
-            result = self.analyze_crop_health(test_image)
+            result = self.analyze_crop_health(test_image, triage=False)
 
             if result["status"] == "ok":
                 return {"status": "ok", "message": "专业农业AI连接测试成功"}
@@ -1028,6 +1748,14 @@ class CropAnalyzer:
 
 # 测试代码
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1:
+        # 离线批量分析：python crop_analyzer_dashscope.py <目录|通配符|视频> [选项]
+        from batch_analysis import main as batch_main
+
+        sys.exit(batch_main())
+
     # 测试专业分析器
     analyzer = CropAnalyzer(
         api_key="test-key",
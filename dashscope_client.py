@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+DashScope异步HTTP客户端
+直接调用DashScope多模态生成接口，运行在事件循环上：
+连接池复用keep-alive连接，配额调度器（quota_scheduler.py）控制请求速率和自适应并发上限，
+被限流(429)的请求暂停后重新排队；每个请求有独立的截止时间（不含排队等待）；
+支持SSE流式增量输出，每收到一段文本立即回调；base_url可配置，便于对接本地模拟服务器（mock_dashscope_server.py）
+"""
+
+import asyncio
+import json
+import time
+
+from quota_scheduler import OUTCOME_ERROR, OUTCOME_OK, OUTCOME_OVERLOAD, OUTCOME_THROTTLED, QuotaScheduler
+
+try:
+    import aiohttp
+
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com"
+MULTIMODAL_GENERATION_PATH = "/api/v1/services/aigc/multimodal-generation/generation"
+
+DEFAULT_CLIENT_CONFIG = {
+    'base_url': DEFAULT_BASE_URL,
+    'max_concurrency': 4,  # 同时进行的请求数上限（自适应并发的上限，配额调度见config['quota']）
+    'request_timeout': 60.0,  # 单个请求截止时间（秒），不含等待并发名额和速率许可的时间
+    'connect_timeout': 10.0,
+    'pool_size': 8,  # 连接池最大连接数
+    'keepalive_timeout': 30.0,
+    # 单次分析的截止时间（秒），包含所有重试和退避等待
+    'analysis_deadline': 20.0,
+    'retry_max_attempts': 3,
+    'retry_base_delay': 0.5,
+    'retry_max_delay': 4.0,
+    # 熔断器：连续失败多少次后打开，打开多久后放行探测请求
+    'breaker_failure_threshold': 3,
+    'breaker_recovery_timeout': 30.0,
+    # 流式输出：模型逐段返回，字段完整后立即推送分析进度（不与多图合批同时生效）
+    'streaming': False,
+    # 原始回复记录文件（JSONL），None表示不记录；用于积累 parser_benchmark.py 的测试语料
+    'response_log': None
+}
+
+# 可重试的HTTP状态码（限流和服务端错误）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# 服务端过载（降低并发上限）
+OVERLOAD_STATUS_CODES = {500, 502, 503, 504}
+
+
+class DashScopeError(Exception):
+    """DashScope接口调用失败"""
+
+    def __init__(self, message, status_code=None, code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.retry_after = retry_after  # 限流响应的 Retry-After（秒）
+
+    @property
+    def throttled(self):
+        """被限流（HTTP 429 或 Throttling.* 错误码）"""
+        return self.status_code == 429 or str(self.code or '').startswith('Throttling')
+
+    @property
+    def retryable(self):
+        """超时、网络错误、限流和服务端错误可以重试；鉴权和参数错误重试无意义"""
+        return self.code in ('Timeout', 'NetworkError') or self.status_code in RETRYABLE_STATUS_CODES
+
+
+class DashScopeAsyncClient:
+    """DashScope异步客户端 - 连接池 + 配额调度 + 请求截止时间"""
+
+    def __init__(self, api_key, config=None):
+        self.api_key = api_key
+        self.config = dict(DEFAULT_CLIENT_CONFIG, **(config or {}))
+        self.base_url = self.config['base_url'].rstrip('/')
+
+        # 会话绑定到创建它的事件循环
+        self._session = None
+        self._loop = None
+        # 请求速率和并发上限（config['quota']覆盖 quota_scheduler.DEFAULT_QUOTA_CONFIG）
+        self.scheduler = QuotaScheduler.from_config(self.config.get('quota'), self.config['max_concurrency'])
+
+        # 统计信息
+        self.request_count = 0
+        self.error_count = 0
+        self.timeout_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.avg_latency_ms = 0.0
+        self.stream_count = 0
+        self.avg_first_token_ms = 0.0
+
+    def _ensure_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.config['pool_size'],
+                keepalive_timeout=self.config['keepalive_timeout'])
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'Authorization': f'Bearer {self.api_key}'},
+                timeout=aiohttp.ClientTimeout(connect=self.config['connect_timeout']))
+            self._loop = loop
+        return self._session
+
+    async def multimodal_generation(self, model, messages, timeout=None, timing=None, **parameters):
+        """调用多模态生成接口，返回 (文本内容, 原始响应JSON)；timing 字典的填写方式见 _schedule"""
+        if not AIOHTTP_AVAILABLE:
+            raise DashScopeError("aiohttp库未安装，无法使用异步客户端")
+
+        deadline = timeout or self.config['request_timeout']
+        payload = {
+            'model': model,
+            'input': {'messages': messages},
+            'parameters': parameters
+        }
+
+        return await self._schedule(lambda: self._post(MULTIMODAL_GENERATION_PATH, payload), deadline,
+                                    timing=timing)
+
+    async def _schedule(self, send, deadline, can_requeue=None, timing=None):
+        """取得配额调度许可后发送请求；deadline只限制请求本身，
+        被限流的请求在调度器暂停后重新排队，累计超过 throttle_max_wait 才作为失败抛出
+
+        timing 字典（可选）写入 latency（最后一次实际发送的耗时，秒）、queue_wait（等待许可和
+        被限流后重新排队的累计时间，秒）和 requeues，调用方据此区分模型延迟和配额排队
+        """
+        if timing is None:
+            timing = {}
+        timing.update(latency=0.0, queue_wait=0.0, requeues=0)
+        first_throttle = None
+        while True:
+            queued_at = time.monotonic()
+            await self.scheduler.acquire()
+            start_time = time.monotonic()
+            timing['queue_wait'] += start_time - queued_at
+            try:
+                result = await asyncio.wait_for(send(), deadline)
+            except asyncio.TimeoutError:
+                timing['latency'] = time.monotonic() - start_time
+                self.scheduler.release(OUTCOME_OVERLOAD, timing['latency'])
+                self.timeout_count += 1
+                raise DashScopeError(f"请求超时（{deadline}秒）", code='Timeout')
+            except DashScopeError as e:
+                latency = timing['latency'] = time.monotonic() - start_time
+                if not e.throttled:
+                    self.scheduler.release(
+                        OUTCOME_OVERLOAD if e.status_code in OVERLOAD_STATUS_CODES else OUTCOME_ERROR, latency)
+                    raise
+                self.scheduler.release(OUTCOME_THROTTLED, latency)
+                delay = self.scheduler.throttle(e.retry_after)
+                now = time.monotonic()
+                first_throttle = first_throttle or now
+                if (can_requeue is not None and not can_requeue()) or \
+                        now + delay - first_throttle > self.scheduler.throttle_max_wait:
+                    self.scheduler.gave_up += 1
+                    raise
+                self.scheduler.requeued += 1
+                # 被限流的这次发送不算模型延迟，计入排队时间
+                timing['queue_wait'] += latency
+                timing['requeues'] += 1
+                print(f"⏳ 云端限流，{delay:.1f}秒后重新排队")
+                continue
+            except BaseException:
+                timing['latency'] = time.monotonic() - start_time
+                self.scheduler.release(OUTCOME_ERROR, timing['latency'])
+                raise
+            timing['latency'] = time.monotonic() - start_time
+            self.scheduler.release(OUTCOME_OK, timing['latency'])
+            return result
+
+    async def _post(self, path, payload):
+        session = self._ensure_session()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start_time = time.perf_counter()
+        try:
+            async with session.post(self.base_url + path, json=payload) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    self.error_count += 1
+                    raise DashScopeError(f"API响应不是有效JSON: {response.status}",
+                                         status_code=response.status, code='InvalidResponse')
+                if response.status != 200:
+                    self.error_count += 1
+                    raise DashScopeError(
+                        f"API调用失败: {response.status} {body.get('message', '')}".strip(),
+                        status_code=response.status, code=body.get('code'),
+                        retry_after=retry_after_seconds(response.headers))
+        except aiohttp.ClientError as e:
+            self.error_count += 1
+            raise DashScopeError(f"网络请求失败: {e}", code='NetworkError')
+        finally:
+            self.in_flight -= 1
+
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.request_count += 1
+        self.avg_latency_ms = elapsed_ms if self.request_count == 1 else \
+            self.avg_latency_ms * 0.9 + elapsed_ms * 0.1
+
+        return extract_message_content(body), body
+
+    async def multimodal_generation_stream(self, model, messages, on_delta, timeout=None, timing=None,
+                                           **parameters):
+        """流式调用多模态生成接口（SSE增量输出），每收到一段新文本调用 on_delta(文本)，
+        返回 (完整文本, 最后一个事件JSON)"""
+        if not AIOHTTP_AVAILABLE:
+            raise DashScopeError("aiohttp库未安装，无法使用异步客户端")
+
+        deadline = timeout or self.config['request_timeout']
+        payload = {
+            'model': model,
+            'input': {'messages': messages},
+            'parameters': dict(parameters, incremental_output=True)
+        }
+
+        delivered = []
+
+        def forward(text):
+            delivered.append(len(text))
+            on_delta(text)
+
+        # 已经输出过文本的流不能重新排队（回调方会收到重复的文本）
+        return await self._schedule(lambda: self._post_stream(MULTIMODAL_GENERATION_PATH, payload, forward),
+                                    deadline, can_requeue=lambda: not delivered, timing=timing)
+
+    async def _post_stream(self, path, payload, on_delta):
+        session = self._ensure_session()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start_time = time.perf_counter()
+        first_token_ms = None
+        parts = []
+        last_event = {}
+        try:
+            headers = {'X-DashScope-SSE': 'enable', 'Accept': 'text/event-stream'}
+            async with session.post(self.base_url + path, json=payload, headers=headers) as response:
+                if response.status != 200:
+                    self.error_count += 1
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        body = {}
+                    raise DashScopeError(
+                        f"API调用失败: {response.status} {body.get('message', '')}".strip(),
+                        status_code=response.status, code=body.get('code'),
+                        retry_after=retry_after_seconds(response.headers))
+
+                event_status = 200
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+                    if line.startswith(':HTTP_STATUS/'):
+                        event_status = int(line.split('/', 1)[1])
+                        continue
+                    if not line.startswith('data:'):
+                        continue
+
+                    try:
+                        event = json.loads(line[5:])
+                    except ValueError:
+                        self.error_count += 1
+                        raise DashScopeError("流式响应事件不是有效JSON", code='InvalidResponse')
+                    if event_status != 200 or 'output' not in event:
+                        # 流中途的错误事件
+                        self.error_count += 1
+                        raise DashScopeError(f"API调用失败: {event.get('message', '')}",
+                                             status_code=event_status, code=event.get('code'))
+
+                    text = content_text(extract_message_content(event))
+                    if text:
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - start_time) * 1000
+                        parts.append(text)
+                        on_delta(text)
+                    last_event = event
+        except aiohttp.ClientError as e:
+            self.error_count += 1
+            raise DashScopeError(f"网络请求失败: {e}", code='NetworkError')
+        finally:
+            self.in_flight -= 1
+
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.request_count += 1
+        self.avg_latency_ms = elapsed_ms if self.request_count == 1 else \
+            self.avg_latency_ms * 0.9 + elapsed_ms * 0.1
+        if first_token_ms is not None:
+            self.stream_count += 1
+            self.avg_first_token_ms = first_token_ms if self.stream_count == 1 else \
+                self.avg_first_token_ms * 0.9 + first_token_ms * 0.1
+
+        return ''.join(parts), last_event
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self):
+        return {
+            'base_url': self.base_url,
+            'max_concurrency': self.config['max_concurrency'],
+            'requests': self.request_count,
+            'errors': self.error_count,
+            'timeouts': self.timeout_count,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'avg_latency_ms': round(self.avg_latency_ms, 2),
+            'streams': self.stream_count,
+            'avg_first_token_ms': round(self.avg_first_token_ms, 2),
+            'quota': self.scheduler.stats()
+        }
+
+
+def retry_after_seconds(headers):
+    """响应头中的 Retry-After 秒数（不存在或不是数字时返回None）"""
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_message_content(body):
+    """从DashScope响应中取出模型回复内容（字符串或 [{'text': ...}] 列表）"""
+    try:
+        return body['output']['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        raise DashScopeError("API响应格式错误：缺少 output.choices[0].message.content")
+
+
+def content_text(content):
+    """消息内容（字符串或 [{'text': ...}] 列表）中的文本"""
+    if isinstance(content, list):
+        return ''.join(item.get('text', '') for item in content if isinstance(item, dict))
+    return content or ''
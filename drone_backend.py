@@ -10,10 +10,10 @@ import os
 import json
 import asyncio
 import websockets
-import threading
 import time
 import argparse
 from datetime import datetime
+from concurrent.futures import CancelledError as FutureCancelledError, TimeoutError as FutureTimeoutError
 import traceback
 import cv2
 import numpy as np
@@ -37,21 +37,29 @@ except ImportError as e:
     TELLO_AVAILABLE = False
     print(f"❌ djitellopy库导入失败: {e}")
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
 # QR码检测库导入 - 这是关键！
-try:
-    from pyzbar import pyzbar
+from qr_detection import (PYZBAR_AVAILABLE, DEFAULT_CASCADE_STAGES, QR_BACKENDS, ProcessPoolQRDetector,
+                          QRDecodeCascade, QRMarkerTracker, available_qr_backends, decode_qr_frame)
 
-    PYZBAR_AVAILABLE = True
+if PYZBAR_AVAILABLE:
     print("✅ pyzbar QR码检测库加载成功")
-except ImportError:
-    PYZBAR_AVAILABLE = False
-    print("❌ pyzbar库未安装！这是检测QR码的必需库")
-    print("请运行: pip install pyzbar")
+else:
+    print("❌ pyzbar库未安装！默认QR码解码后端不可用")
+    print("请运行: pip install pyzbar，或使用 --qr-backend opencv")
     if sys.platform.startswith('win'):
         print("Windows用户可能还需要安装: pip install zbar-py")
 
+from video_pipeline import VideoPipeline, pack_binary_frame, BINARY_FRAME_VERSION, BINARY_FRAME_HEADER
+from client_channel import ClientChannel, AdaptiveQualityController
+from analysis_scheduler import AnalysisExecutor, SingleFlight, SUBMIT_COALESCED, SUBMIT_REJECTED
+from analysis_cache import AnalysisCache
+from analysis_codebook import CODEBOOK
+from change_gate import DEFAULT_CHANGE_GATE_CONFIG, ChangeGate
+from plant_roi import DEFAULT_ROI_CONFIG, PlantROIExtractor
+
 # AI分析器导入
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 try:
     from crop_analyzer_dashscope import CropAnalyzer
 
@@ -65,13 +73,15 @@ except ImportError as e:
 class QRDroneBackendService:
     """专用QR码检测的无人机后端服务"""
 
-    def __init__(self, ws_port=3002):
+    def __init__(self, ws_port=3002, qr_pool_workers=0, qr_tracking=False, qr_backend='pyzbar'):
         self.ws_port = ws_port
         self.drone = None
         self.crop_analyzer = None
-        self.video_thread = None
+        self.video_pipeline = None
         self.is_running = True
-        self.connected_clients = set()
+        # 每个客户端一个发送通道（独立发送队列和发送任务）
+        self.client_channels = {}
+        self.client_stats_interval = 5.0  # 客户端统计广播间隔（秒）
 
         # 主事件循环引用
         self.main_loop = None
@@ -100,13 +110,101 @@ class QRDroneBackendService:
         self.last_detection_time = 0
         self.detection_interval = 0.5  # 每0.5秒检测一次
 
-        # 检查QR码检测库
-        if not PYZBAR_AVAILABLE:
-            print("⚠️ 警告：pyzbar库未安装，QR码检测将不可用")
-            print("解决方案：pip install pyzbar")
+        # QR码检测执行方式：'inline'（检测线程内解码，受detection_interval限制）
+        # 或 'process_pool'（多进程解码，每帧都提交，空闲槽位不足时丢帧）
+        # tracking：跟踪已识别标记，逐帧只解码标记附近区域，整帧扫描按full_scan_interval进行（仅inline方式）
+        # cascade_stages：解码级联阶段，按顺序尝试，前面阶段解码到即停止
+        self.qr_detection_config = {
+            'backend': qr_backend,  # 解码后端: pyzbar / opencv / opencv_aruco
+            'cascade_stages': list(DEFAULT_CASCADE_STAGES),
+            'cascade_downscale': 0.5,
+            'executor': 'process_pool' if qr_pool_workers > 0 else 'inline',
+            'pool_workers': qr_pool_workers,
+            'pool_slots_per_worker': 2,
+            'tracking': qr_tracking,
+            'full_scan_interval': 0.5,
+            'roi_padding': 0.5,
+            'max_track_misses': 3
+        }
+        self.qr_pool_detector = None
+        self.qr_tracker = None
+        self.qr_cascade = QRDecodeCascade(**self.get_cascade_options())
+        self.pending_detection_frames = {}  # 帧序号 -> 已提交解码的帧
+
+        # 视频流水线配置（采集 → 检测 → 编码 → 广播）
+        self.video_config = {
+            'capture_fps': 30,
+            'jpeg_quality': 85,
+            'overlay_ttl': 1.0,  # 检测框在后续帧上保留的时间（秒）
+            # 自适应码率：按客户端网络状况在(缩放比例, JPEG质量)档位间切换
+            'adaptive_bitrate': True,
+            'quality_ladder': [(1.0, 85), (0.75, 70), (0.5, 60), (0.35, 50)],
+            'abr_degrade_send_ms': 80.0,  # 平均发送耗时超过该值时降档
+            'abr_upgrade_send_ms': 25.0,  # 平均发送耗时低于该值持续一段时间后升档
+            'abr_upgrade_after': 60,  # 连续顺畅发送多少帧后升档
+            'queue_sizes': {
+                'detect': 1,
+                'encode': 2,
+                'broadcast': 2
+            }
+        }
+        self.frame_seq = 0
+        # 当前客户端需要的质量档位集合，编码阶段每帧每档只编码一次
+        self.requested_rungs = frozenset()
+        # 检测阶段产出的绘制信息：(时间戳, [(qr_info, color), ...])
+        self.qr_overlay = (0, [])
+        self.qr_overlay_seq = 0
+
+        # 检查QR码解码后端
+        if not self.is_qr_backend_available():
+            print(f"⚠️ 警告：QR码解码后端 {qr_backend} 不可用，QR码检测将不可用")
+            print(f"当前可用的解码后端: {', '.join(available_qr_backends()) or '无'}")
+
+        # AI分析执行器配置：固定工作线程 + 有界优先级队列
+        self.analysis_config = {
+            'workers': 2,
+            'max_queue': 16,  # 排队任务上限（每个任务持有一帧图像）
+            'health_memory': 600.0,  # 按最近分析结果排序的有效期（秒）
+            'urgent_health_score': 50,  # 健康评分低于该值的植株优先分析
+            'healthy_score': 75,
+            # 植株分析进行中又收到新请求时：False共享进行中的结果，True等其完成后用新画面再分析一次
+            'refresh_inflight': False,
+            # 工作线程等待事件循环上分析结果的时间 = 分析截止时间 + 限流重新排队上限 + 该余量（覆盖合批窗口、等待配额许可等），
+            # 超时后改用本地分析
+            'result_timeout_margin': 15.0
+        }
+        # 同一植株同时只进行一次API调用，后来的请求共享其结果
+        self.analysis_flights = SingleFlight()
+
+        # 以QR码为锚点的植株区域提取配置（config.json中的plant_roi覆盖默认值）
+        self.plant_roi_config = dict(DEFAULT_ROI_CONFIG)
+        # 画面无明显变化的植株复用上次结果（config.json中的change_gate覆盖默认值）
+        self.change_gate_config = dict(DEFAULT_CHANGE_GATE_CONFIG)
 
         # 初始化AI分析器
         self.init_ai_analyzer()
+        self.roi_extractor = PlantROIExtractor.from_config(self.plant_roi_config)
+        self.change_gate = ChangeGate.from_config(self.change_gate_config) if self.crop_analyzer else None
+
+        # 工作线程数依赖分析器的合批配置，在分析器初始化之后创建执行器
+        self.analysis_executor = AnalysisExecutor(
+            self.run_plant_analysis,
+            workers=self.analysis_worker_count(),
+            max_queue=self.analysis_config['max_queue'],
+            health_memory=self.analysis_config['health_memory'],
+            urgent_health_score=self.analysis_config['urgent_health_score'],
+            healthy_score=self.analysis_config['healthy_score'],
+            on_status=self.publish_analysis_queue_status)
+        if self.crop_analyzer:
+            self.analysis_executor.start()
+
+    def analysis_worker_count(self):
+        """AI分析工作线程数"""
+        workers = self.analysis_config['workers']
+        if self.crop_analyzer and self.crop_analyzer.batching_enabled:
+            # 每个工作线程同时只等待一株的结果：线程数至少为两批，才能在一批进行中凑下一批
+            workers = max(workers, self.crop_analyzer.batch_config['max_batch_size'] * 2)
+        return workers
 
     def init_ai_analyzer(self):
         """初始化AI分析器"""
@@ -118,17 +216,29 @@ class QRDroneBackendService:
             # 从环境变量或配置文件获取API配置
             api_key = os.getenv('DASHSCOPE_API_KEY')
             app_id = os.getenv('DASHSCOPE_APP_ID')
-
-            if not api_key or not app_id:
-                config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-                if os.path.exists(config_path):
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
-                        api_key = api_key or config.get('dashscope_api_key')
-                        app_id = app_id or config.get('dashscope_app_id')
+            client_config = {}
+            cache_config = {}
+
+            config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+            if os.path.exists(config_path):
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                    api_key = api_key or config.get('dashscope_api_key')
+                    app_id = app_id or config.get('dashscope_app_id')
+                    # 异步客户端配置（base_url、并发上限、超时等）
+                    client_config = config.get('dashscope_client', {})
+                    # 分析结果缓存配置（TTL、汉明距离阈值、磁盘路径等）
+                    cache_config = config.get('analysis_cache', {})
+                    self.plant_roi_config.update(config.get('plant_roi', {}))
+                    self.change_gate_config.update(config.get('change_gate', {}))
+
+            if os.getenv('DASHSCOPE_BASE_URL'):
+                client_config['base_url'] = os.getenv('DASHSCOPE_BASE_URL')
 
             if api_key and app_id:
-                self.crop_analyzer = CropAnalyzer(api_key=api_key, app_id=app_id)
+                self.crop_analyzer = CropAnalyzer(api_key=api_key, app_id=app_id, config=client_config,
+                                                  cache=AnalysisCache.from_config(cache_config))
+                self.crop_analyzer.circuit_breaker.on_state_change = self.publish_ai_circuit_status
                 print("✅ AI分析器初始化成功")
             else:
                 print("⚠️ 未找到有效的AI API配置")
@@ -146,19 +256,27 @@ class QRDroneBackendService:
         async def handle_client(websocket, path):
             client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
             print(f"🔗 客户端连接: {client_ip}")
-            self.connected_clients.add(websocket)
+            channel = ClientChannel(websocket, self.build_video_payload,
+                                    quality=self.create_quality_controller(),
+                                    on_rung_change=self.update_requested_rungs)
+            channel.start()
+            self.client_channels[websocket] = channel
+            self.update_requested_rungs()
 
             try:
                 # 发送连接确认
-                await websocket.send(json.dumps({
-                    'type': 'connection_established',
-                    'data': {
-                        'server_time': datetime.now().isoformat(),
-                        'qr_detection_available': PYZBAR_AVAILABLE,
-                        'message': 'QR码专用检测服务已就绪'
-                    },
-                    'timestamp': datetime.now().isoformat()
-                }, ensure_ascii=False))
+                await self.send_to_client(websocket, 'connection_established', {
+                    'server_time': datetime.now().isoformat(),
+                    'qr_detection_available': self.is_qr_backend_available(),
+                    'qr_backend': self.qr_detection_config['backend'],
+                    'video_protocols': ['json', 'binary'],
+                    'binary_frame_version': BINARY_FRAME_VERSION,
+                    'ai_circuit': self.crop_analyzer.get_circuit_status() if self.crop_analyzer else None,
+                    # 紧凑模式的分析结果只含代码，前端按代码表展开
+                    'analysis_profile': self.crop_analyzer.analysis_profile if self.crop_analyzer else None,
+                    'analysis_codebook': CODEBOOK,
+                    'message': 'QR码专用检测服务已就绪'
+                })
 
                 async for message in websocket:
                     await self.handle_websocket_message(websocket, message)
@@ -168,108 +286,276 @@ class QRDroneBackendService:
                 print(f"❌ WebSocket处理错误: {e}")
                 traceback.print_exc()
             finally:
-                self.connected_clients.discard(websocket)
+                channel.close()
+                self.client_channels.pop(websocket, None)
+                self.update_requested_rungs()
 
         # 启动服务器
         server = await websockets.serve(handle_client, "localhost", self.ws_port)
         print(f"✅ QR码检测WebSocket服务器已启动: ws://localhost:{self.ws_port}")
 
+        # 定期广播客户端发送统计
+        asyncio.create_task(self.client_stats_worker())
+
         return server
 
-    def video_stream_worker(self):
-        """视频流工作线程 - QR码专用版本"""
-        print("📹 QR码检测视频流已启动")
+    def build_video_pipeline(self):
+        """构建视频流水线：采集 → 检测 / 编码 → 广播"""
+        queue_sizes = self.video_config['queue_sizes']
+        pipeline = VideoPipeline('qr_video')
+
+        detect_queue = pipeline.create_queue('detect', queue_sizes['detect'])
+        encode_queue = pipeline.create_queue('encode', queue_sizes['encode'])
+        broadcast_queue = pipeline.create_queue('broadcast', queue_sizes['broadcast'])
+
+        # 采集帧同时送入检测分支和编码分支，检测慢不会拖慢预览
+        pipeline.add_stage('capture', self.capture_frame_stage,
+                           output_queues=[detect_queue, encode_queue],
+                           interval=1.0 / self.video_config['capture_fps'])
+        pipeline.add_stage('detect', self.detect_frame_stage, input_queue=detect_queue)
+        pipeline.add_stage('encode', self.encode_frame_stage, input_queue=encode_queue,
+                           output_queues=[broadcast_queue])
+        pipeline.add_stage('broadcast', self.broadcast_frame_stage, input_queue=broadcast_queue)
+
+        return pipeline
+
+    def capture_frame_stage(self):
+        """采集阶段 - 从无人机读取最新帧"""
+        if not self.video_streaming or not self.drone:
+            return None
+
+        frame_read = self.drone.get_frame_read()
+        if frame_read is None:
+            time.sleep(0.1)
+            return None
+
+        frame = frame_read.frame
+        if frame is None:
+            time.sleep(0.1)
+            return None
+
+        self.update_fps_stats()
+        self.frame_seq += 1
+
+        return {
+            'seq': self.frame_seq,
+            'timestamp': time.time(),
+            'frame': frame
+        }
+
+    def detect_frame_stage(self, packet):
+        """检测阶段 - 按检测间隔对最新帧进行QR码检测"""
+        if self.qr_pool_detector is not None:
+            self.detect_frame_pooled(packet)
+            return None
 
-        frame_retry_count = 0
-        max_retry = 10
+        # 跟踪模式下逐帧只解码标记附近区域，整帧扫描间隔由跟踪器控制
+        current_time = time.time()
+        if (self.qr_tracker is None and
+                (current_time - self.last_detection_time) < self.detection_interval):
+            return None
+
+        self.last_detection_time = current_time
+        self.run_qr_detection(packet['frame'], packet['seq'])
+        return None
+
+    def detect_frame_pooled(self, packet):
+        """检测阶段（多进程）- 每帧提交给工作进程，并处理已完成的结果"""
+        if self.is_qr_detection_active():
+            if self.qr_pool_detector.submit(packet['seq'], packet['frame']):
+                self.pending_detection_frames[packet['seq']] = packet['frame']
+
+        for seq, codes in self.qr_pool_detector.poll_results():
+            frame = self.pending_detection_frames.pop(seq, None)
+            if frame is None:
+                continue
+            detected_qrs = [self.build_qr_info(code) for code in codes]
+            self.apply_qr_detections(frame, detected_qrs, seq)
+
+        # 清理解码失败或被丢弃的帧，避免长期占用内存
+        oldest_seq = packet['seq'] - self.qr_pool_detector.slot_count * 4
+        for seq in [s for s in self.pending_detection_frames if s < oldest_seq]:
+            del self.pending_detection_frames[seq]
+
+    def encode_frame_stage(self, packet):
+        """编码阶段 - 绘制覆盖信息，并为客户端需要的每个质量档位各编码一次JPEG"""
+        rungs = self.requested_rungs
+        if not rungs:
+            # 没有客户端时不做编码
+            return None
+
+        processed_frame = self.render_frame(packet['frame'])
+        ladder = self.get_quality_ladder()
+        height, width = processed_frame.shape[:2]
+
+        renditions = {}
+        for rung in sorted(rungs):
+            scale, quality = ladder[min(rung, len(ladder) - 1)]
+            if scale < 1.0:
+                target_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+                image = cv2.resize(processed_frame, target_size, interpolation=cv2.INTER_AREA)
+            else:
+                image = processed_frame
+
+            _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            renditions[rung] = {
+                'width': image.shape[1],
+                'height': image.shape[0],
+                'jpeg': buffer.tobytes()
+            }
+
+        return {
+            'seq': packet['seq'],
+            'timestamp': packet['timestamp'],
+            'renditions': renditions
+        }
 
-        while self.video_streaming and self.drone:
+    def get_quality_ladder(self):
+        """获取质量档位表，关闭自适应码率时只有最高质量一档"""
+        if not self.video_config['adaptive_bitrate']:
+            return [(1.0, self.video_config['jpeg_quality'])]
+        return self.video_config['quality_ladder']
+
+    def create_quality_controller(self):
+        """为新客户端创建自适应质量控制器"""
+        if not self.video_config['adaptive_bitrate']:
+            return None
+        return AdaptiveQualityController(
+            len(self.video_config['quality_ladder']),
+            degrade_send_ms=self.video_config['abr_degrade_send_ms'],
+            upgrade_send_ms=self.video_config['abr_upgrade_send_ms'],
+            upgrade_after=self.video_config['abr_upgrade_after']
+        )
+
+    def update_requested_rungs(self):
+        """刷新客户端需要的质量档位集合（供编码线程读取）"""
+        self.requested_rungs = frozenset(channel.rung for channel in self.client_channels.values())
+
+    def broadcast_frame_stage(self, packet):
+        """广播阶段 - 将编码后的帧交给各客户端发送通道（不等待发送完成）"""
+        if self.main_loop and not self.main_loop.is_closed():
             try:
-                frame_read = self.drone.get_frame_read()
-                if frame_read is None:
-                    time.sleep(0.1)
-                    continue
+                self.main_loop.call_soon_threadsafe(self.dispatch_video_frame, packet)
+            except RuntimeError:
+                pass
+        return None
+
+    def get_video_pipeline_stats(self):
+        """获取视频流水线各阶段的队列深度和丢帧统计"""
+        if not self.video_pipeline:
+            return {'running': False, 'stages': {}}
+
+        stats = self.video_pipeline.stats()
+        stats['running'] = self.video_pipeline.is_alive()
+        stats['fps'] = self.fps
+        if self.qr_pool_detector is not None:
+            stats['qr_pool'] = self.qr_pool_detector.stats()
+        if self.qr_tracker is not None:
+            stats['qr_tracker'] = self.qr_tracker.stats()
+        stats['qr_cascade'] = self.qr_cascade.stats.snapshot()
+        stats['analysis_queue'] = self.analysis_executor.stats()
+        stats['analysis_single_flight'] = self.analysis_flights.stats()
+        if self.crop_analyzer and self.crop_analyzer.get_client_stats():
+            stats['ai_client'] = self.crop_analyzer.get_client_stats()
+        if self.crop_analyzer:
+            stats['ai_circuit'] = self.crop_analyzer.get_circuit_status()
+            stats['ai_upload'] = self.crop_analyzer.get_upload_stats()
+            stats['local_features'] = self.crop_analyzer.feature_engine.stats()
+            stats['ai_batching'] = self.crop_analyzer.get_batch_stats()
+            stats['analysis_tiers'] = self.crop_analyzer.get_tier_stats()
+            stats['ai_models'] = self.crop_analyzer.get_router_stats()
+            stats['ai_parse'] = self.crop_analyzer.get_parse_stats()
+            stats['ai_profiles'] = self.crop_analyzer.get_profile_stats()
+        if self.roi_extractor:
+            stats['plant_roi'] = self.roi_extractor.stats()
+        if self.change_gate is not None:
+            stats['change_gate'] = self.change_gate.stats()
+        if self.crop_analyzer and self.crop_analyzer.get_cache_stats():
+            stats['analysis_cache'] = self.crop_analyzer.get_cache_stats()
+        return stats
+
+    def get_cascade_options(self):
+        """QR解码级联参数（主进程和工作进程共用）"""
+        return {
+            'stages': tuple(self.qr_detection_config['cascade_stages']),
+            'downscale': self.qr_detection_config['cascade_downscale'],
+            'backend': self.qr_detection_config['backend']
+        }
 
-                frame = frame_read.frame
-                if frame is None:
-                    frame_retry_count += 1
-                    if frame_retry_count > max_retry:
-                        print("⚠️ 视频帧获取失败次数过多")
-                        frame_retry_count = 0
-                    time.sleep(0.1)
-                    continue
+    def is_qr_backend_available(self):
+        """当前配置的QR码解码后端是否可用"""
+        return self.qr_cascade.backend.available
 
-                frame_retry_count = 0
-                self.update_fps_stats()
+    def process_frame_for_qr(self, frame, should_detect=True):
+        """专门处理QR码检测的帧处理（检测 + 绘制，同步版本）"""
+        try:
+            if should_detect:
+                self.run_qr_detection(frame)
+            return self.render_frame(frame)
 
-                # QR码检测处理
-                current_time = time.time()
-                should_detect = (current_time - self.last_detection_time) >= self.detection_interval
-
-                processed_frame = self.process_frame_for_qr(frame, should_detect)
-
-                if should_detect:
-                    self.last_detection_time = current_time
-
-                # 编码并发送视频帧
-                _, buffer = cv2.imencode('.jpg', processed_frame,
-                                         [cv2.IMWRITE_JPEG_QUALITY, 85])
-                frame_b64 = base64.b64encode(buffer).decode('utf-8')
-
-                if self.main_loop and not self.main_loop.is_closed():
-                    try:
-                        future = asyncio.run_coroutine_threadsafe(
-                            self.broadcast_message('video_frame', {
-                                'frame': f'data:image/jpeg;base64,{frame_b64}',
-                                'fps': self.fps,
-                                'timestamp': datetime.now().isoformat()
-                            }),
-                            self.main_loop
-                        )
-                        future.result(timeout=0.1)
-                    except Exception:
-                        pass
-
-                time.sleep(0.033)  # 约30fps
+        except Exception as e:
+            print(f"❌ QR码帧处理错误: {e}")
+            return frame
 
-            except Exception as e:
-                print(f"❌ QR检测视频流错误: {e}")
-                time.sleep(0.5)
+    def is_qr_detection_active(self):
+        """当前是否需要进行QR码检测"""
+        return (self.qr_detection_enabled and
+                self.drone_state.get('mission_active', False) and
+                self.is_qr_backend_available())
 
-        print("📹 QR码检测视频流已停止")
+    def run_qr_detection(self, frame, seq=None):
+        """执行QR码检测并更新检测框绘制信息"""
+        try:
+            if not self.is_qr_detection_active():
+                return
 
-    def process_frame_for_qr(self, frame, should_detect=True):
-        """专门处理QR码检测的帧处理"""
+            self.apply_qr_detections(frame, self.detect_qr_codes(frame), seq)
+
+        except Exception as e:
+            print(f"❌ QR码检测处理错误: {e}")
+
+    def apply_qr_detections(self, frame, detected_qrs, seq=None):
+        """处理一帧的检测结果：冷却判断、触发分析、更新检测框绘制信息"""
         try:
-            processed_frame = frame.copy()
+            overlays = []
 
-            # QR码检测
-            if (should_detect and
-                    self.qr_detection_enabled and
-                    self.drone_state.get('mission_active', False) and
-                    PYZBAR_AVAILABLE):
+            for qr_info in detected_qrs:
+                qr_data = qr_info['data']
+                current_time = time.time()
 
-                detected_qrs = self.detect_qr_codes(processed_frame)
+                # 检查冷却时间
+                if qr_data in self.detection_cooldown:
+                    if current_time - self.detection_cooldown[qr_data] < self.cooldown_duration:
+                        # 还在冷却期，绘制灰色边框
+                        overlays.append((qr_info, (128, 128, 128)))
+                        continue
 
-                for qr_info in detected_qrs:
-                    qr_data = qr_info['data']
-                    current_time = time.time()
+                # 新检测到的QR码
+                self.detection_cooldown[qr_data] = current_time
 
-                    # 检查冷却时间
-                    if qr_data in self.detection_cooldown:
-                        if current_time - self.detection_cooldown[qr_data] < self.cooldown_duration:
-                            # 还在冷却期，绘制灰色边框
-                            self.draw_qr_detection(processed_frame, qr_info, color=(128, 128, 128))
-                            continue
+                # 绘制绿色边框
+                overlays.append((qr_info, (0, 255, 0)))
 
-                    # 新检测到的QR码
-                    self.detection_cooldown[qr_data] = current_time
+                # 处理QR码检测结果
+                self.handle_qr_detection(frame, qr_info)
 
-                    # 绘制绿色边框
-                    self.draw_qr_detection(processed_frame, qr_info, color=(0, 255, 0))
+            # 多进程结果可能乱序到达，只用更新的帧刷新检测框
+            if seq is None or seq >= self.qr_overlay_seq:
+                self.qr_overlay_seq = seq or self.qr_overlay_seq
+                self.qr_overlay = (time.time(), overlays)
 
-                    # 处理QR码检测结果
-                    self.handle_qr_detection(frame, qr_info)
+        except Exception as e:
+            print(f"❌ QR码检测处理错误: {e}")
+
+    def render_frame(self, frame):
+        """在帧副本上绘制最近的检测框和状态覆盖信息"""
+        try:
+            processed_frame = frame.copy()
+
+            overlay_time, overlays = self.qr_overlay
+            if time.time() - overlay_time <= self.video_config['overlay_ttl']:
+                for qr_info, color in overlays:
+                    self.draw_qr_detection(processed_frame, qr_info, color=color)
 
             # 添加覆盖信息
             self.add_frame_overlay(processed_frame)
@@ -277,73 +563,25 @@ class QRDroneBackendService:
             return processed_frame
 
         except Exception as e:
-            print(f"❌ QR码帧处理错误: {e}")
+            print(f"❌ 帧绘制错误: {e}")
             return frame
 
     def detect_qr_codes(self, frame):
         """检测QR码 - 仅使用pyzbar"""
         detected_codes = []
 
-        if not PYZBAR_AVAILABLE:
+        if not self.is_qr_backend_available():
             return detected_codes
 
         try:
-            # 转换为灰度图
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            # 图像预处理 - 提高检测成功率
-            # 1. 高斯模糊去噪
-            gray = cv2.GaussianBlur(gray, (3, 3), 0)
-
-            # 2. 对比度增强
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            gray = clahe.apply(gray)
-
-            # 使用pyzbar检测QR码
-            qr_codes = pyzbar.decode(gray)
+            if self.qr_tracker is not None:
+                codes = self.qr_tracker.process(frame)
+            else:
+                codes = decode_qr_frame(frame, self.qr_cascade)
 
-            for qr in qr_codes:
+            for code in codes:
                 try:
-                    # 解码数据
-                    data = qr.data.decode('utf-8')
-
-                    # 获取边界框
-                    rect = qr.rect
-
-                    # 计算角点
-                    if hasattr(qr, 'polygon') and qr.polygon:
-                        # 使用多边形角点（更精确）
-                        corners = [[p.x, p.y] for p in qr.polygon]
-                    else:
-                        # 从矩形推导角点
-                        corners = [
-                            [rect.left, rect.top],
-                            [rect.left + rect.width, rect.top],
-                            [rect.left + rect.width, rect.top + rect.height],
-                            [rect.left, rect.top + rect.height]
-                        ]
-
-                    # 计算中心点
-                    center_x = rect.left + rect.width // 2
-                    center_y = rect.top + rect.height // 2
-
-                    # 解析植物ID
-                    plant_id = self.parse_plant_id(data)
-
-                    detected_codes.append({
-                        'type': 'qr',
-                        'id': plant_id,
-                        'data': data,
-                        'corners': corners,
-                        'center': (center_x, center_y),
-                        'confidence': 0.9,  # QR码检测通常很可靠
-                        'rect': (rect.left, rect.top, rect.width, rect.height),
-                        'quality': qr.quality if hasattr(qr, 'quality') else 100
-                    })
-
-                except UnicodeDecodeError:
-                    print(f"⚠️ QR码数据解码失败，可能包含非UTF-8字符")
-                    continue
+                    detected_codes.append(self.build_qr_info(code))
                 except Exception as e:
                     print(f"⚠️ 处理QR码时出错: {e}")
                     continue
@@ -353,6 +591,21 @@ class QRDroneBackendService:
 
         return detected_codes
 
+    def build_qr_info(self, code):
+        """由解码结果构建QR码检测信息（植物ID、中心点等）"""
+        left, top, width, height = code['rect']
+
+        return {
+            'type': 'qr',
+            'id': self.parse_plant_id(code['data']),
+            'data': code['data'],
+            'corners': code['corners'],
+            'center': (left + width // 2, top + height // 2),
+            'confidence': 0.9,  # QR码检测通常很可靠
+            'rect': code['rect'],
+            'quality': code['quality']
+        }
+
     def parse_plant_id(self, data):
         """从QR码数据中解析植物ID"""
         try:
@@ -467,58 +720,164 @@ class QRDroneBackendService:
                 except Exception as e:
                     print(f"❌ 发送QR检测事件失败: {e}")
 
-            # 进行AI分析
+            # 进行AI分析（只提交以QR码为锚点裁剪出的植株区域）
             if self.crop_analyzer:
-                self.analyze_plant_ai(frame, qr_info)
+                self.analyze_plant_ai(self.extract_plant_roi(frame, qr_info), qr_info)
             else:
                 print("⚠️ AI分析器不可用，跳过分析")
 
         except Exception as e:
             print(f"❌ 处理QR检测结果错误: {e}")
 
-    def analyze_plant_ai(self, frame, qr_info):
-        """AI分析植物"""
-        try:
-            plant_id = qr_info.get('id', 'Unknown')
+    def extract_plant_roi(self, frame, qr_info):
+        """按QR码角点提取校正后的植株区域，无法提取时使用整帧"""
+        if self.roi_extractor is None:
+            return frame
 
-            def ai_analysis_worker():
-                try:
-                    print(f"🤖 开始AI分析植株 {plant_id}...")
-
-                    result = self.crop_analyzer.analyze_crop_health(frame)
-
-                    if result['status'] == 'ok':
-                        if self.main_loop and not self.main_loop.is_closed():
-                            try:
-                                future = asyncio.run_coroutine_threadsafe(
-                                    self.broadcast_message('ai_analysis_complete', {
-                                        'plant_id': plant_id,
-                                        'timestamp': datetime.now().isoformat(),
-                                        'analysis': result,
-                                        'qr_info': qr_info
-                                    }),
-                                    self.main_loop
-                                )
-                                future.result(timeout=2.0)
-                            except Exception as e:
-                                print(f"❌ 发送AI分析结果失败: {e}")
-
-                        health_score = result.get('health_score', 0)
-                        print(f"✅ 植株 {plant_id} AI分析完成，健康评分: {health_score}/100")
-                    else:
-                        print(f"❌ 植株 {plant_id} AI分析失败: {result.get('message')}")
+        roi, info = self.roi_extractor.extract(frame, qr_info.get('corners', []))
+        if roi is None:
+            print(f"⚠️ 植株 {qr_info.get('id', 'Unknown')} 区域提取失败（{info}），使用整帧分析")
+            return frame
 
-                except Exception as e:
-                    print(f"❌ AI分析执行错误: {e}")
+        qr_info['roi'] = info
+        return roi
 
-            # 在单独线程中运行AI分析
-            ai_thread = threading.Thread(target=ai_analysis_worker)
-            ai_thread.daemon = True
-            ai_thread.start()
+    def analyze_plant_ai(self, frame, qr_info):
+        """提交植株AI分析任务（由分析执行器的固定工作线程按优先级执行）；画面与上次分析时相比没有明显变化则复用上次结果"""
+        try:
+            plant_id = qr_info.get('id', 'Unknown')
+            features = None
+            if self.change_gate is not None:
+                features = self.crop_analyzer.feature_engine.extract(frame)
+                reused, gate_info = self.change_gate.check(plant_id, features)
+                if reused is not None:
+                    print(f"♻️ 植株 {plant_id} 画面无明显变化（漂移 {gate_info['drift']}），复用 "
+                          f"{gate_info['age']:.0f} 秒前的分析结果")
+                    self.publish_reused_analysis(plant_id, reused, qr_info, gate_info)
+                    return
+                if gate_info['reason'] != 'new':
+                    print(f"🔄 植株 {plant_id} 重新分析（{gate_info['reason']}，漂移 {gate_info['drift']}）")
+
+            # 门控检查时提取的特征随任务传递，分析完成后记录时不再重复提取
+            result = self.analysis_executor.submit(plant_id, frame, qr_info, features)
+
+            if result == SUBMIT_REJECTED:
+                print(f"⚠️ AI分析队列已满，跳过植株 {plant_id}")
+            elif result == SUBMIT_COALESCED:
+                print(f"🔁 植株 {plant_id} 已在分析队列中，更新为最新画面")
 
         except Exception as e:
             print(f"❌ AI分析启动错误: {e}")
 
+    def run_plant_analysis(self, task):
+        """执行单个植株的AI分析（在分析工作线程中运行）"""
+        plant_id = task.plant_id
+        qr_info = task.qr_info
+        print(f"🤖 开始AI分析植株 {plant_id}...")
+
+        shared = False
+        if self.main_loop and not self.main_loop.is_closed():
+            # API请求在事件循环上执行，复用连接池并受并发上限约束
+            future = asyncio.run_coroutine_threadsafe(
+                self.analyze_plant_single_flight(task.frame, plant_id, self.analysis_config['refresh_inflight']),
+                self.main_loop)
+            timeout = self.crop_analyzer.analysis_time_budget() + self.analysis_config['result_timeout_margin']
+            try:
+                result, shared = future.result(timeout=timeout)
+            except (FutureTimeoutError, FutureCancelledError):
+                # 调用迟迟不返回时工作线程不再等待；不取消该调用，由它自行完成并把结果记入熔断器、缓存和统计
+                print(f"⏱️ 植株 {plant_id} 的AI分析 {timeout:.0f} 秒内未完成，改用本地分析（云端调用在后台继续）")
+                result = self.crop_analyzer.analyze_local_fallback(task.frame, plant_id)
+        else:
+            result = self.crop_analyzer.analyze_crop_health(task.frame, plant_id)
+
+        if shared:
+            # 结果已由发起该次调用的请求广播
+            print(f"🔗 植株 {plant_id} 共享进行中的AI分析结果")
+            return result
+
+        if self.change_gate is not None and result['status'] == 'ok':
+            features = task.features
+            if features is None:
+                features = self.crop_analyzer.feature_engine.extract(task.frame)
+            self.change_gate.record(plant_id, features, result)
+
+        if result['status'] == 'ok':
+            if self.main_loop and not self.main_loop.is_closed():
+                try:
+                    future = asyncio.run_coroutine_threadsafe(
+                        self.broadcast_message('ai_analysis_complete', {
+                            'plant_id': plant_id,
+                            'timestamp': datetime.now().isoformat(),
+                            'analysis': result,
+                            'qr_info': qr_info,
+                            'queue_wait_seconds': round(time.time() - task.enqueued_at, 2)
+                        }),
+                        self.main_loop
+                    )
+                    future.result(timeout=2.0)
+                except Exception as e:
+                    print(f"❌ 发送AI分析结果失败: {e}")
+
+            health_score = result.get('health_score', 0)
+            print(f"✅ 植株 {plant_id} AI分析完成（{result.get('analysis_tier', 'cloud')}），健康评分: {health_score}/100")
+        else:
+            print(f"❌ 植株 {plant_id} AI分析失败: {result.get('message')}")
+
+        return result
+
+    async def analyze_plant_single_flight(self, frame, plant_id, refresh=False, triage=True):
+        """同一植株的并发分析合并为一次API调用，返回 (结果, 是否共享了进行中的调用)"""
+        def on_progress(fields):
+            self.publish_analysis_progress(plant_id, fields)
+
+        return await self.analysis_flights.run(
+            plant_id, lambda: self.crop_analyzer.analyze_crop_health_async(frame, plant_id, triage, on_progress),
+            refresh)
+
+    def publish_reused_analysis(self, plant_id, result, qr_info, gate_info):
+        """重新广播复用的分析结果（reused 标记，漂移和结果年龄在 reuse 中）"""
+        if self.main_loop and not self.main_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.broadcast_message('ai_analysis_complete', {
+                    'plant_id': plant_id,
+                    'timestamp': datetime.now().isoformat(),
+                    'analysis': result,
+                    'qr_info': qr_info,
+                    'reused': True,
+                    'reuse': gate_info
+                }),
+                self.main_loop
+            )
+
+    def publish_analysis_progress(self, plant_id, fields):
+        """流式分析中字段完整时立即推送（如 health_score、urgency），最终结果仍以 ai_analysis_complete 发送"""
+        if self.main_loop and not self.main_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.broadcast_message('ai_analysis_progress', {
+                    'plant_id': plant_id,
+                    'timestamp': datetime.now().isoformat(),
+                    'fields': fields
+                }),
+                self.main_loop
+            )
+
+    def publish_ai_circuit_status(self, status):
+        """广播云端AI熔断器状态变化（可在任意线程调用）"""
+        if self.main_loop and not self.main_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.broadcast_message('ai_circuit_status', status),
+                self.main_loop
+            )
+
+    def publish_analysis_queue_status(self, status):
+        """广播AI分析队列长度和预计等待时间（可在任意线程调用）"""
+        if self.main_loop and not self.main_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.broadcast_message('analysis_queue_status', status),
+                self.main_loop
+            )
+
     def add_frame_overlay(self, frame):
         """添加帧覆盖信息"""
         try:
@@ -539,7 +898,7 @@ class QRDroneBackendService:
                 status_text.append('FLYING')
             if self.drone_state['mission_active']:
                 status_text.append('MISSION')
-            if self.qr_detection_enabled and PYZBAR_AVAILABLE:
+            if self.qr_detection_enabled and self.is_qr_backend_available():
                 status_text.append('QR_READY')
 
             if status_text:
@@ -553,8 +912,8 @@ class QRDroneBackendService:
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
 
             # 检测状态
-            if not PYZBAR_AVAILABLE:
-                cv2.putText(frame, 'QR DETECTION DISABLED - INSTALL PYZBAR', (10, 75),
+            if not self.is_qr_backend_available():
+                cv2.putText(frame, f"QR DETECTION DISABLED - BACKEND {self.qr_detection_config['backend'].upper()} UNAVAILABLE", (10, 75),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
 
         except Exception as e:
@@ -592,10 +951,16 @@ class QRDroneBackendService:
                 await self.handle_qr_reset(websocket, message_data)
             elif message_type == 'ai_test':
                 await self.handle_ai_test(websocket, message_data)
+            elif message_type == 'full_analysis_request':
+                await self.handle_full_analysis_request(websocket, message_data)
             elif message_type == 'heartbeat':
                 await self.handle_heartbeat(websocket, message_data)
             elif message_type == 'connection_test':
                 await self.handle_connection_test(websocket, message_data)
+            elif message_type == 'video_protocol':
+                await self.handle_video_protocol(websocket, message_data)
+            elif message_type == 'pipeline_stats':
+                await self.handle_pipeline_stats(websocket, message_data)
             else:
                 print(f"⚠️ 未知消息类型: {message_type}")
 
@@ -611,6 +976,10 @@ class QRDroneBackendService:
         try:
             self.processed_qr_data.clear()
             self.detection_cooldown.clear()
+            if self.qr_tracker is not None:
+                self.qr_tracker.reset()
+            if self.change_gate is not None:
+                self.change_gate.clear()
             await self.broadcast_message('status_update', '🔄 QR码检测已重置')
             print("✅ QR码检测状态已重置")
         except Exception as e:
@@ -620,8 +989,8 @@ class QRDroneBackendService:
     async def handle_mission_start(self, websocket, data):
         """处理任务开始"""
         try:
-            if not PYZBAR_AVAILABLE:
-                await self.send_error(websocket, "QR码检测库未安装，无法启动任务")
+            if not self.is_qr_backend_available():
+                await self.send_error(websocket, "QR码解码后端不可用，无法启动任务")
                 return
 
             self.drone_state['mission_active'] = True
@@ -649,7 +1018,8 @@ class QRDroneBackendService:
 
             await self.broadcast_message('status_update', '🧪 正在进行AI分析测试...')
 
-            result = self.crop_analyzer.analyze_crop_health(test_image)
+            # 测试需要真正调用云端：跳过本地分级和结果缓存，云端失败时报告失败而不是本地回退结果
+            result = await self.crop_analyzer.probe_cloud_async(test_image)
 
             if result['status'] == 'ok':
                 health_score = result.get('health_score', 0)
@@ -670,6 +1040,35 @@ class QRDroneBackendService:
             print(f"❌ AI测试失败: {e}")
             await self.send_error(websocket, f"AI测试失败: {str(e)}")
 
+    async def handle_full_analysis_request(self, websocket, data):
+        """紧凑模式下按需为选中的植株生成完整分析报告"""
+        try:
+            plant_id = data.get('plant_id')
+            if not self.crop_analyzer:
+                await self.send_error(websocket, "AI分析器未初始化")
+                return
+            if not plant_id:
+                await self.send_error(websocket, "缺少植株ID")
+                return
+
+            await self.send_to_client(websocket, 'status_update', f'📋 正在生成植株 {plant_id} 的完整分析...')
+            # 重复点击共享同一次调用
+            result, _ = await self.analysis_flights.run(
+                ('full', plant_id), lambda: self.crop_analyzer.analyze_full_async(plant_id))
+
+            if result['status'] == 'ok':
+                await self.broadcast_message('ai_analysis_complete', {
+                    'plant_id': plant_id,
+                    'timestamp': datetime.now().isoformat(),
+                    'analysis': result
+                })
+            else:
+                await self.send_error(websocket, f"完整分析失败: {result.get('message', '未知错误')}")
+
+        except Exception as e:
+            print(f"❌ 完整分析失败: {e}")
+            await self.send_error(websocket, f"完整分析失败: {str(e)}")
+
     # 其他必要的方法保持与原版相同，但移除所有ArUco相关代码
     async def handle_drone_connect(self, websocket, data):
         """处理无人机连接"""
@@ -719,18 +1118,35 @@ class QRDroneBackendService:
 
     def start_video_streaming(self):
         """启动视频流"""
-        if self.video_thread is None or not self.video_thread.is_alive():
+        if self.video_pipeline is None or not self.video_pipeline.is_alive():
             self.video_streaming = True
-            self.video_thread = threading.Thread(target=self.video_stream_worker)
-            self.video_thread.daemon = True
-            self.video_thread.start()
+            self.qr_overlay = (0, [])
+            self.qr_overlay_seq = 0
+            if self.qr_detection_config['executor'] == 'process_pool' and self.is_qr_backend_available():
+                self.qr_pool_detector = ProcessPoolQRDetector(
+                    workers=self.qr_detection_config['pool_workers'],
+                    slots_per_worker=self.qr_detection_config['pool_slots_per_worker'],
+                    cascade_options=self.get_cascade_options())
+            elif self.qr_detection_config['tracking']:
+                self.qr_tracker = QRMarkerTracker(
+                    self.qr_cascade,
+                    full_scan_interval=self.qr_detection_config['full_scan_interval'],
+                    roi_padding=self.qr_detection_config['roi_padding'],
+                    max_misses=self.qr_detection_config['max_track_misses'])
+            self.video_pipeline = self.build_video_pipeline()
+            self.video_pipeline.start()
             print("📹 QR码检测视频流已启动")
 
     def stop_video_streaming(self):
         """停止视频流"""
         self.video_streaming = False
-        if self.video_thread and self.video_thread.is_alive():
-            self.video_thread.join(timeout=2)
+        if self.video_pipeline:
+            self.video_pipeline.stop(timeout=2)
+        if self.qr_pool_detector:
+            self.qr_pool_detector.close()
+            self.qr_pool_detector = None
+        self.qr_tracker = None
+        self.pending_detection_frames.clear()
         print("📹 QR码检测视频流已停止")
 
     # 保持其他必要的方法...
@@ -773,34 +1189,57 @@ class QRDroneBackendService:
     async def handle_heartbeat(self, websocket, data):
         """处理心跳"""
         try:
-            await websocket.send(json.dumps({
-                'type': 'heartbeat_ack',
-                'data': {
-                    'server_time': datetime.now().isoformat(),
-                    'qr_detection_ready': PYZBAR_AVAILABLE
-                }
-            }, ensure_ascii=False))
+            await self.send_to_client(websocket, 'heartbeat_ack', {
+                'server_time': datetime.now().isoformat(),
+                'qr_detection_ready': self.is_qr_backend_available()
+            })
         except Exception as e:
             print(f"❌ 处理心跳失败: {e}")
 
     async def handle_connection_test(self, websocket, data):
         """处理连接测试"""
         try:
-            await websocket.send(json.dumps({
-                'type': 'connection_test_ack',
-                'data': {
-                    'message': 'QR码检测服务连接正常',
-                    'server_time': datetime.now().isoformat(),
-                    'qr_detection_available': PYZBAR_AVAILABLE
-                },
-                'timestamp': datetime.now().isoformat()
-            }, ensure_ascii=False))
+            await self.send_to_client(websocket, 'connection_test_ack', {
+                'message': 'QR码检测服务连接正常',
+                'server_time': datetime.now().isoformat(),
+                'qr_detection_available': self.is_qr_backend_available()
+            })
         except Exception as e:
             print(f"❌ 连接测试失败: {e}")
 
+    async def handle_video_protocol(self, websocket, data):
+        """处理视频帧协议协商"""
+        try:
+            protocol = data.get('protocol', 'json')
+            if protocol not in ('json', 'binary'):
+                await self.send_error(websocket, f"不支持的视频帧协议: {protocol}")
+                return
+
+            channel = self.client_channels.get(websocket)
+            if channel:
+                channel.video_protocol = protocol
+            await self.send_to_client(websocket, 'video_protocol_ack', {
+                'protocol': protocol,
+                'binary_frame_version': BINARY_FRAME_VERSION,
+                'header_size': BINARY_FRAME_HEADER.size
+            })
+            print(f"🎞️ 客户端视频帧协议: {protocol}")
+        except Exception as e:
+            print(f"❌ 视频帧协议协商失败: {e}")
+            await self.send_error(websocket, f"视频帧协议协商失败: {str(e)}")
+
+    async def handle_pipeline_stats(self, websocket, data):
+        """处理视频流水线统计查询"""
+        try:
+            stats = self.get_video_pipeline_stats()
+            stats['clients'] = self.get_client_stats()
+            await self.send_to_client(websocket, 'pipeline_stats', stats)
+        except Exception as e:
+            print(f"❌ 发送流水线统计失败: {e}")
+
     async def broadcast_message(self, message_type, data=None):
-        """广播消息"""
-        if not self.connected_clients:
+        """广播消息 - 放入每个客户端的发送队列，不等待慢客户端"""
+        if not self.client_channels:
             return
 
         message = {
@@ -810,24 +1249,79 @@ class QRDroneBackendService:
         }
 
         message_json = json.dumps(message, ensure_ascii=False)
-        disconnected_clients = set()
 
-        for client in self.connected_clients:
-            try:
-                await client.send(message_json)
-            except:
-                disconnected_clients.add(client)
+        for channel in list(self.client_channels.values()):
+            channel.send_message(message_json)
+
+    async def send_to_client(self, websocket, message_type, data=None):
+        """发送消息给单个客户端（经由其发送队列）"""
+        message_json = json.dumps({
+            'type': message_type,
+            'data': data,
+            'timestamp': datetime.now().isoformat()
+        }, ensure_ascii=False)
+
+        channel = self.client_channels.get(websocket)
+        if channel:
+            channel.send_message(message_json)
+        else:
+            await websocket.send(message_json)
+
+    def dispatch_video_frame(self, packet):
+        """将最新视频帧交给每个客户端通道，未发送的旧帧被覆盖"""
+        for channel in self.client_channels.values():
+            channel.send_video_frame(packet)
+
+    def build_video_payload(self, packet, protocol, rung=0):
+        """按协议和质量档位构建视频帧数据，同一帧同一档位同一协议只构建一次"""
+        renditions = packet['renditions']
+        if rung not in renditions:
+            # 档位刚调整、本帧尚未编码该档位时，使用最接近的已编码档位
+            rung = min(renditions, key=lambda r: abs(r - rung))
+
+        payloads = packet.setdefault('payloads', {})
+        cache_key = (protocol, rung)
+        if cache_key in payloads:
+            return payloads[cache_key]
+
+        rendition = renditions[rung]
+        if protocol == 'binary':
+            payload = pack_binary_frame(
+                packet['seq'], packet['timestamp'], self.fps,
+                rendition['width'], rendition['height'], rendition['jpeg'], flags=rung)
+        else:
+            # 旧客户端仍使用base64数据URL
+            frame_b64 = base64.b64encode(rendition['jpeg']).decode('utf-8')
+            payload = json.dumps({
+                'type': 'video_frame',
+                'data': {
+                    'frame': f'data:image/jpeg;base64,{frame_b64}',
+                    'fps': self.fps,
+                    'seq': packet['seq'],
+                    'quality_rung': rung,
+                    'timestamp': datetime.fromtimestamp(packet['timestamp']).isoformat()
+                },
+                'timestamp': datetime.now().isoformat()
+            }, ensure_ascii=False)
+
+        payloads[cache_key] = payload
+        return payload
+
+    def get_client_stats(self):
+        """获取每个客户端的发送延迟和丢帧统计"""
+        return [channel.stats() for channel in self.client_channels.values()]
 
-        self.connected_clients -= disconnected_clients
+    async def client_stats_worker(self):
+        """定期广播客户端发送统计"""
+        while self.is_running:
+            await asyncio.sleep(self.client_stats_interval)
+            if self.client_channels:
+                await self.broadcast_message('client_stats', self.get_client_stats())
 
     async def send_error(self, websocket, error_message):
         """发送错误消息"""
         try:
-            await websocket.send(json.dumps({
-                'type': 'error',
-                'data': {'message': error_message},
-                'timestamp': datetime.now().isoformat()
-            }, ensure_ascii=False))
+            await self.send_to_client(websocket, 'error', {'message': error_message})
         except Exception as e:
             print(f"❌ 发送错误消息失败: {e}")
 
@@ -840,6 +1334,12 @@ class QRDroneBackendService:
         print("🧹 清理QR码检测服务资源...")
         self.is_running = False
         self.stop_video_streaming()
+        self.analysis_executor.shutdown()
+        if self.crop_analyzer:
+            try:
+                asyncio.create_task(self.crop_analyzer.close())
+            except RuntimeError:
+                pass
 
         if self.drone:
             try:
@@ -849,12 +1349,13 @@ class QRDroneBackendService:
                 pass
             self.drone = None
 
-        for client in self.connected_clients.copy():
+        for websocket, channel in list(self.client_channels.items()):
             try:
-                asyncio.create_task(client.close())
+                channel.close()
+                asyncio.create_task(websocket.close())
             except:
                 pass
-        self.connected_clients.clear()
+        self.client_channels.clear()
 
 
 # 主函数
@@ -863,24 +1364,32 @@ async def main():
     parser = argparse.ArgumentParser(description='专用QR码检测无人机后端')
     parser.add_argument('--ws-port', type=int, default=3002, help='WebSocket服务端口')
     parser.add_argument('--debug', action='store_true', help='启用调试模式')
+    parser.add_argument('--qr-pool-workers', type=int, default=0,
+                        help='QR码多进程解码的工作进程数（0表示在检测线程内解码）')
+    parser.add_argument('--qr-tracking', action='store_true',
+                        help='启用QR码跟踪模式（逐帧只解码已识别标记附近区域）')
+    parser.add_argument('--qr-backend', choices=list(QR_BACKENDS), default='pyzbar',
+                        help='QR码解码后端（可用 qr_benchmark.py 对比各后端的速度和识别率）')
 
     args = parser.parse_args()
 
     print("🔍 专用QR码检测无人机系统后端服务")
     print("=" * 50)
     print(f"WebSocket端口: {args.ws_port}")
-    print(f"QR码检测库: {'✅ 已安装' if PYZBAR_AVAILABLE else '❌ 未安装'}")
+    print(f"QR码解码后端: {args.qr_backend}（可用: {', '.join(available_qr_backends()) or '无'}）")
     print(f"启动时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-    if not PYZBAR_AVAILABLE:
+    if args.qr_backend == 'pyzbar' and not PYZBAR_AVAILABLE:
         print("\n⚠️ 重要提醒：pyzbar库未安装！")
         print("QR码检测功能将不可用")
         print("解决方案：pip install pyzbar")
         print("Windows用户可能还需要：pip install zbar-py")
+        print("或使用OpenCV解码后端：--qr-backend opencv")
 
     print("=" * 50)
 
-    backend = QRDroneBackendService(ws_port=args.ws_port)
+    backend = QRDroneBackendService(ws_port=args.ws_port, qr_pool_workers=args.qr_pool_workers,
+                                    qr_tracking=args.qr_tracking, qr_backend=args.qr_backend)
 
     try:
         server = await backend.start_websocket_server()
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+本地DashScope模拟服务器
+模拟多模态生成接口的响应格式，用于在不消耗API额度的情况下测试异步客户端的
+连接复用、并发限制、超时处理、多图合批、SSE流式输出、紧凑分析模式，以及注入延迟/错误/断连来测试熔断和重试；
+usage中的token数按文本长度估算，--token-delay 可模拟输出越长耗时越长；
+--rate-limit-rpm / --max-concurrent 模拟账号限流配额，超出时返回429（Throttling.RateQuota）
+
+用法:
+    python mock_dashscope_server.py --port 8089 --delay 1.5
+    python mock_dashscope_server.py --error-rate 0.3 --drop-rate 0.2   # 模拟不稳定的上行链路
+    python mock_dashscope_server.py --model-delay qwen-vl-max=3 --model-delay qwen-vl-plus=1
+    python mock_dashscope_server.py --delay 0.5 --token-delay 0.01          # 对比完整/紧凑模式的延迟
+    python mock_dashscope_server.py --rate-limit-rpm 120 --max-concurrent 3  # 模拟限流配额
+    然后在 config.json 中设置 "dashscope_client": {"base_url": "http://127.0.0.1:8089"}
+"""
+
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from analysis_codebook import COMPACT_PROMPT_TAG
+from dashscope_client import MULTIMODAL_GENERATION_PATH
+
+IMAGE_TOKENS = 800  # 每张图像的输入token数（估算值）
+
+
+def build_mock_analysis(request_index):
+    """生成一份符合提示词要求格式的分析结果"""
+    health_score = random.randint(40, 95)
+    urgency = "high" if health_score < 50 else "medium" if health_score < 75 else "low"
+    return {
+        "health_score": health_score,
+        "analysis_summary": f"模拟分析结果 #{request_index}：叶片整体呈绿色，局部有轻微黄化",
+        "urgency": urgency,
+        "crop_type": {"name": "生菜", "confidence": 85, "characteristics": "叶片宽大，呈莲座状"},
+        "growth_stage": {"stage": "生长期", "description": "叶片快速扩展", "care_points": "保持水肥均衡"},
+        "diseases": [],
+        "nutrition_status": {"summary": "营养状况基本正常", "deficiencies": []},
+        "issues": [],
+        "recommendations": ["保持适宜的浇水频率", "注意观察叶片颜色变化"]
+    }
+
+
+def build_mock_compact_analysis(request_index):
+    """生成一份紧凑模式（评分 + 代码）的分析结果"""
+    health_score = random.randint(40, 95)
+    urgency = "H" if health_score < 50 else "M" if health_score < 75 else "L"
+    return {
+        "h": health_score,
+        "u": urgency,
+        "c": ["LV", 85],
+        "g": "VG",
+        "d": [["LS", random.randint(20, 80), "M"]] if health_score < 75 else [],
+        "n": [["N", "L"]] if health_score < 60 else [],
+        "e": [],
+        "t": f"模拟分析 #{request_index}：叶片整体呈绿色，局部轻微黄化"
+    }
+
+
+def estimate_tokens(text):
+    """粗略估算token数：每个非ASCII字符约1个token，ASCII字符约4个一个token"""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def request_texts(payload):
+    try:
+        content = payload['input']['messages'][0]['content']
+    except (KeyError, IndexError, TypeError):
+        return [], 0
+    return [item.get('text', '') for item in content], sum(1 for item in content if 'image' in item)
+
+
+def batch_labels(payload):
+    """多图请求中每张图片前的植株ID标注（"植株ID: xxx"）"""
+    labels = []
+    try:
+        content = payload['input']['messages'][0]['content']
+    except (KeyError, IndexError, TypeError):
+        return labels
+    for previous, item in zip(content, content[1:]):
+        if 'image' in item and previous.get('text', '').startswith('植株ID:'):
+            labels.append(previous['text'].split(':', 1)[1].strip())
+    return labels
+
+
+class MockDashScopeHandler(BaseHTTPRequestHandler):
+    """模拟多模态生成接口：返回 output.choices[0].message.content 格式的响应"""
+
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive，便于验证连接复用
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        with server.lock:
+            server.request_count += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            request_index = server.request_count
+
+        try:
+            if self.path != MULTIMODAL_GENERATION_PATH:
+                self._send_json(404, {'code': 'NotFound', 'message': f'unknown path {self.path}'})
+                return
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                self._send_json(401, {'code': 'InvalidApiKey', 'message': 'missing api key'})
+                return
+
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self._send_json(400, {'code': 'InvalidParameter', 'message': 'invalid json'})
+                return
+
+            texts, images = request_texts(payload)
+            compact = any(COMPACT_PROMPT_TAG in text for text in texts)
+            build = build_mock_compact_analysis if compact else build_mock_analysis
+            labels = batch_labels(payload)
+            if len(labels) > 1:
+                # 多图合批请求：按图片前标注的植株ID逐张返回
+                analysis = {'results': [dict(build(request_index), plant_id=label) for label in labels]}
+            else:
+                analysis = build(request_index)
+            reply = json.dumps(analysis, ensure_ascii=False, indent=None if compact else 2)
+            usage = {
+                'input_tokens': sum(estimate_tokens(text) for text in texts) + images * IMAGE_TOKENS,
+                'output_tokens': estimate_tokens(reply),
+                'image_tokens': images * IMAGE_TOKENS
+            }
+
+            throttled = server.check_quota()
+            if throttled:
+                self._send_json(429, {'code': 'Throttling.RateQuota', 'message': throttled},
+                                {'Retry-After': str(server.retry_after)} if server.retry_after else None)
+                return
+
+            delay = server.model_delays.get(payload.get('model'), server.delay)
+            delay += usage['output_tokens'] * server.token_delay
+            if delay:
+                time.sleep(delay)
+
+            if random.random() < server.drop_rate:
+                # 模拟链路中断：不返回任何响应直接断开连接
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+
+            if random.random() < server.error_rate:
+                self._send_json(500, {'code': 'InternalError', 'message': 'mock internal error'})
+                return
+
+            if self.headers.get('X-DashScope-SSE') == 'enable':
+                self._send_stream(reply, usage)
+                return
+            self._send_json(200, {
+                'output': {
+                    'choices': [{
+                        'finish_reason': 'stop',
+                        'message': {
+                            'role': 'assistant',
+                            'content': [{'text': '```json\n' + reply + '\n```'}]
+                        }
+                    }]
+                },
+                'usage': usage,
+                'request_id': str(uuid.uuid4())
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send_stream(self, text, usage):
+        """SSE增量输出：把回复按小段依次发送（chunked编码，保持keep-alive）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        chunk_size = self.server.stream_chunk_chars
+        pieces = ['```json\n'] + [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] + ['\n```']
+        request_id = str(uuid.uuid4())
+        sent = ''
+        for index, piece in enumerate(pieces):
+            sent += piece
+            finished = index == len(pieces) - 1
+            event = {
+                'output': {'choices': [{
+                    'finish_reason': 'stop' if finished else 'null',
+                    'message': {'role': 'assistant', 'content': [{'text': piece}]}
+                }]},
+                'usage': dict(usage, output_tokens=estimate_tokens(sent)),
+                'request_id': request_id
+            }
+            data = f"id:{index + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(event, ensure_ascii=False)}\n\n"
+            self._write_chunk(data.encode('utf-8'))
+            if not finished and self.server.stream_interval:
+                time.sleep(self.server.stream_interval)
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MockDashScopeServer(ThreadingHTTPServer):
+    """记录请求数和最大并发数的模拟服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, address, delay=0.0, error_rate=0.0, drop_rate=0.0, verbose=False, model_delays=None):
+        super().__init__(address, MockDashScopeHandler)
+        # 故障注入参数可在运行中修改
+        self.delay = delay
+        self.model_delays = dict(model_delays or {})  # 模型名称 -> 处理时间，未列出的模型使用delay
+        self.token_delay = 0.0  # 每个输出token增加的处理时间（秒）
+        # 流式输出：每段字符数和段间隔（delay相当于首个token的等待时间）
+        self.stream_chunk_chars = 24
+        self.stream_interval = 0.02
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.verbose = verbose
+        # 限流配额：每分钟请求数（令牌桶，容量rate_limit_burst）和同时处理的请求数，0表示不限制
+        self.rate_limit_rpm = 0
+        self.rate_limit_burst = 1
+        self.max_concurrent = 0
+        self.retry_after = None  # 429响应的Retry-After秒数，None表示不返回该响应头
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.throttled_count = 0
+        self.served_count = 0
+        self._quota_tokens = None
+        self._quota_updated = time.monotonic()
+
+    def check_quota(self):
+        """按限流配额判断是否拒绝当前请求，拒绝时返回原因；in_flight 包含当前请求"""
+        with self.lock:
+            if self.max_concurrent and self.in_flight > self.max_concurrent:
+                self.throttled_count += 1
+                return f'too many concurrent requests (limit {self.max_concurrent})'
+            if self.rate_limit_rpm:
+                now = time.monotonic()
+                if self._quota_tokens is None:
+                    self._quota_tokens = float(self.rate_limit_burst)
+                self._quota_tokens = min(float(self.rate_limit_burst),
+                                         self._quota_tokens + (now - self._quota_updated) * self.rate_limit_rpm / 60.0)
+                self._quota_updated = now
+                if self._quota_tokens < 1:
+                    self.throttled_count += 1
+                    return f'requests rate limit exceeded (limit {self.rate_limit_rpm}/min)'
+                self._quota_tokens -= 1
+            self.served_count += 1
+            return None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(port=0, delay=0.0, error_rate=0.0, drop_rate=0.0, verbose=False, model_delays=None):
+    """在后台线程启动模拟服务器（port=0 时自动分配端口），返回服务器对象"""
+    server = MockDashScopeServer(('127.0.0.1', port), delay=delay, error_rate=error_rate,
+                                 drop_rate=drop_rate, verbose=verbose, model_delays=model_delays)
+    thread = threading.Thread(target=server.serve_forever, name='mock-dashscope')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地DashScope模拟服务器')
+    parser.add_argument('--port', type=int, default=8089, help='监听端口')
+    parser.add_argument('--delay', type=float, default=1.0, help='每个请求的模拟处理时间（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500错误的概率')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='不返回响应直接断开连接的概率')
+    parser.add_argument('--model-delay', action='append', default=[], metavar='MODEL=SECONDS',
+                        help='指定模型的处理时间，可重复，如 qwen-vl-max=3 qwen-vl-plus=1')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='每个输出token增加的处理时间（秒）')
+    parser.add_argument('--rate-limit-rpm', type=float, default=0, help='每分钟请求数配额，超出返回429（0表示不限制）')
+    parser.add_argument('--rate-limit-burst', type=int, default=1, help='请求数配额允许的突发请求数')
+    parser.add_argument('--max-concurrent', type=int, default=0, help='同时处理的请求数配额，超出返回429（0表示不限制）')
+    parser.add_argument('--retry-after', type=float, default=None, help='429响应附带的Retry-After秒数')
+    parser.add_argument('--verbose', action='store_true', help='打印每个请求')
+    args = parser.parse_args()
+
+    model_delays = {}
+    for item in args.model_delay:
+        model, _, seconds = item.partition('=')
+        model_delays[model] = float(seconds)
+
+    server = MockDashScopeServer(('127.0.0.1', args.port), delay=args.delay,
+                                 error_rate=args.error_rate, drop_rate=args.drop_rate, verbose=args.verbose,
+                                 model_delays=model_delays)
+    server.token_delay = args.token_delay
+    server.rate_limit_rpm = args.rate_limit_rpm
+    server.rate_limit_burst = args.rate_limit_burst
+    server.max_concurrent = args.max_concurrent
+    server.retry_after = args.retry_after
+    print(f"🧪 DashScope模拟服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n👋 模拟服务器已停止，共处理 {server.request_count} 个请求（限流 {server.throttled_count}），"
+              f"最大并发 {server.max_in_flight}")
+
+
+if __name__ == "__main__":
+    main()
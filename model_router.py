@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+视觉模型分级路由
+常规植株使用更快、更便宜的视觉模型，紧急、曾经发现病害或本地分级无法判断的植株使用max模型；
+路由规则是声明式配置（按顺序匹配，第一条命中的规则决定模型），并按模型统计调用延迟、token数和费用
+"""
+
+import threading
+
+DEFAULT_ROUTER_CONFIG = {
+    'enabled': False,  # 未启用时所有请求使用 CropAnalyzer.model_name
+    'default_model': 'qwen-vl-plus',  # 没有规则命中时使用的模型
+    # 每千token价格（元），用于统计费用，请按阿里云百炼当前价格修改
+    'models': {
+        'qwen-vl-plus': {'input_price': 0.0015, 'output_price': 0.0045},
+        'qwen-vl-max': {'input_price': 0.003, 'output_price': 0.009}
+    },
+    # when 中的条件全部满足时命中：
+    #   urgency: 该植株上一次结果的紧急程度列表
+    #   previously_diseased: 上一次结果是否诊断出病害
+    #   health_score_below: 上一次结果的健康评分低于该值
+    #   triage_reason: 本次本地分级的升级原因列表（uncertain/disease/stale/sampled/local_failed）
+    #   local_score_below: 本次本地分级评分低于该值
+    'rules': [
+        {'model': 'qwen-vl-max', 'when': {'urgency': ['high']}},
+        {'model': 'qwen-vl-max', 'when': {'previously_diseased': True}},
+        {'model': 'qwen-vl-max', 'when': {'triage_reason': ['uncertain', 'disease', 'local_failed']}}
+    ]
+}
+
+
+class ModelRouter:
+    """按声明式规则为每次分析选择模型，并记录各模型的延迟和费用"""
+
+    def __init__(self, default_model, rules=None, models=None, enabled=True, history_size=4096):
+        self.default_model = default_model
+        self.rules = list(rules or [])
+        self.models = dict(models or {})
+        self.enabled = enabled
+        self.history_size = history_size
+        self.plant_history = {}  # plant_id -> 上一次分析结果的摘要
+        self._lock = threading.Lock()
+        self._model_stats = {}
+        self.rule_hits = [0] * len(self.rules)
+
+    @classmethod
+    def from_config(cls, config=None, fallback_model='qwen-vl-max'):
+        """按配置创建路由器；未启用时所有请求使用fallback_model，但仍按模型统计"""
+        config = dict(DEFAULT_ROUTER_CONFIG, **(config or {}))
+        if not config['enabled']:
+            return cls(fallback_model, models=config['models'], enabled=False)
+        return cls(config['default_model'], rules=config['rules'], models=config['models'])
+
+    def route(self, plant_id=None, triage=None):
+        """返回 (模型名称, 路由原因)"""
+        if not self.enabled:
+            return self.default_model, 'fixed'
+
+        context = dict(self.plant_history.get(plant_id, {}))
+        if triage:
+            context['triage_reason'] = triage.get('reason')
+            context['local_score'] = triage.get('local_score')
+
+        for index, rule in enumerate(self.rules):
+            if self._matches(rule.get('when', {}), context):
+                with self._lock:
+                    self.rule_hits[index] += 1
+                return rule['model'], f"rule{index + 1}"
+        return self.default_model, 'default'
+
+    def _matches(self, conditions, context):
+        for key, expected in conditions.items():
+            if key in ('urgency', 'triage_reason'):
+                if context.get(key) not in expected:
+                    return False
+            elif key == 'previously_diseased':
+                if bool(context.get(key)) != bool(expected):
+                    return False
+            elif key in ('health_score_below', 'local_score_below'):
+                value = context.get('health_score' if key == 'health_score_below' else 'local_score')
+                if value is None or value >= expected:
+                    return False
+            else:
+                return False  # 未知条件不命中，避免配置拼写错误时静默升级所有请求
+        return True
+
+    def observe(self, plant_id, result):
+        """记录植株最近一次成功分析的结果，供后续路由使用"""
+        if plant_id is None or not result or result.get('status') != 'ok':
+            return
+        with self._lock:
+            if plant_id not in self.plant_history and len(self.plant_history) >= self.history_size:
+                self.plant_history.pop(next(iter(self.plant_history)))
+            self.plant_history[plant_id] = {
+                'urgency': result.get('urgency'),
+                'health_score': result.get('health_score'),
+                # 紧凑模式的病害在 codes.diseases 中
+                'previously_diseased': bool(result.get('diseases') or (result.get('codes') or {}).get('diseases'))
+            }
+
+    def record_call(self, model, latency_seconds, usage=None, images=1, success=True, queue_wait_seconds=0.0):
+        """记录一次模型调用（合批调用的images为图像数）；latency_seconds 为请求发出后的模型延迟，
+        queue_wait_seconds 为发出前等待配额许可（含限流后重新排队）的时间，两者分开统计"""
+        usage = usage or {}
+        input_tokens = int(usage.get('input_tokens') or 0)
+        output_tokens = int(usage.get('output_tokens') or 0)
+        prices = self.models.get(model, {})
+        cost = (input_tokens * prices.get('input_price', 0.0) + output_tokens * prices.get('output_price', 0.0)) / 1000
+
+        with self._lock:
+            stats = self._model_stats.setdefault(model, {
+                'calls': 0, 'errors': 0, 'images': 0, 'input_tokens': 0, 'output_tokens': 0,
+                'cost': 0.0, 'avg_latency_ms': 0.0, 'max_latency_ms': 0.0, 'avg_queue_wait_ms': 0.0
+            })
+            if not success:
+                stats['errors'] += 1
+                return
+            latency_ms = latency_seconds * 1000
+            queue_wait_ms = queue_wait_seconds * 1000
+            stats['calls'] += 1
+            stats['images'] += images
+            stats['input_tokens'] += input_tokens
+            stats['output_tokens'] += output_tokens
+            stats['cost'] += cost
+            stats['avg_latency_ms'] = latency_ms if stats['calls'] == 1 else \
+                stats['avg_latency_ms'] * 0.9 + latency_ms * 0.1
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+            stats['avg_queue_wait_ms'] = queue_wait_ms if stats['calls'] == 1 else \
+                stats['avg_queue_wait_ms'] * 0.9 + queue_wait_ms * 0.1
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for model, stats in self._model_stats.items():
+                images = stats['images']
+                models[model] = dict(
+                    stats,
+                    cost=round(stats['cost'], 4),
+                    cost_per_image=round(stats['cost'] / images, 5) if images else 0.0,
+                    avg_latency_ms=round(stats['avg_latency_ms'], 1),
+                    max_latency_ms=round(stats['max_latency_ms'], 1),
+                    avg_queue_wait_ms=round(stats['avg_queue_wait_ms'], 1))
+            return {
+                'enabled': self.enabled,
+                'default_model': self.default_model,
+                'rule_hits': list(self.rule_hits),
+                'models': models
+            }
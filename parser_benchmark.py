@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+模型回复解析器对比测试
+在回复语料上比较旧的正则解析流程和 ai_response_parser 的解析速度与成功率；
+语料来自 dashscope_client.response_log 记录的真实回复，或按常见缺陷生成的合成回复
+
+用法:
+    python parser_benchmark.py                                  # 合成语料
+    python parser_benchmark.py --corpus responses.jsonl         # 使用记录的真实回复
+    python parser_benchmark.py --count 400 --repeat 20 --json
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+from ai_response_parser import ResponseParseError, extract_analysis, validate_analysis
+from mock_dashscope_server import build_mock_analysis
+
+# 合成回复的变化类型（按顺序循环生成）
+CORPUS_VARIANTS = ('plain', 'fenced', 'prose', 'long', 'trailing_comma', 'fullwidth', 'truncated', 'inner_quotes')
+
+
+def make_response(rng, index, variant):
+    """生成一条带指定缺陷的模型回复文本"""
+    analysis = build_mock_analysis(index)
+    analysis['diseases'] = [{
+        'name': '叶斑病', 'symptoms': '叶片出现褐色斑点', 'probability': rng.randint(10, 90), 'severity': 'medium',
+        'pathogen': '真菌', 'treatment': '喷施代森锰锌', 'prevention': '加强通风', 'recommendations': ['摘除病叶']
+    }]
+    if variant == 'long':
+        analysis['recommendations'] = [f"建议{i}：保持适宜的温湿度并定期巡查叶片背面" for i in range(60)]
+        analysis['analysis_summary'] = '叶片整体呈绿色，局部有轻微黄化。' * 80
+
+    text = json.dumps(analysis, ensure_ascii=False, indent=2)
+    if variant == 'trailing_comma':
+        text = re.sub(r'(\]|\}|"|\d)(\n\s*[\]\}])', r'\1,\2', text)
+    elif variant == 'fullwidth':
+        text = text.replace('": ', '"：').replace('",\n', '"，\n')
+    elif variant == 'truncated':
+        text = text[:int(len(text) * rng.uniform(0.6, 0.95))]
+    elif variant == 'inner_quotes':
+        text = text.replace('局部有轻微黄化', '局部有"轻微黄化"')
+
+    if variant in ('fenced', 'long', 'trailing_comma', 'fullwidth', 'truncated', 'inner_quotes'):
+        text = '```json\n' + text + '\n```'
+    elif variant == 'prose':
+        text = '根据图片分析（以下为{结构化}结果）：\n' + text + '\n以上分析仅供参考。'
+    return text
+
+
+def generate_corpus(count, seed=0):
+    rng = random.Random(seed)
+    return [(CORPUS_VARIANTS[i % len(CORPUS_VARIANTS)], make_response(rng, i, CORPUS_VARIANTS[i % len(CORPUS_VARIANTS)]))
+            for i in range(count)]
+
+
+def load_corpus(path):
+    corpus = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            corpus.append((record.get('model', 'recorded'), record['text']))
+    return corpus
+
+
+def legacy_parse(ai_response):
+    """改造前 _parse_ai_response 的解析流程（用于对比）"""
+    if ai_response.strip().startswith('{'):
+        return json.loads(ai_response)
+    elif '```json' in ai_response:
+        json_match = re.search(r'```json\s*\n(.*?)\n```', ai_response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(1).strip())
+        json_match = re.search(r'\{.*\}', ai_response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        raise ValueError("无法提取JSON数据")
+    json_match = re.search(r'\{.*\}', ai_response, re.DOTALL)
+    if json_match:
+        return json.loads(json_match.group())
+    raise ValueError("无法提取JSON数据")
+
+
+def current_parse(ai_response):
+    data, _ = extract_analysis(ai_response)
+    # 只有提取出的对象本身带有评分才算成功（校验会补默认值）
+    extracted_score = isinstance(data, dict) and 'health_score' in data
+    validate_analysis(data)
+    return data if extracted_score else {}
+
+
+PARSERS = {'legacy': legacy_parse, 'current': current_parse}
+
+
+def benchmark_parser(name, corpus, repeat=10):
+    """返回每种回复类型的成功率和平均/P95耗时（微秒）"""
+    parse = PARSERS[name]
+    by_variant = {}
+    for variant, text in corpus:
+        timings = []
+        ok = True
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                data = parse(text)
+                ok = isinstance(data, dict) and 'health_score' in data
+            except (ValueError, ResponseParseError):
+                ok = False
+            timings.append((time.perf_counter() - start) * 1e6)
+        entry = by_variant.setdefault(variant, {'count': 0, 'ok': 0, 'timings': []})
+        entry['count'] += 1
+        entry['ok'] += int(ok)
+        entry['timings'].append(min(timings))
+
+    report = {}
+    for variant, entry in by_variant.items():
+        timings = sorted(entry['timings'])
+        report[variant] = {
+            'count': entry['count'],
+            'success_rate': round(entry['ok'] / entry['count'], 3),
+            'avg_us': round(sum(timings) / len(timings), 1),
+            'p95_us': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 1)
+        }
+    return report
+
+
+def print_report(results):
+    variants = sorted({variant for report in results.values() for variant in report})
+    print(f"\n{'类型':<16}" + ''.join(f"{name + ' 成功率':>16}{name + ' 平均us':>16}" for name in results))
+    for variant in variants:
+        row = f"{variant:<16}"
+        for report in results.values():
+            entry = report.get(variant, {})
+            row += f"{entry.get('success_rate', 0):>16.3f}{entry.get('avg_us', 0):>16.1f}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模型回复解析器速度/成功率对比')
+    parser.add_argument('--corpus', default=None, help='记录的回复语料（JSONL，每行含text字段）')
+    parser.add_argument('--count', type=int, default=240, help='合成语料条数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=10, help='每条回复重复解析次数（取最小耗时）')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate_corpus(args.count, args.seed)
+    if not corpus:
+        print("❌ 语料为空")
+        return 1
+
+    results = {name: benchmark_parser(name, corpus, args.repeat) for name in PARSERS}
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"📚 语料: {len(corpus)} 条")
+        print_report(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+以QR码为锚点的植株区域提取
+QR码四个角点确定标记平面到图像的单应矩阵，植株区域用"标记边长"为单位描述
+（相对标记中心的偏移和区域宽高），经透视校正后裁剪出来用于分析：
+像素更少、上传更小、排队任务占用内存更少，也不会混入画面中的相邻植株
+"""
+
+import cv2
+import numpy as np
+
+DEFAULT_ROI_CONFIG = {
+    'enabled': True,
+    # 区域中心相对标记中心的偏移（单位：标记边长；x向右、y向下，按标记自身方向）
+    'offset': (0.0, 0.0),
+    # 区域宽高（单位：标记边长）
+    'size': (4.0, 4.0),
+    'output_max_edge': 768,  # 输出图像长边上限（像素），不会超过原图中的实际分辨率
+    'min_visible': 0.6,  # 区域在画面内的面积比例低于该值时放弃提取
+    'min_marker_px': 12  # 标记边长小于该像素数时放弃提取（透视估计不可靠）
+}
+
+
+def order_marker_corners(corners):
+    """整理标记角点为图像坐标系下的顺时针顺序（保留起始角点）
+
+    OpenCV解码器按QR码自身方向返回 左上、右上、右下、左下；
+    pyzbar返回的多边形可能是逆时针，此时反转为顺时针
+    """
+    points = np.asarray(corners, dtype=np.float32).reshape(-1, 2)
+    if len(points) != 4:
+        hull = cv2.convexHull(points).reshape(-1, 2)
+        if len(hull) < 4:
+            return None
+        points = cv2.boxPoints(cv2.minAreaRect(hull)).astype(np.float32)
+
+    # 图像坐标y轴向下，顺时针时鞋带公式面积为正
+    x, y = points[:, 0], points[:, 1]
+    signed_area = 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    if signed_area < 0:
+        points = np.concatenate([points[:1], points[:0:-1]])
+    return points
+
+
+class PlantROIExtractor:
+    """根据QR码角点提取并校正植株区域"""
+
+    def __init__(self, offset=(0.0, 0.0), size=(4.0, 4.0), output_max_edge=768, min_visible=0.6, min_marker_px=12):
+        self.offset = tuple(offset)
+        self.size = tuple(size)
+        self.output_max_edge = output_max_edge
+        self.min_visible = min_visible
+        self.min_marker_px = min_marker_px
+
+        # 统计信息
+        self.extracted = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_config(cls, config=None):
+        """按配置字典创建提取器，未启用时返回None"""
+        config = dict(DEFAULT_ROI_CONFIG, **(config or {}))
+        if not config['enabled']:
+            return None
+        return cls(offset=config['offset'], size=config['size'], output_max_edge=config['output_max_edge'],
+                   min_visible=config['min_visible'], min_marker_px=config['min_marker_px'])
+
+    def roi_polygon(self, corners):
+        """植株区域在图像中的四个角点，以及标记单位到图像的单应矩阵"""
+        marker = order_marker_corners(corners)
+        if marker is None:
+            return None, None
+
+        unit_square = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float32)
+        homography = cv2.getPerspectiveTransform(unit_square, marker)
+
+        width, height = self.size
+        cx, cy = 0.5 + self.offset[0], 0.5 + self.offset[1]
+        roi_units = np.array([
+            [cx - width / 2, cy - height / 2],
+            [cx + width / 2, cy - height / 2],
+            [cx + width / 2, cy + height / 2],
+            [cx - width / 2, cy + height / 2]
+        ], dtype=np.float32)
+        polygon = cv2.perspectiveTransform(roi_units.reshape(-1, 1, 2), homography).reshape(4, 2)
+        return polygon, homography
+
+    def extract(self, frame, corners):
+        """提取校正后的植株区域，返回 (图像, 信息字典)，无法提取时返回 (None, 原因)"""
+        marker = order_marker_corners(corners)
+        if marker is None:
+            return self._skip('角点无效')
+
+        marker_px = float(np.mean(np.linalg.norm(marker - np.roll(marker, -1, axis=0), axis=1)))
+        if marker_px < self.min_marker_px:
+            return self._skip(f'标记过小({marker_px:.0f}px)')
+
+        polygon, homography = self.roi_polygon(marker)
+        visible = self._visible_fraction(polygon, frame.shape)
+        if visible < self.min_visible:
+            return self._skip(f'区域大部分在画面外({visible:.0%})')
+
+        # 输出分辨率：不超过原图中标记的实际像素密度，长边不超过上限
+        width, height = self.size
+        pixels_per_unit = min(marker_px, self.output_max_edge / max(width, height))
+        out_width = max(1, int(round(width * pixels_per_unit)))
+        out_height = max(1, int(round(height * pixels_per_unit)))
+
+        # 输出像素 → 标记单位 → 图像像素
+        units_per_pixel = 1.0 / pixels_per_unit
+        output_to_units = np.array([
+            [units_per_pixel, 0, 0.5 + self.offset[0] - width / 2],
+            [0, units_per_pixel, 0.5 + self.offset[1] - height / 2],
+            [0, 0, 1]
+        ], dtype=np.float64)
+        output_to_image = homography @ output_to_units
+
+        roi = cv2.warpPerspective(frame, output_to_image, (out_width, out_height),
+                                  flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                  borderMode=cv2.BORDER_REPLICATE)
+        self.extracted += 1
+        return roi, {
+            'width': out_width,
+            'height': out_height,
+            'visible': round(visible, 3),
+            'marker_px': round(marker_px, 1),
+            'polygon': polygon.round(1).tolist()
+        }
+
+    def _visible_fraction(self, polygon, frame_shape):
+        height, width = frame_shape[:2]
+        area = cv2.contourArea(polygon)
+        if area <= 0:
+            return 0.0
+        frame_rect = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
+        inside, _ = cv2.intersectConvexConvex(polygon.astype(np.float32), frame_rect)
+        return float(inside) / area
+
+    def _skip(self, reason):
+        self.skipped += 1
+        return None, reason
+
+    def stats(self):
+        return {
+            'offset': self.offset,
+            'size': self.size,
+            'extracted': self.extracted,
+            'skipped': self.skipped
+        }
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+QR码解码后端对比测试
+在本地生成的合成QR码图像集上运行各解码后端，统计解码速度、识别率和角点精度，
+用于选择在高空（标记较小、模糊、光照变化）时仍能识别的最快解码器
+
+用法:
+    python qr_benchmark.py                          # 默认样本数，测试所有可用后端
+    python qr_benchmark.py --count 300 --cascade    # 使用完整解码级联而不是单次解码
+    python qr_benchmark.py --backends opencv opencv_aruco --json
+    python qr_benchmark.py --save-corpus corpus.npz # 保存样本集，之后用 --load-corpus 复用
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from qr_detection import QR_BACKENDS, QRDecodeCascade, create_qr_backend
+
+# 样本变化类型（按顺序循环生成，保证每类样本数量一致）
+CORPUS_VARIANTS = ('clean', 'small', 'blur', 'motion_blur', 'perspective', 'dark', 'gradient', 'noise')
+
+DEFAULT_FRAME_SIZE = (720, 960)
+
+
+def _encode_qr(text):
+    """生成QR码位图，返回(图像, 码区在位图中的四个角点)"""
+    encoder = cv2.QRCodeEncoder.create()
+    bitmap = encoder.encode(text)
+    dark = np.argwhere(bitmap == 0)
+    (top, left), (bottom, right) = dark.min(axis=0), dark.max(axis=0) + 1
+    corners = np.array([[left, top], [right, top], [right, bottom], [left, bottom]], dtype=np.float32)
+    return bitmap, corners
+
+
+def _background(rng, height, width):
+    """带纹理的农田背景，避免纯色背景让检测过于容易"""
+    base = rng.integers(60, 120, size=(height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    background = cv2.resize(base, (width, height), interpolation=cv2.INTER_LINEAR)
+    noise = rng.normal(0, 6, size=background.shape)
+    return np.clip(background + noise, 0, 255).astype(np.uint8)
+
+
+def generate_sample(rng, index, variant, frame_size=DEFAULT_FRAME_SIZE):
+    """生成一个样本：QR码经缩放、透视变换后贴到背景上，再叠加模糊/光照/噪声变化"""
+    height, width = frame_size
+    data = f"plant_{index:04d}"
+    bitmap, code_corners = _encode_qr(data)
+
+    # 模块像素尺寸：small 模拟高空拍摄时的小标记
+    module_px = rng.uniform(2.0, 3.0) if variant == 'small' else rng.uniform(4.0, 8.0)
+    side = bitmap.shape[0] * module_px
+    src = np.array([[0, 0], [bitmap.shape[1], 0], [bitmap.shape[1], bitmap.shape[0]], [0, bitmap.shape[0]]],
+                   dtype=np.float32)
+
+    # 目标四边形：随机位置 + 轻微旋转，perspective 变体加大角点扰动
+    cx = rng.uniform(side, width - side)
+    cy = rng.uniform(side, height - side)
+    angle = rng.uniform(-0.4, 0.4)
+    jitter = side * (0.18 if variant == 'perspective' else 0.03)
+    half = side / 2
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    square = np.array([[-half, -half], [half, -half], [half, half], [-half, half]])
+    dst = (square @ rotation.T + [cx, cy] + rng.uniform(-jitter, jitter, size=(4, 2))).astype(np.float32)
+
+    homography = cv2.getPerspectiveTransform(src, dst)
+    frame = _background(rng, height, width)
+    qr_bgr = cv2.cvtColor(bitmap, cv2.COLOR_GRAY2BGR)
+    warped = cv2.warpPerspective(qr_bgr, homography, (width, height), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.full(bitmap.shape, 255, np.uint8), homography, (width, height))
+    frame[mask > 0] = warped[mask > 0]
+
+    corners = cv2.perspectiveTransform(code_corners.reshape(-1, 1, 2), homography).reshape(4, 2)
+
+    if variant == 'blur':
+        frame = cv2.GaussianBlur(frame, (0, 0), rng.uniform(1.0, 2.0))
+    elif variant == 'motion_blur':
+        length = int(rng.integers(5, 10))
+        kernel = np.zeros((length, length), np.float32)
+        kernel[length // 2, :] = 1.0 / length
+        frame = cv2.filter2D(frame, -1, kernel)
+    elif variant == 'dark':
+        frame = (frame.astype(np.float32) * rng.uniform(0.2, 0.35)).astype(np.uint8)
+    elif variant == 'gradient':
+        # 一侧强光一侧阴影
+        ramp = np.linspace(rng.uniform(0.3, 0.5), rng.uniform(1.3, 1.6), width, dtype=np.float32)
+        frame = np.clip(frame.astype(np.float32) * ramp[None, :, None], 0, 255).astype(np.uint8)
+    elif variant == 'noise':
+        frame = np.clip(frame + rng.normal(0, 18, size=frame.shape), 0, 255).astype(np.uint8)
+
+    return {
+        'frame': frame,
+        'data': data,
+        'corners': corners.tolist(),
+        'variant': variant
+    }
+
+
+def generate_corpus(count=160, seed=0, frame_size=DEFAULT_FRAME_SIZE):
+    """生成合成QR码样本集"""
+    rng = np.random.default_rng(seed)
+    return [generate_sample(rng, index, CORPUS_VARIANTS[index % len(CORPUS_VARIANTS)], frame_size)
+            for index in range(count)]
+
+
+def save_corpus(corpus, path):
+    meta = [{key: sample[key] for key in ('data', 'corners', 'variant')} for sample in corpus]
+    np.savez_compressed(path, frames=np.stack([sample['frame'] for sample in corpus]),
+                        meta=np.array(json.dumps(meta)))
+
+
+def load_corpus(path):
+    archive = np.load(path)
+    meta = json.loads(str(archive['meta']))
+    return [dict(item, frame=frame) for item, frame in zip(meta, archive['frames'])]
+
+
+def corner_error(expected, detected):
+    """角点平均误差（像素），取四个角点各种循环起点和方向中误差最小的对应关系"""
+    expected = np.asarray(expected, dtype=np.float32).reshape(4, 2)
+    detected = np.asarray(detected, dtype=np.float32).reshape(-1, 2)[:4]
+    if len(detected) < 4:
+        return None
+
+    best = None
+    for order in (detected, detected[::-1]):
+        for shift in range(4):
+            error = float(np.linalg.norm(np.roll(order, shift, axis=0) - expected, axis=1).mean())
+            best = error if best is None else min(best, error)
+    return best
+
+
+def benchmark_backend(name, corpus, use_cascade=False, repeat=1):
+    """在样本集上运行一个解码后端，返回统计结果"""
+    if use_cascade:
+        decoder = QRDecodeCascade(backend=name)
+        decode = decoder.decode
+    else:
+        backend = create_qr_backend(name)
+        decode = lambda frame: backend.decode(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+    hits = 0
+    false_decodes = 0
+    corner_errors = []
+    per_variant = {}
+    total_seconds = 0.0
+
+    for sample in corpus:
+        codes = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            codes = decode(sample['frame'])
+            total_seconds += time.perf_counter() - start_time
+
+        matched = [code for code in codes if code['data'] == sample['data']]
+        false_decodes += len(codes) - len(matched)
+
+        variant_stats = per_variant.setdefault(sample['variant'], {'samples': 0, 'hits': 0})
+        variant_stats['samples'] += 1
+        if matched:
+            hits += 1
+            variant_stats['hits'] += 1
+            error = corner_error(sample['corners'], matched[0]['corners'])
+            if error is not None:
+                corner_errors.append(error)
+
+    decodes = len(corpus) * repeat
+    return {
+        'backend': name,
+        'mode': 'cascade' if use_cascade else 'single',
+        'samples': len(corpus),
+        'decodes_per_second': round(decodes / total_seconds, 1) if total_seconds else 0.0,
+        'avg_ms': round(total_seconds * 1000 / decodes, 2) if decodes else 0.0,
+        'recall': round(hits / len(corpus), 3) if corpus else 0.0,
+        'false_decodes': false_decodes,
+        'corner_error_px': {
+            'mean': round(float(np.mean(corner_errors)), 2) if corner_errors else None,
+            'p95': round(float(np.percentile(corner_errors, 95)), 2) if corner_errors else None
+        },
+        'recall_by_variant': {
+            variant: round(stats['hits'] / stats['samples'], 3) for variant, stats in per_variant.items()
+        }
+    }
+
+
+def print_report(results):
+    print(f"{'后端':<14}{'模式':<9}{'解码/秒':>9}{'平均ms':>9}{'识别率':>8}{'误识别':>7}{'角点误差':>10}")
+    for result in results:
+        mean_error = result['corner_error_px']['mean']
+        print(f"{result['backend']:<14}{result['mode']:<9}{result['decodes_per_second']:>9}"
+              f"{result['avg_ms']:>9}{result['recall']:>8}{result['false_decodes']:>7}"
+              f"{mean_error if mean_error is not None else '-':>10}")
+
+    print("\n按样本类型的识别率:")
+    print(f"{'后端':<14}" + ''.join(f"{variant:>12}" for variant in CORPUS_VARIANTS))
+    for result in results:
+        print(f"{result['backend']:<14}" + ''.join(
+            f"{result['recall_by_variant'].get(variant, '-'):>12}" for variant in CORPUS_VARIANTS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QR码解码后端速度/识别率对比')
+    parser.add_argument('--backends', nargs='+', choices=list(QR_BACKENDS), default=list(QR_BACKENDS),
+                        help='要测试的解码后端（默认全部）')
+    parser.add_argument('--count', type=int, default=160, help='合成样本数量')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--repeat', type=int, default=1, help='每个样本重复解码次数（用于稳定计时）')
+    parser.add_argument('--cascade', action='store_true', help='使用完整解码级联（与后端服务一致）')
+    parser.add_argument('--save-corpus', help='保存生成的样本集(.npz)')
+    parser.add_argument('--load-corpus', help='加载已保存的样本集(.npz)')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    if args.load_corpus:
+        corpus = load_corpus(args.load_corpus)
+    else:
+        corpus = generate_corpus(args.count, args.seed)
+    if args.save_corpus:
+        save_corpus(corpus, args.save_corpus)
+
+    results = []
+    for name in args.backends:
+        if not QR_BACKENDS[name].available:
+            print(f"⚠️ 解码后端 {name} 不可用，跳过", file=sys.stderr)
+            continue
+        results.append(benchmark_backend(name, corpus, args.cascade, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"📊 样本数: {len(corpus)}  模式: {'解码级联' if args.cascade else '单次解码'}")
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+"""
+QR码解码核心、跟踪与多进程检测后端
+解码器后端可替换（pyzbar / OpenCV QRCodeDetector / OpenCV QRCodeDetectorAruco），按配置选择；
+解码函数只依赖图像数据，可在主进程内直接调用，也可在工作进程中运行；
+解码按级联进行：先尝试代价低的预处理，前面阶段未解码到才尝试后面阶段；
+跟踪模式下只对已识别标记附近的区域重新解码；
+多进程模式下帧通过共享内存传给工作进程，结果按帧序号回传
+"""
+
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+try:
+    from pyzbar import pyzbar
+
+    PYZBAR_AVAILABLE = True
+except ImportError:
+    PYZBAR_AVAILABLE = False
+
+
+def preprocess_for_qr(gray, clahe):
+    """图像预处理 - 高斯模糊去噪 + 对比度增强"""
+    gray = cv2.GaussianBlur(gray, (3, 3), 0)
+    return clahe.apply(gray)
+
+
+def decode_qr_gray(gray):
+    """使用pyzbar解码灰度图中的QR码，返回原始检测结果列表"""
+    codes = []
+    if not PYZBAR_AVAILABLE:
+        return codes
+
+    for qr in pyzbar.decode(gray):
+        try:
+            # 解码数据
+            data = qr.data.decode('utf-8')
+        except UnicodeDecodeError:
+            print(f"⚠️ QR码数据解码失败，可能包含非UTF-8字符")
+            continue
+
+        rect = qr.rect
+
+        # 计算角点
+        if hasattr(qr, 'polygon') and qr.polygon:
+            # 使用多边形角点（更精确）
+            corners = [[p.x, p.y] for p in qr.polygon]
+        else:
+            # 从矩形推导角点
+            corners = [
+                [rect.left, rect.top],
+                [rect.left + rect.width, rect.top],
+                [rect.left + rect.width, rect.top + rect.height],
+                [rect.left, rect.top + rect.height]
+            ]
+
+        codes.append({
+            'data': data,
+            'corners': corners,
+            'rect': (rect.left, rect.top, rect.width, rect.height),
+            'quality': qr.quality if hasattr(qr, 'quality') else 100
+        })
+
+    return codes
+
+
+def _corners_to_code(data, corners, quality=100):
+    """由角点构造统一格式的解码结果"""
+    corners = [[float(x), float(y)] for x, y in corners]
+    x, y, w, h = cv2.boundingRect(np.array(corners, dtype=np.float32))
+    return {
+        'data': data,
+        'corners': corners,
+        'rect': (x, y, w, h),
+        'quality': quality
+    }
+
+
+class QRDetectorBackend:
+    """QR码解码后端接口 - decode(gray) 返回 [{'data', 'corners', 'rect', 'quality'}, ...]"""
+
+    name = 'base'
+    available = False
+
+    def decode(self, gray):
+        raise NotImplementedError
+
+
+class PyzbarBackend(QRDetectorBackend):
+    """pyzbar（zbar）解码后端"""
+
+    name = 'pyzbar'
+    available = PYZBAR_AVAILABLE
+
+    def decode(self, gray):
+        return decode_qr_gray(gray)
+
+
+class OpenCVQRBackend(QRDetectorBackend):
+    """OpenCV内置QRCodeDetector解码后端（无需额外依赖）"""
+
+    name = 'opencv'
+    available = hasattr(cv2, 'QRCodeDetector')
+
+    def __init__(self):
+        self.detector = cv2.QRCodeDetector() if self.available else None
+
+    def decode(self, gray):
+        if self.detector is None:
+            return []
+        try:
+            ok, datas, points, _ = self.detector.detectAndDecodeMulti(gray)
+        except cv2.error:
+            return []
+        if not ok or points is None:
+            return []
+
+        # 定位成功但解码失败的标记数据为空字符串，直接忽略
+        return [_corners_to_code(data, corners)
+                for data, corners in zip(datas, points) if data]
+
+
+class OpenCVArucoQRBackend(OpenCVQRBackend):
+    """OpenCV QRCodeDetectorAruco解码后端（基于ArUco的定位图案检测）"""
+
+    name = 'opencv_aruco'
+    available = hasattr(cv2, 'QRCodeDetectorAruco')
+
+    def __init__(self):
+        self.detector = cv2.QRCodeDetectorAruco() if self.available else None
+
+
+QR_BACKENDS = {
+    PyzbarBackend.name: PyzbarBackend,
+    OpenCVQRBackend.name: OpenCVQRBackend,
+    OpenCVArucoQRBackend.name: OpenCVArucoQRBackend
+}
+
+
+def create_qr_backend(name='pyzbar'):
+    """按名称创建QR码解码后端"""
+    backend_class = QR_BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"未知的QR码解码后端: {name}（可选: {', '.join(QR_BACKENDS)}）")
+    if not backend_class.available:
+        print(f"⚠️ QR码解码后端 {name} 当前不可用")
+    return backend_class()
+
+
+def available_qr_backends():
+    """当前环境可用的解码后端名称列表"""
+    return [name for name, backend_class in QR_BACKENDS.items() if backend_class.available]
+
+
+# 级联阶段（按代价从低到高）：
+#   downscaled - 缩小后的原始灰度图
+#   full       - 全分辨率原始灰度图
+#   clahe      - 全分辨率 + CLAHE对比度增强
+#   blur_clahe - 全分辨率 + 高斯模糊 + CLAHE
+DEFAULT_CASCADE_STAGES = ('downscaled', 'full', 'clahe', 'blur_clahe')
+
+
+class CascadeStats:
+    """级联各阶段的尝试次数、命中次数和耗时统计"""
+
+    def __init__(self, stages):
+        self.stages = {name: {'attempts': 0, 'hits': 0, 'total_ms': 0.0} for name in stages}
+
+    def record(self, stage, hit, elapsed_ms):
+        stats = self.stages.setdefault(stage, {'attempts': 0, 'hits': 0, 'total_ms': 0.0})
+        stats['attempts'] += 1
+        stats['hits'] += 1 if hit else 0
+        stats['total_ms'] += elapsed_ms
+
+    def snapshot(self):
+        result = {}
+        for name, stats in self.stages.items():
+            attempts = stats['attempts']
+            result[name] = {
+                'attempts': attempts,
+                'hits': stats['hits'],
+                'hit_rate': round(stats['hits'] / attempts, 3) if attempts else 0.0,
+                'avg_ms': round(stats['total_ms'] / attempts, 2) if attempts else 0.0
+            }
+        return result
+
+
+class QRDecodeCascade:
+    """多级QR码解码级联 - 预处理对象只创建一次，记录每个阶段的命中率"""
+
+    def __init__(self, stages=DEFAULT_CASCADE_STAGES, downscale=0.5, min_downscale_size=320, backend='pyzbar'):
+        unknown = [name for name in stages if name not in DEFAULT_CASCADE_STAGES]
+        if unknown:
+            raise ValueError(f"未知的QR解码级联阶段: {unknown}")
+
+        self.stages = tuple(stages)
+        self.backend = create_qr_backend(backend)
+        self.downscale = downscale
+        self.min_downscale_size = min_downscale_size  # 图像短边小于该值时跳过缩小阶段
+
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self.stats = CascadeStats(self.stages)
+        self.last_trace = []  # 最近一次解码经过的阶段 [(阶段, 是否命中, 耗时ms), ...]
+
+    def decode(self, image):
+        """按级联顺序解码，某一阶段解码到QR码即返回"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        self.last_trace = []
+
+        for stage in self.stages:
+            if stage == 'downscaled' and min(gray.shape[:2]) * self.downscale < self.min_downscale_size:
+                continue
+
+            start_time = time.perf_counter()
+            codes = self._run_stage(stage, gray)
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+            self.stats.record(stage, bool(codes), elapsed_ms)
+            self.last_trace.append((stage, bool(codes), elapsed_ms))
+            if codes:
+                return codes
+
+        return []
+
+    def _run_stage(self, stage, gray):
+        if stage == 'downscaled':
+            small = cv2.resize(gray, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+            return [_scale_code(code, 1.0 / self.downscale) for code in self.backend.decode(small)]
+        if stage == 'full':
+            return self.backend.decode(gray)
+        if stage == 'clahe':
+            return self.backend.decode(self.clahe.apply(gray))
+        return self.backend.decode(preprocess_for_qr(gray, self.clahe))
+
+
+def decode_qr_frame(frame, cascade):
+    """使用解码级联解码BGR帧或灰度图中的QR码"""
+    return cascade.decode(frame)
+
+
+def _scale_code(code, factor):
+    """将缩小图上的解码结果换算回原图坐标"""
+    left, top, width, height = code['rect']
+    return {
+        'data': code['data'],
+        'corners': [[x * factor, y * factor] for x, y in code['corners']],
+        'rect': (int(left * factor), int(top * factor), int(width * factor), int(height * factor)),
+        'quality': code['quality']
+    }
+
+
+def _offset_code(code, dx, dy):
+    """将ROI内的解码结果平移回整帧坐标"""
+    left, top, width, height = code['rect']
+    return {
+        'data': code['data'],
+        'corners': [[x + dx, y + dy] for x, y in code['corners']],
+        'rect': (left + dx, top + dy, width, height),
+        'quality': code['quality']
+    }
+
+
+class QRMarkerTracker:
+    """QR码跟踪 - 光流跟踪已识别标记的四个角点，只对填充后的ROI重新解码，
+    整帧扫描仅定期进行或在跟踪丢失时进行"""
+
+    def __init__(self, cascade, full_scan_interval=0.5, roi_padding=0.5, max_misses=3):
+        self.cascade = cascade
+        self.full_scan_interval = full_scan_interval
+        self.roi_padding = roi_padding  # ROI在标记尺寸基础上向外扩展的比例
+        self.max_misses = max_misses  # ROI连续解码失败多少次后放弃跟踪
+
+        self.tracks = {}  # QR数据 -> {'corners': ndarray(4, 2), 'misses': int}
+        self.prev_gray = None
+        self.last_full_scan = 0
+        self.force_full_scan = False
+
+        # 统计信息
+        self.full_scans = 0
+        self.roi_decodes = 0
+        self.roi_hits = 0
+        self.track_losses = 0
+        self.avg_process_ms = 0.0
+        self.frames = 0
+
+    def reset(self):
+        self.tracks = {}
+        self.prev_gray = None
+        self.last_full_scan = 0
+
+    def process(self, frame):
+        """处理一帧，返回本帧解码到的QR码列表"""
+        start_time = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        now = time.time()
+
+        codes = {}
+        if self.tracks and self.prev_gray is not None and self.prev_gray.shape == gray.shape:
+            self._track(gray)
+            for code in self._decode_tracked_rois(gray):
+                codes[code['data']] = code
+
+        # 没有跟踪标记时同样按 full_scan_interval 节流，只有跟踪丢失时才立即整帧扫描
+        need_full_scan = self.force_full_scan or now - self.last_full_scan >= self.full_scan_interval
+        if need_full_scan:
+            self.full_scans += 1
+            self.last_full_scan = now
+            self.force_full_scan = False
+            for code in decode_qr_frame(gray, self.cascade):
+                codes.setdefault(code['data'], code)
+                self._update_track(code)
+
+        self.prev_gray = gray
+        self._record_latency(start_time)
+        return list(codes.values())
+
+    def _track(self, gray):
+        """用金字塔LK光流把所有跟踪标记的角点推进到当前帧"""
+        keys = list(self.tracks.keys())
+        points = np.concatenate([self.tracks[key]['corners'] for key in keys]).reshape(-1, 1, 2)
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, points, None, winSize=(21, 21), maxLevel=3)
+
+        for index, key in enumerate(keys):
+            if status[index * 4:(index + 1) * 4].all():
+                self.tracks[key]['corners'] = new_points[index * 4:(index + 1) * 4].reshape(4, 2)
+            else:
+                self._drop_track(key)
+
+    def _decode_tracked_rois(self, gray):
+        """只对跟踪标记周围的填充区域进行解码"""
+        height, width = gray.shape[:2]
+        codes = []
+
+        for key in list(self.tracks.keys()):
+            corners = self.tracks[key]['corners']
+            x, y, w, h = cv2.boundingRect(corners.astype(np.float32))
+            pad = int(max(w, h) * self.roi_padding)
+            x0, y0 = max(0, x - pad), max(0, y - pad)
+            x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+            if x1 - x0 < 8 or y1 - y0 < 8:
+                self._drop_track(key)
+                continue
+
+            self.roi_decodes += 1
+            found = False
+            for code in decode_qr_frame(gray[y0:y1, x0:x1], self.cascade):
+                code = _offset_code(code, x0, y0)
+                codes.append(code)
+                self._update_track(code)
+                found = found or code['data'] == key
+
+            if found:
+                self.roi_hits += 1
+            elif key in self.tracks:
+                self.tracks[key]['misses'] += 1
+                if self.tracks[key]['misses'] > self.max_misses:
+                    self._drop_track(key)
+
+        return codes
+
+    def _update_track(self, code):
+        self.tracks[code['data']] = {
+            'corners': np.array(code['corners'], dtype=np.float32).reshape(-1, 2)[:4],
+            'misses': 0
+        }
+
+    def _drop_track(self, key):
+        if self.tracks.pop(key, None) is not None:
+            self.track_losses += 1
+            # 跟踪丢失时下一帧立即整帧扫描
+            self.force_full_scan = True
+
+    def _record_latency(self, start_time):
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.frames += 1
+        self.avg_process_ms = elapsed_ms if self.frames == 1 else self.avg_process_ms * 0.9 + elapsed_ms * 0.1
+
+    def stats(self):
+        return {
+            'tracks': len(self.tracks),
+            'frames': self.frames,
+            'full_scans': self.full_scans,
+            'roi_decodes': self.roi_decodes,
+            'roi_hits': self.roi_hits,
+            'track_losses': self.track_losses,
+            'avg_process_ms': round(self.avg_process_ms, 2)
+        }
+
+
+# ---------------------------------------------------------------------------
+# 工作进程
+# ---------------------------------------------------------------------------
+
+_worker_state = {}
+
+
+def _pool_worker_init(shm_name, slot_count, slot_shape, cascade_options):
+    """工作进程初始化 - 挂载共享内存帧缓冲区，创建本进程的解码级联"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state['shm'] = shm
+    _worker_state['frames'] = np.ndarray((slot_count,) + tuple(slot_shape), dtype=np.uint8, buffer=shm.buf)
+    _worker_state['cascade'] = QRDecodeCascade(**cascade_options)
+
+
+def _pool_worker_decode(slot, seq, shape):
+    """工作进程解码任务 - 从共享内存槽位读取帧并解码"""
+    start_time = time.perf_counter()
+    height, width = shape[:2]
+    frame = _worker_state['frames'][slot][:height, :width]
+    cascade = _worker_state['cascade']
+    codes = decode_qr_frame(frame, cascade)
+    return seq, codes, (time.perf_counter() - start_time) * 1000, cascade.last_trace
+
+
+class ProcessPoolQRDetector:
+    """多进程QR码检测后端 - 共享内存传帧，按帧序号回传结果"""
+
+    def __init__(self, workers=0, slots_per_worker=2, cascade_options=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.slot_count = self.workers * slots_per_worker
+        self.cascade_options = cascade_options or {}
+        # 汇总各工作进程的级联阶段统计
+        self.cascade_stats = CascadeStats(self.cascade_options.get('stages', DEFAULT_CASCADE_STAGES))
+
+        self._executor = None
+        self._shm = None
+        self._frames = None
+        self._slot_shape = None
+        self._free_slots = deque()
+        self._results = deque()
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.submitted_count = 0
+        self.completed_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self.avg_decode_ms = 0.0
+
+    def _start(self, frame_shape):
+        """按帧尺寸分配共享内存并启动工作进程"""
+        self.close()
+
+        self._slot_shape = tuple(frame_shape)
+        slot_bytes = int(np.prod(self._slot_shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=slot_bytes * self.slot_count)
+        self._frames = np.ndarray((self.slot_count,) + self._slot_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._free_slots = deque(range(self.slot_count))
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_pool_worker_init,
+            initargs=(self._shm.name, self.slot_count, self._slot_shape, self.cascade_options)
+        )
+        print(f"🧵 QR码多进程检测已启动: {self.workers}个工作进程, {self.slot_count}个共享内存槽位")
+
+    def submit(self, seq, frame):
+        """提交一帧进行解码，没有空闲槽位时丢弃该帧并返回False"""
+        if frame.ndim != 3 or frame.dtype != np.uint8:
+            raise ValueError("仅支持uint8 BGR帧")
+
+        if self._executor is None or frame.shape != self._slot_shape:
+            self._start(frame.shape)
+
+        with self._lock:
+            if not self._free_slots:
+                self.dropped_count += 1
+                return False
+            slot = self._free_slots.popleft()
+
+        self._frames[slot][...] = frame
+        self.submitted_count += 1
+
+        try:
+            future = self._executor.submit(_pool_worker_decode, slot, seq, frame.shape)
+        except Exception:
+            with self._lock:
+                self._free_slots.append(slot)
+            raise
+
+        future.add_done_callback(lambda f, s=slot, executor=self._executor: self._on_done(f, s, executor))
+        return True
+
+    def _on_done(self, future, slot, executor):
+        if executor is not self._executor:
+            # 工作进程已因帧尺寸变化重启，旧结果丢弃
+            return
+
+        with self._lock:
+            self._free_slots.append(slot)
+
+        try:
+            seq, codes, decode_ms, trace = future.result()
+        except Exception as e:
+            self.error_count += 1
+            print(f"❌ QR码工作进程解码失败: {e}")
+            return
+
+        self.completed_count += 1
+        self.avg_decode_ms = decode_ms if self.completed_count == 1 else self.avg_decode_ms * 0.9 + decode_ms * 0.1
+        for stage, hit, elapsed_ms in trace:
+            self.cascade_stats.record(stage, hit, elapsed_ms)
+        self._results.append((seq, codes))
+
+    def poll_results(self):
+        """取出所有已完成的解码结果 [(seq, codes), ...]"""
+        results = []
+        while self._results:
+            results.append(self._results.popleft())
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            try:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            except Exception:
+                traceback.print_exc()
+            self._executor = None
+
+        if self._shm is not None:
+            self._frames = None
+            try:
+                self._shm.close()
+                self._shm.unlink()
+            except Exception:
+                pass
+            self._shm = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'slots': self.slot_count,
+            'free_slots': len(self._free_slots),
+            'submitted': self.submitted_count,
+            'completed': self.completed_count,
+            'dropped': self.dropped_count,
+            'errors': self.error_count,
+            'avg_decode_ms': round(self.avg_decode_ms, 2),
+            'cascade': self.cascade_stats.snapshot()
+        }
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+云端配额调度对比测试
+启动带限流配额的本地模拟服务器（mock_dashscope_server.py），用同一批图像分别以
+固定并发（限流即失败，回退本地分析）和配额调度（令牌桶 + AIMD并发，限流后重新排队）运行，
+比较云端成功数、回退数、服务端返回的429次数和吞吐量
+
+用法:
+    python quota_benchmark.py                                   # 默认：配额120次/分钟、同时3个请求
+    python quota_benchmark.py --plants 60 --rpm 240 --max-concurrent 4 --delay 0.8
+    python quota_benchmark.py --client-rpm 110 --json            # 客户端令牌桶按略低于配额的速率发放
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from crop_analyzer_dashscope import TIER_CLOUD, CropAnalyzer
+from mock_dashscope_server import start_mock_server
+
+SCENARIOS = ('fixed', 'scheduled')
+
+
+def scenario_config(name, args, base_url):
+    config = {
+        'base_url': base_url,
+        'max_concurrency': args.concurrency,
+        'analysis_deadline': args.deadline
+    }
+    if name == 'fixed':
+        # 调度前的行为：并发固定，429直接作为失败（重试耗尽或熔断后回退本地分析）
+        config['quota'] = {'adaptive_concurrency': False, 'rate_limit_rpm': 0, 'throttle_max_wait': 0}
+    else:
+        config['quota'] = {'rate_limit_rpm': args.client_rpm, 'rate_limit_burst': args.client_burst,
+                           'throttle_max_wait': args.throttle_max_wait}
+    return config
+
+
+async def run_scenario(name, args, server, images):
+    with server.lock:
+        server.throttled_count = 0
+        server.served_count = 0
+        server.max_in_flight = 0
+    analyzer = CropAnalyzer('benchmark-key', config=scenario_config(name, args, server.base_url))
+
+    start = time.perf_counter()
+    results = await analyzer.analyze_batch_async(images, [f"P{i}" for i in range(len(images))],
+                                                 concurrency=len(images))
+    elapsed = time.perf_counter() - start
+    client_stats = analyzer.get_client_stats()
+    model_stats = analyzer.get_router_stats()['models'].get(analyzer.model_name, {})
+    await analyzer.close()
+
+    cloud = sum(1 for result in results if result.get('analysis_tier') == TIER_CLOUD)
+    return {
+        'seconds': round(elapsed, 2),
+        'cloud': cloud,
+        'fallback': len(results) - cloud,
+        'cloud_per_second': round(cloud / elapsed, 2) if elapsed > 0 else 0.0,
+        'server_throttled': server.throttled_count,
+        'server_max_in_flight': server.max_in_flight,
+        # 模型延迟（请求发出后）和配额排队时间分开统计
+        'avg_latency_ms': model_stats.get('avg_latency_ms', 0.0),
+        'avg_queue_wait_ms': model_stats.get('avg_queue_wait_ms', 0.0),
+        'quota': client_stats['quota']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='云端配额调度（令牌桶 + AIMD）对比测试')
+    parser.add_argument('--plants', type=int, default=40, help='分析的植株数（同时提交）')
+    parser.add_argument('--rpm', type=float, default=120, help='模拟服务器的每分钟请求数配额')
+    parser.add_argument('--burst', type=int, default=3, help='模拟服务器配额允许的突发请求数')
+    parser.add_argument('--max-concurrent', type=int, default=3, help='模拟服务器的并发请求数配额')
+    parser.add_argument('--delay', type=float, default=0.5, help='模拟服务器的处理时间（秒）')
+    parser.add_argument('--concurrency', type=int, default=8, help='客户端max_concurrency')
+    parser.add_argument('--client-rpm', type=float, default=0, help='客户端令牌桶速率（每分钟，0表示不限速）')
+    parser.add_argument('--client-burst', type=int, default=2)
+    parser.add_argument('--throttle-max-wait', type=float, default=120.0)
+    parser.add_argument('--deadline', type=float, default=20.0, help='单次分析截止时间（秒）')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    server = start_mock_server(delay=args.delay)
+    server.rate_limit_rpm = args.rpm
+    server.rate_limit_burst = args.burst
+    server.max_concurrent = args.max_concurrent
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (240, 320, 3), dtype=np.uint8) for _ in range(args.plants)]
+    results = {name: asyncio.run(run_scenario(name, args, server, images)) for name in SCENARIOS}
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"\n📊 {args.plants} 株，服务端配额 {args.rpm:g}次/分钟、并发 {args.max_concurrent}，处理时间 {args.delay}s")
+    print(f"{'方案':<12}{'耗时s':>8}{'云端':>6}{'回退':>6}{'云端/秒':>9}{'429次数':>9}{'并发上限':>10}"
+          f"{'延迟ms':>9}{'排队ms':>9}")
+    for name, result in results.items():
+        concurrency = result['quota']['concurrency']
+        print(f"{name:<12}{result['seconds']:>8}{result['cloud']:>6}{result['fallback']:>6}"
+              f"{result['cloud_per_second']:>9}{result['server_throttled']:>9}"
+              f"{concurrency['lowest_limit']:>5}-{concurrency['limit']:<4}"
+              f"{result['avg_latency_ms']:>9}{result['avg_queue_wait_ms']:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+配额感知的云端请求调度
+令牌桶按配置的每分钟请求数发放请求许可，被限流(429)时整体暂停一段时间（优先使用响应的Retry-After）；
+AIMD并发控制：请求成功且延迟正常时并发上限缓慢加一（每轮约+1），
+遇到429/5xx/超时时乘性减半，延迟明显高于基线时小幅下调，每个延迟窗口内最多下调一次；
+被限流的请求由 DashScopeAsyncClient 重新排队等待许可，而不是当作失败回退到本地分析
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+
+DEFAULT_QUOTA_CONFIG = {
+    'rate_limit_rpm': 0,  # 每分钟请求数上限（按阿里云百炼账号的限流配额设置），0表示不限速
+    'rate_limit_burst': 2,  # 令牌桶容量（允许的突发请求数）
+    'adaptive_concurrency': True,  # False时并发上限固定为max_concurrency
+    'min_concurrency': 1,
+    'initial_concurrency': None,  # None表示从max_concurrency开始
+    'latency_tolerance': 2.0,  # 延迟超过基线的倍数时视为排队/过载
+    'overload_backoff': 0.5,  # 429/5xx/超时后并发上限乘以该系数
+    'latency_backoff': 0.9,  # 延迟过高时并发上限乘以该系数
+    'throttle_max_wait': 60.0,  # 被限流的请求重新排队的累计时间上限（秒），超过后按失败处理
+    'throttle_base_delay': 1.0,  # 没有Retry-After时的暂停时间，连续限流时指数增长
+    'throttle_max_delay': 10.0
+}
+
+# 请求结果
+OUTCOME_OK = 'ok'
+OUTCOME_THROTTLED = 'throttled'  # 429
+OUTCOME_OVERLOAD = 'overload'  # 5xx、超时
+OUTCOME_ERROR = 'error'  # 其他错误（不影响并发上限）
+
+
+class TokenBucket:
+    """请求速率令牌桶（异步），rate为每秒令牌数，rate<=0时只在暂停期间阻塞"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """等待并取得一个令牌，返回等待的秒数"""
+        start = time.monotonic()
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if self.rate <= 0:
+                return now - start
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return now - start
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """暂停发放令牌（被限流后），暂停结束时令牌桶为空，从零开始积累"""
+        now = time.monotonic()
+        self._refill(now)
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+
+    def stats(self):
+        return {
+            'rate_per_second': round(self.rate, 3),
+            'burst': self.burst,
+            'tokens': round(self.tokens, 2),
+            'paused_for': round(max(0.0, self.paused_until - time.monotonic()), 2)
+        }
+
+
+class AIMDLimiter:
+    """加性增/乘性减的并发上限（异步），等待中的请求按先后顺序获得名额"""
+
+    def __init__(self, max_limit, min_limit=1, initial=None, adaptive=True, latency_tolerance=2.0,
+                 overload_backoff=0.5, latency_backoff=0.9):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial or self.max_limit)))
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.overload_backoff = overload_backoff
+        self.latency_backoff = latency_backoff
+
+        self.in_flight = 0
+        self._waiters = deque()
+        self._loop = None
+        self.baseline_latency = None  # 近期最低延迟（秒），缓慢上漂以适应模型/负载变化
+        self._last_decrease = 0.0
+
+        # 统计信息
+        self.increases = 0
+        self.decreases = 0
+        self.min_seen = self.limit
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环变化（如 analyze_batch 每次新建循环），旧循环上的等待者已失效
+            self._loop = loop
+            self._waiters.clear()
+            self.in_flight = 0
+
+        if self.in_flight < self.current_limit and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()  # 名额已分配但调用方已取消
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.current_limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, outcome, latency):
+        """请求结束：按结果和延迟调整并发上限，再释放名额"""
+        if self.adaptive:
+            self._adjust(outcome, latency)
+        self._release_slot()
+
+    def _adjust(self, outcome, latency):
+        if outcome == OUTCOME_OK:
+            if self.baseline_latency is None or latency < self.baseline_latency:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency += (latency - self.baseline_latency) * 0.01
+            if latency > self.baseline_latency * self.latency_tolerance:
+                self._decrease(self.latency_backoff)
+            elif self.limit < self.max_limit:
+                # 每个名额成功一次约增加 1/limit，即每轮请求并发上限 +1
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.increases += 1
+        elif outcome in (OUTCOME_THROTTLED, OUTCOME_OVERLOAD):
+            self._decrease(self.overload_backoff)
+
+    def _decrease(self, factor):
+        # 同一批在途请求的多个失败只下调一次（窗口为基线延迟）
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline_latency or 1.0) or self.limit <= self.min_limit:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.min_seen = min(self.min_seen, self.limit)
+        self.decreases += 1
+        print(f"📉 云端并发上限下调为 {self.current_limit}")
+
+    def stats(self):
+        return {
+            'adaptive': self.adaptive,
+            'limit': self.current_limit,
+            'limit_exact': round(self.limit, 2),
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'in_flight': self.in_flight,
+            'waiting': len(self._waiters),
+            'baseline_latency_ms': round(self.baseline_latency * 1000, 1) if self.baseline_latency else None,
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'lowest_limit': max(self.min_limit, int(self.min_seen))
+        }
+
+
+class QuotaScheduler:
+    """云端请求调度：并发名额（AIMD）+ 速率许可（令牌桶）+ 限流后暂停"""
+
+    def __init__(self, limiter, bucket, throttle_max_wait=60.0, throttle_base_delay=1.0, throttle_max_delay=10.0):
+        self.limiter = limiter
+        self.bucket = bucket
+        self.throttle_max_wait = throttle_max_wait
+        self.throttle_base_delay = throttle_base_delay
+        self.throttle_max_delay = throttle_max_delay
+        self.consecutive_throttles = 0
+
+        # 统计信息
+        self.throttled = 0
+        self.requeued = 0
+        self.gave_up = 0
+        self.avg_queue_wait_ms = 0.0
+        self.acquired = 0
+
+    @classmethod
+    def from_config(cls, config=None, max_concurrency=4):
+        config = dict(DEFAULT_QUOTA_CONFIG, **(config or {}))
+        limiter = AIMDLimiter(max_concurrency, min_limit=config['min_concurrency'],
+                              initial=config['initial_concurrency'], adaptive=config['adaptive_concurrency'],
+                              latency_tolerance=config['latency_tolerance'],
+                              overload_backoff=config['overload_backoff'], latency_backoff=config['latency_backoff'])
+        bucket = TokenBucket(config['rate_limit_rpm'] / 60.0, config['rate_limit_burst'])
+        return cls(limiter, bucket, throttle_max_wait=config['throttle_max_wait'],
+                   throttle_base_delay=config['throttle_base_delay'], throttle_max_delay=config['throttle_max_delay'])
+
+    async def acquire(self):
+        """等待并发名额和速率许可（先占名额再取令牌，避免令牌在等待名额时浪费）"""
+        start = time.monotonic()
+        await self.limiter.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.limiter.release(OUTCOME_ERROR, 0.0)
+            raise
+        wait_ms = (time.monotonic() - start) * 1000
+        self.acquired += 1
+        self.avg_queue_wait_ms = wait_ms if self.acquired == 1 else self.avg_queue_wait_ms * 0.9 + wait_ms * 0.1
+
+    def release(self, outcome, latency):
+        if outcome == OUTCOME_OK:
+            self.consecutive_throttles = 0
+        self.limiter.release(outcome, latency)
+
+    def throttle(self, retry_after=None):
+        """记录一次限流并暂停令牌桶，返回暂停秒数"""
+        self.throttled += 1
+        self.consecutive_throttles += 1
+        if retry_after is not None:
+            delay = float(retry_after)
+        else:
+            delay = self.throttle_base_delay * (2 ** min(self.consecutive_throttles - 1, 6))
+            delay = random.uniform(delay * 0.5, delay)  # 抖动，避免所有请求同时恢复
+        delay = min(self.throttle_max_delay, max(0.0, delay))
+        self.bucket.pause(delay)
+        return delay
+
+    def stats(self):
+        return {
+            'concurrency': self.limiter.stats(),
+            'rate': self.bucket.stats(),
+            'throttled': self.throttled,
+            'requeued': self.requeued,
+            'gave_up': self.gave_up,
+            'avg_queue_wait_ms': round(self.avg_queue_wait_ms, 1)
+        }
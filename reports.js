@@ -6,6 +6,8 @@ class ReportManager {
     constructor() {
         this.reportContent = document.getElementById('report-content');
         this.currentReports = [];
+        this.pendingAnalyses = {};  // 流式分析中已收到的字段，按植株ID保存
+        this.codebook = null;  // 紧凑模式代码表（连接建立时由后端下发）
         this.initReportControls();
     }
 
@@ -25,20 +27,95 @@ class ReportManager {
         }
     }
 
+    /**
+     * 设置紧凑模式代码表
+     */
+    setCodebook(codebook) {
+        this.codebook = codebook;
+        console.log(`📖 分析代码表 v${codebook.version} 已加载`);
+    }
+
+    /**
+     * 按代码表把紧凑模式结果展开为完整报告的结构
+     */
+    expandCompactAnalysis(analysis) {
+        const book = this.codebook;
+        const codes = analysis.codes || {};
+        if (!book) {
+            return Object.assign({}, analysis, { recommendations: ['代码表未加载，无法展开详细内容'] });
+        }
+
+        const crop = codes.crop ? book.crops[codes.crop.code] : null;
+        const diseases = (codes.diseases || []).filter(item => book.diseases[item.code]).map(item =>
+            Object.assign({}, book.diseases[item.code], { probability: item.probability, severity: item.severity }));
+        const deficiencies = (codes.deficiencies || []).filter(item => book.nutrients[item.code]).map(item =>
+            Object.assign({}, book.nutrients[item.code], { severity: item.severity }));
+        const envIssues = (codes.issues || []).filter(item => book.issues[item.code]).map(item =>
+            Object.assign({}, book.issues[item.code], { severity: item.severity }));
+
+        const issues = [];
+        let recommendations = [];
+        diseases.forEach(disease => {
+            issues.push({
+                type: `植物病害 - ${disease.name}`,
+                description: `${disease.symptoms} (发生概率: ${disease.probability}%)`,
+                severity: disease.severity,
+                solution: disease.treatment,
+                prevention: disease.prevention
+            });
+            recommendations = recommendations.concat(disease.recommendations || []);
+        });
+        deficiencies.forEach(deficiency => {
+            issues.push({
+                type: `营养缺乏 - ${deficiency.nutrient}`,
+                description: deficiency.symptoms,
+                severity: deficiency.severity,
+                solution: deficiency.treatment
+            });
+            recommendations = recommendations.concat(deficiency.recommendations || []);
+        });
+        envIssues.forEach(issue => {
+            issues.push(issue);
+            recommendations = recommendations.concat(issue.recommendations || []);
+        });
+
+        return Object.assign({}, analysis, {
+            crop_type: crop ? Object.assign({ confidence: codes.crop.confidence }, crop) : {},
+            growth_stage: book.stages[codes.stage] || {},
+            diseases: diseases,
+            nutrition_status: {
+                summary: deficiencies.length > 0
+                    ? `检测到${deficiencies.map(item => item.nutrient).join('、')}缺乏症状，建议及时补充`
+                    : '未发现明显的营养缺乏',
+                deficiencies: deficiencies
+            },
+            issues: issues,
+            recommendations: recommendations.length > 0 ? recommendations : book.healthy_recommendations
+        });
+    }
+
     /**
      * 显示AI分析结果
      */
     displayAnalysis(analysisData) {
         try {
             console.log('显示AI分析结果:', analysisData);
+            if (analysisData.analysis && analysisData.analysis.analysis_profile === 'compact') {
+                analysisData = Object.assign({}, analysisData, {
+                    analysis: this.expandCompactAnalysis(analysisData.analysis)
+                });
+            }
 
             const plantId = analysisData.plant_id || '未知';
             const analysis = analysisData.analysis || {};
             const timestamp = analysisData.timestamp || new Date().toISOString();
+            delete this.pendingAnalyses[plantId];
 
-            // 添加到报告列表
+            // 添加到报告列表（画面无变化时后端复用上次结果，不计入分析次数）
             this.currentReports.push(analysisData);
-            ui.incrementAnalyzedCount();
+            if (!analysisData.reused) {
+                ui.incrementAnalyzedCount();
+            }
 
             // 生成HTML报告
             const reportHTML = this.generateReportHTML(analysisData);
@@ -46,13 +123,23 @@ class ReportManager {
             // 更新报告内容
             this.reportContent.innerHTML = reportHTML;
 
+            // 植株ID来自QR码内容，不拼进内联脚本，按钮事件在这里绑定
+            const fullAnalysisBtn = this.reportContent.querySelector('.full-analysis-btn');
+            if (fullAnalysisBtn) {
+                fullAnalysisBtn.addEventListener('click', () => api.requestFullAnalysis(plantId));
+            }
+
             // 添加动画效果
             this.reportContent.classList.add('slide-in');
             setTimeout(() => {
                 this.reportContent.classList.remove('slide-in');
             }, 300);
 
-            ui.addLog('success', `植株 ${plantId} 的AI分析报告已生成`);
+            if (analysisData.reused) {
+                ui.addLog('info', `植株 ${plantId} 画面无明显变化，沿用上次分析结果`);
+            } else {
+                ui.addLog('success', `植株 ${plantId} 的AI分析报告已生成`);
+            }
 
         } catch (error) {
             console.error('显示分析结果失败:', error);
@@ -60,6 +147,77 @@ class ReportManager {
         }
     }
 
+    /**
+     * 显示流式分析的阶段性结果（完整报告到达前）
+     */
+    displayProgress(progressData) {
+        try {
+            const plantId = progressData.plant_id || '未知';
+            const fields = progressData.fields || {};
+            const partial = Object.assign(this.pendingAnalyses[plantId] || {}, fields);
+            this.pendingAnalyses[plantId] = partial;
+
+            if (fields.health_score !== undefined) {
+                ui.addLog('info', `植株 ${plantId} 初步健康评分: ${fields.health_score}/100`);
+            }
+            this.reportContent.innerHTML = this.generateProgressHTML(plantId, partial);
+        } catch (error) {
+            console.error('显示分析进度失败:', error);
+        }
+    }
+
+    /**
+     * 生成分析进度HTML（只显示已收到的字段）
+     */
+    generateProgressHTML(plantId, partial) {
+        const hasScore = partial.health_score !== undefined;
+        const scoreStyle = this.getHealthScoreStyle(partial.health_score || 0);
+        const urgencyStyle = this.getUrgencyStyle(partial.urgency);
+        const cropType = partial.crop_type || {};
+
+        return `
+<div class="ai-report">
+    <div class="report-header-section">
+        <div class="report-title">
+            <i class="fas fa-spinner fa-spin"></i>
+            <h2>AI分析进行中</h2>
+            <span class="report-badge">植株 ${plantId}</span>
+        </div>
+    </div>
+
+    <div class="health-score-section">
+        <h3><i class="fas fa-heartbeat"></i> 健康评估</h3>
+        <div class="score-display" style="${hasScore ? scoreStyle.background : ''}">
+            <div class="score-value">${hasScore ? partial.health_score : '--'}</div>
+            <div class="score-label">健康评分</div>
+            <div class="score-status" style="color: ${scoreStyle.color}">${hasScore ? scoreStyle.status : '等待中'}</div>
+        </div>
+        ${partial.urgency ? `
+        <div class="urgency-badge" style="${urgencyStyle.style}">
+            <i class="${urgencyStyle.icon}"></i>
+            <span>紧急程度: ${partial.urgency.toUpperCase()}</span>
+        </div>` : ''}
+    </div>
+
+    ${cropType.name ? `<p><strong>作物类型:</strong> ${cropType.name}</p>` : ''}
+    ${partial.analysis_summary ? `<p>${partial.analysis_summary}</p>` : ''}
+</div>`;
+    }
+
+    /**
+     * 分析结果来源层级（本地分级 / 云端模型 / 云端不可用时的本地回退）
+     */
+    getAnalysisTierInfo(tier) {
+        switch (tier) {
+            case 'local':
+                return { type: '本地特征分级', service: '本地分析' };
+            case 'local_fallback':
+                return { type: '本地分析（云端不可用）', service: '本地分析' };
+            default:
+                return { type: '专业农业AI', service: '阿里云百炼' };
+        }
+    }
+
     /**
      * 生成报告HTML
      */
@@ -83,6 +241,7 @@ class ReportManager {
         const issues = analysis.issues || [];
         const recommendations = analysis.recommendations || [];
         const imageFeatures = analysis.image_features || {};
+        const tierInfo = this.getAnalysisTierInfo(analysis.analysis_tier);
 
         // 健康评分样式
         const scoreStyle = this.getHealthScoreStyle(healthScore);
@@ -100,6 +259,10 @@ class ReportManager {
         <div class="report-meta">
             <span class="analysis-id">分析ID: ${analysisId}</span>
             <span class="timestamp">${new Date(analysisTime).toLocaleString()}</span>
+            ${analysis.analysis_profile === 'compact' ? `
+            <button class="btn btn-secondary full-analysis-btn">
+                <i class="fas fa-file-alt"></i> 完整分析
+            </button>` : ''}
         </div>
     </div>
 
@@ -117,11 +280,11 @@ class ReportManager {
             </div>
             <div class="info-item">
                 <span class="label">分析类型:</span>
-                <span class="value">专业农业AI</span>
+                <span class="value">${tierInfo.type}${analysisData.reused ? '（画面无变化，沿用上次结果）' : ''}</span>
             </div>
             <div class="info-item">
                 <span class="label">AI服务:</span>
-                <span class="value">阿里云百炼</span>
+                <span class="value">${tierInfo.service}</span>
             </div>
         </div>
     </div>
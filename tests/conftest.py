@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具：后端模块位于仓库根目录，云端相关测试都对接本地模拟服务器（mock_dashscope_server.py）
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crop_analyzer_dashscope import CropAnalyzer  # noqa: E402
+from mock_dashscope_server import start_mock_server  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    server = start_mock_server(delay=0.0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def plant_image():
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    image[:] = (40, 140, 60)
+    return image
+
+
+def make_analyzer(server, **config):
+    """对接模拟服务器的分析器：重试等待缩短到毫秒级，其余配置按参数覆盖"""
+    settings = {
+        'base_url': server.base_url,
+        'retry_base_delay': 0.01,
+        'retry_max_delay': 0.02
+    }
+    settings.update(config)
+    return CropAnalyzer('test-key', config=settings)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+云端调用的重试预算、熔断器和截止时间（对接本地模拟服务器注入错误和延迟）
+"""
+
+import asyncio
+import time
+
+from circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+from crop_analyzer_dashscope import TIER_CLOUD, TIER_LOCAL_FALLBACK
+
+from conftest import make_analyzer
+
+
+def analyze(analyzer, image, times=1):
+    """依次分析times次（跳过本地分级，直接走云端路径），返回结果列表"""
+    async def run():
+        try:
+            return [await analyzer.analyze_crop_health_async(image, triage=False) for _ in range(times)]
+        finally:
+            await analyzer.close()
+
+    return asyncio.run(run())
+
+
+def test_retry_budget_limits_attempts(mock_server, plant_image):
+    mock_server.error_rate = 1.0
+    analyzer = make_analyzer(mock_server, retry_max_attempts=3, breaker_failure_threshold=10)
+
+    result, = analyze(analyzer, plant_image)
+
+    assert mock_server.request_count == 3
+    assert result['status'] == 'ok'
+    assert result['analysis_tier'] == TIER_LOCAL_FALLBACK
+
+
+def test_breaker_opens_after_consecutive_failures(mock_server, plant_image):
+    mock_server.error_rate = 1.0
+    analyzer = make_analyzer(mock_server, retry_max_attempts=1, breaker_failure_threshold=2,
+                             breaker_recovery_timeout=60.0)
+
+    results = analyze(analyzer, plant_image, times=3)
+
+    # 前两次各请求一次后熔断器打开，第三次不再请求云端
+    assert mock_server.request_count == 2
+    assert analyzer.circuit_breaker.state == STATE_OPEN
+    assert analyzer.circuit_breaker.stats()['rejected'] == 1
+    assert [result['analysis_tier'] for result in results] == [TIER_LOCAL_FALLBACK] * 3
+
+
+def test_half_open_probe_success_closes_breaker(mock_server, plant_image):
+    mock_server.error_rate = 1.0
+    analyzer = make_analyzer(mock_server, retry_max_attempts=1, breaker_failure_threshold=1,
+                             breaker_recovery_timeout=0.2)
+    analyze(analyzer, plant_image)
+    assert analyzer.circuit_breaker.state == STATE_OPEN
+
+    mock_server.error_rate = 0.0
+    time.sleep(0.3)
+    states = []
+    analyzer.circuit_breaker.on_state_change = lambda status: states.append(status['state'])
+
+    result, = analyze(analyzer, plant_image)
+
+    assert states == [STATE_HALF_OPEN, STATE_CLOSED]
+    assert result['analysis_tier'] == TIER_CLOUD
+    assert analyzer.circuit_breaker.state == STATE_CLOSED
+
+
+def test_half_open_probe_failure_reopens_breaker(mock_server, plant_image):
+    mock_server.error_rate = 1.0
+    analyzer = make_analyzer(mock_server, retry_max_attempts=3, breaker_failure_threshold=1,
+                             breaker_recovery_timeout=0.2)
+    analyze(analyzer, plant_image)
+    requests_before = mock_server.request_count
+    time.sleep(0.3)
+
+    result, = analyze(analyzer, plant_image)
+
+    # 半开状态只放行一个探测请求，失败后立即重新打开，不再重试
+    assert mock_server.request_count == requests_before + 1
+    assert analyzer.circuit_breaker.state == STATE_OPEN
+    assert result['analysis_tier'] == TIER_LOCAL_FALLBACK
+
+
+def test_deadline_falls_back_to_local(mock_server, plant_image):
+    mock_server.delay = 2.0
+    analyzer = make_analyzer(mock_server, analysis_deadline=0.5, breaker_failure_threshold=10)
+
+    start = time.monotonic()
+    result, = analyze(analyzer, plant_image)
+    elapsed = time.monotonic() - start
+
+    # 剩余时间不足一次尝试（RetryPolicy.min_attempt_time）时不再重试
+    assert mock_server.request_count == 1
+    assert result['status'] == 'ok'
+    assert result['analysis_tier'] == TIER_LOCAL_FALLBACK
+    assert elapsed < 1.5
+
+
+def test_cancelled_half_open_probe_releases_its_slot(mock_server, plant_image):
+    mock_server.error_rate = 1.0
+    analyzer = make_analyzer(mock_server, retry_max_attempts=1, breaker_failure_threshold=1,
+                             breaker_recovery_timeout=0.1)
+    analyze(analyzer, plant_image)
+    assert analyzer.circuit_breaker.state == STATE_OPEN
+
+    mock_server.error_rate = 0.0
+    mock_server.delay = 3.0
+    time.sleep(0.2)
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(analyzer.analyze_crop_health_async(plant_image, triage=False))
+        await asyncio.sleep(0.3)
+        assert analyzer.circuit_breaker.state == STATE_HALF_OPEN
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+        await analyzer.close()
+
+    asyncio.run(cancel_probe())
+
+    # 被取消的探测不算失败，也不能占住探测名额
+    assert analyzer.circuit_breaker.state == STATE_HALF_OPEN
+    mock_server.delay = 0.0
+    result, = analyze(analyzer, plant_image)
+    assert result['analysis_tier'] == TIER_CLOUD
+    assert analyzer.circuit_breaker.state == STATE_CLOSED
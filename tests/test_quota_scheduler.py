@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+配额调度：令牌桶限速、遇到429时AIMD下调并发上限并重新排队、恢复后并发上限回升
+（对接模拟服务器的限流配额模式）
+"""
+
+import asyncio
+import time
+
+from circuit_breaker import STATE_CLOSED
+from crop_analyzer_dashscope import TIER_CLOUD, TIER_LOCAL_FALLBACK
+from quota_scheduler import OUTCOME_OK, OUTCOME_THROTTLED, AIMDLimiter, TokenBucket
+
+from conftest import make_analyzer
+
+# 限流后的暂停缩短到毫秒级
+FAST_THROTTLE = {'throttle_base_delay': 0.05, 'throttle_max_delay': 0.2, 'latency_tolerance': 10.0}
+
+
+def analyze_concurrently(analyzer, image, count):
+    async def run():
+        try:
+            return await asyncio.gather(*[analyzer.analyze_crop_health_async(image, triage=False)
+                                          for _ in range(count)])
+        finally:
+            await analyzer.close()
+
+    return asyncio.run(run())
+
+
+def test_token_bucket_paces_acquires():
+    bucket = TokenBucket(rate=20.0, burst=1)
+
+    async def run():
+        start = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 第一个令牌立即可用，之后每个间隔 1/20 秒
+    assert 0.2 <= asyncio.run(run()) < 0.5
+
+
+def test_token_bucket_keeps_client_under_server_quota(mock_server, plant_image):
+    mock_server.rate_limit_rpm = 660
+    mock_server.rate_limit_burst = 2
+    analyzer = make_analyzer(mock_server, quota=dict(FAST_THROTTLE, rate_limit_rpm=600, rate_limit_burst=1))
+
+    start = time.monotonic()
+    results = analyze_concurrently(analyzer, plant_image, 8)
+    elapsed = time.monotonic() - start
+
+    assert mock_server.throttled_count == 0
+    assert elapsed >= 7 / 10.0 * 0.9
+    assert all(result['analysis_tier'] == TIER_CLOUD for result in results)
+
+
+def test_throttled_requests_are_requeued_and_concurrency_decreases(mock_server, plant_image):
+    mock_server.delay = 0.1
+    mock_server.max_concurrent = 1
+    analyzer = make_analyzer(mock_server, max_concurrency=4, quota=dict(FAST_THROTTLE))
+
+    results = analyze_concurrently(analyzer, plant_image, 8)
+    quota = analyzer.get_client_stats()['quota']
+
+    assert mock_server.throttled_count > 0
+    assert quota['concurrency']['decreases'] >= 1
+    assert quota['concurrency']['lowest_limit'] < 4
+    assert quota['requeued'] > 0 and quota['gave_up'] == 0
+    # 429没有变成本地回退
+    assert all(result['analysis_tier'] == TIER_CLOUD for result in results)
+
+
+def test_throttle_beyond_max_wait_falls_back_to_local(mock_server, plant_image):
+    mock_server.rate_limit_rpm = 1
+    mock_server.rate_limit_burst = 1
+    analyzer = make_analyzer(mock_server, retry_max_attempts=1,
+                             quota=dict(FAST_THROTTLE, throttle_max_wait=0.3))
+
+    results = analyze_concurrently(analyzer, plant_image, 2)
+
+    assert sorted(result['analysis_tier'] for result in results) == [TIER_CLOUD, TIER_LOCAL_FALLBACK]
+    assert analyzer.get_client_stats()['quota']['gave_up'] == 1
+
+
+def test_throttle_give_up_does_not_trip_breaker(mock_server, plant_image):
+    mock_server.rate_limit_rpm = 1
+    mock_server.rate_limit_burst = 1
+    analyzer = make_analyzer(mock_server, retry_max_attempts=3, breaker_failure_threshold=1,
+                             quota=dict(FAST_THROTTLE, throttle_max_wait=0.3))
+
+    results = analyze_concurrently(analyzer, plant_image, 2)
+
+    # 限流不算云端故障：熔断器保持关闭；调度器已重新排队到上限，放弃后不再重试
+    assert sorted(result['analysis_tier'] for result in results) == [TIER_CLOUD, TIER_LOCAL_FALLBACK]
+    assert analyzer.circuit_breaker.state == STATE_CLOSED
+    assert analyzer.circuit_breaker.consecutive_failures == 0
+    assert analyzer.get_client_stats()['quota']['gave_up'] == 1
+
+
+def test_concurrency_recovers_after_throttling(mock_server, plant_image):
+    mock_server.delay = 0.05
+    mock_server.max_concurrent = 1
+    analyzer = make_analyzer(mock_server, max_concurrency=4, quota=dict(FAST_THROTTLE))
+    analyze_concurrently(analyzer, plant_image, 8)
+    limiter = analyzer.async_client.scheduler.limiter
+    assert limiter.current_limit < 4
+
+    mock_server.max_concurrent = 0
+    analyze_concurrently(analyzer, plant_image, 16)
+
+    assert limiter.current_limit == 4
+
+
+def test_aimd_limiter_halves_on_throttle_and_grows_additively():
+    limiter = AIMDLimiter(8, latency_tolerance=10.0)
+
+    async def succeed(times):
+        for _ in range(times):
+            await limiter.acquire()
+            limiter.release(OUTCOME_OK, 0.1)
+
+    async def run():
+        await succeed(1)
+        await limiter.acquire()
+        limiter.release(OUTCOME_THROTTLED, 0.1)
+        after_throttle = limiter.limit
+        # 每次成功约 +1/limit：一轮（limit次）成功后增加不到1，而不是翻倍
+        await succeed(4)
+        after_round = limiter.limit
+        await succeed(30)
+        return after_throttle, after_round, limiter.current_limit
+
+    after_throttle, after_round, recovered = asyncio.run(run())
+    assert after_throttle == 4
+    assert 4.5 < after_round < 5
+    assert recovered == 8
+
+
+def test_model_latency_excludes_quota_wait(mock_server, plant_image):
+    mock_server.delay = 0.05
+    analyzer = make_analyzer(mock_server, quota=dict(FAST_THROTTLE, rate_limit_rpm=120, rate_limit_burst=1))
+
+    analyze_concurrently(analyzer, plant_image, 4)
+    model_stats = analyzer.get_router_stats()['models'][analyzer.model_name]
+
+    # 令牌每0.5秒一个，后面的请求依次排队约0.5/1.0/1.5秒，模型延迟只计请求发出之后的部分
+    assert model_stats['max_latency_ms'] < 400
+    assert model_stats['avg_queue_wait_ms'] > 200
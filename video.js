@@ -99,6 +99,17 @@ class VideoManager {
                     this.updateFrameStats();
                 };
                 img.src = frameData.startsWith('data:') ? frameData : `data:image/jpeg;base64,${frameData}`;
+            } else if (frameData instanceof Blob) {
+                // 二进制协议的JPEG帧
+                const url = URL.createObjectURL(frameData);
+                const img = new Image();
+                img.onload = () => {
+                    this.drawFrame(img);
+                    this.updateFrameStats();
+                    URL.revokeObjectURL(url);
+                };
+                img.onerror = () => URL.revokeObjectURL(url);
+                img.src = url;
             } else if (frameData instanceof ImageData) {
                 // 如果是ImageData，直接绘制
                 this.ctx.putImageData(frameData, 0, 0);
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+视频流多级流水线
+采集 → 检测 → 编码 → 广播，每个阶段独立线程运行，
+阶段之间使用有界队列（最新帧优先：队列满时丢弃最旧帧）
+"""
+
+import struct
+import threading
+import time
+import traceback
+from collections import deque
+
+# 二进制视频帧协议
+# 头部为小端序定长结构，后面紧跟原始JPEG字节：
+#   magic(4s) version(B) flags(B) header_len(H) seq(I) timestamp(d) fps(f) width(H) height(H)
+# flags 字段为该帧的视频质量档位编号（0为最高质量）
+BINARY_FRAME_MAGIC = b'TTVF'
+BINARY_FRAME_VERSION = 1
+BINARY_FRAME_HEADER = struct.Struct('<4sBBHIdfHH')
+
+
+def pack_binary_frame(seq, timestamp, fps, width, height, jpeg_bytes, flags=0):
+    """打包二进制视频帧：定长头部 + JPEG字节"""
+    header = BINARY_FRAME_HEADER.pack(
+        BINARY_FRAME_MAGIC,
+        BINARY_FRAME_VERSION,
+        flags,
+        BINARY_FRAME_HEADER.size,
+        seq & 0xFFFFFFFF,
+        timestamp,
+        fps,
+        width,
+        height
+    )
+    return header + jpeg_bytes
+
+
+def unpack_binary_frame(payload):
+    """解析二进制视频帧，返回头部字段和JPEG字节"""
+    if len(payload) < BINARY_FRAME_HEADER.size:
+        raise ValueError("二进制帧长度不足")
+
+    magic, version, flags, header_len, seq, timestamp, fps, width, height = \
+        BINARY_FRAME_HEADER.unpack_from(payload)
+    if magic != BINARY_FRAME_MAGIC:
+        raise ValueError("二进制帧标识错误")
+
+    return {
+        'version': version,
+        'flags': flags,
+        'seq': seq,
+        'timestamp': timestamp,
+        'fps': fps,
+        'width': width,
+        'height': height,
+        'jpeg': bytes(payload[header_len:])
+    }
+
+
+class LatestFrameQueue:
+    """有界帧队列 - 满时丢弃最旧元素，保证消费者总是拿到最新帧"""
+
+    def __init__(self, name, maxsize=1):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # 统计信息
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped_count = 0
+
+    def put(self, item):
+        """放入元素，队列已满时丢弃最旧的元素"""
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped_count += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """取出最旧的待处理元素，超时或队列关闭时返回None"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            self.get_count += 1
+            return self._items.popleft()
+
+    def clear(self):
+        with self._cond:
+            self._items.clear()
+
+    def close(self):
+        """关闭队列并唤醒所有等待者"""
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            'depth': len(self._items),
+            'capacity': self.maxsize,
+            'put': self.put_count,
+            'get': self.get_count,
+            'dropped': self.dropped_count
+        }
+
+
+class PipelineStage:
+    """流水线阶段 - 从输入队列取元素，处理后放入所有输出队列"""
+
+    def __init__(self, name, handler, input_queue=None, output_queues=None,
+                 poll_timeout=0.1, interval=None):
+        self.name = name
+        self.handler = handler
+        self.input_queue = input_queue
+        self.output_queues = list(output_queues or [])
+        self.poll_timeout = poll_timeout
+        self.interval = interval  # 源阶段的调用间隔（秒）
+
+        self.thread = None
+        self.running = False
+
+        # 统计信息
+        self.processed_count = 0
+        self.error_count = 0
+        self.avg_process_ms = 0.0
+        self.last_error = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def join(self, timeout=None):
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        while self.running:
+            try:
+                if self.input_queue is not None:
+                    item = self.input_queue.get(timeout=self.poll_timeout)
+                    if item is None:
+                        continue
+                    start_time = time.perf_counter()
+                    result = self.handler(item)
+                    self._record_latency(start_time)
+                else:
+                    # 源阶段（如采集）没有输入队列，按固定间隔调用handler
+                    if self.interval:
+                        time.sleep(self.interval)
+                    start_time = time.perf_counter()
+                    result = self.handler()
+                    if result is not None:
+                        self._record_latency(start_time)
+
+                if result is None:
+                    continue
+
+                for queue in self.output_queues:
+                    queue.put(result)
+
+            except Exception as e:
+                self.error_count += 1
+                self.last_error = str(e)
+                print(f"❌ 流水线阶段[{self.name}]错误: {e}")
+                traceback.print_exc()
+                time.sleep(0.5)
+
+    def _record_latency(self, start_time):
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.processed_count += 1
+        # 指数滑动平均，避免单帧抖动影响统计
+        if self.processed_count == 1:
+            self.avg_process_ms = elapsed_ms
+        else:
+            self.avg_process_ms = self.avg_process_ms * 0.9 + elapsed_ms * 0.1
+
+    def stats(self):
+        stats = {
+            'alive': self.is_alive(),
+            'processed': self.processed_count,
+            'errors': self.error_count,
+            'avg_process_ms': round(self.avg_process_ms, 2),
+            'last_error': self.last_error
+        }
+        if self.input_queue is not None:
+            stats['queue'] = self.input_queue.stats()
+        return stats
+
+
+class VideoPipeline:
+    """多级视频流水线 - 管理各阶段线程和阶段间队列"""
+
+    def __init__(self, name='video'):
+        self.name = name
+        self.stages = []
+        self.queues = []
+
+    def create_queue(self, name, maxsize=1):
+        queue = LatestFrameQueue(name, maxsize)
+        self.queues.append(queue)
+        return queue
+
+    def add_stage(self, name, handler, input_queue=None, output_queues=None, interval=None):
+        stage = PipelineStage(name, handler, input_queue, output_queues, interval=interval)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2.0):
+        for stage in self.stages:
+            stage.stop()
+        for queue in self.queues:
+            queue.close()
+
+        deadline = time.time() + timeout
+        for stage in self.stages:
+            stage.join(timeout=max(0.0, deadline - time.time()))
+
+    def is_alive(self):
+        return any(stage.is_alive() for stage in self.stages)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'stages': {stage.name: stage.stats() for stage in self.stages}
+        }